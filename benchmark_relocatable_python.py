@@ -0,0 +1,777 @@
+#!/usr/bin/python3
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tool to time the relocation pipeline on generated frameworks, on any
+platform, and to flag regressions against earlier runs"""
+
+from __future__ import print_function
+
+import builtins
+import contextlib
+import datetime
+import io
+import json
+import optparse
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+from locallibs import macho, synthetic
+from locallibs.fix import (ensure_current_version_link, fix_broken_signatures,
+                           fix_script_shebangs)
+from locallibs.inventory import HEAD_SIZE, Inventory
+from locallibs.pipeline import Pipeline
+from locallibs.precompile import precompile
+from locallibs.relocatablizer import (analyze, apply_relocation, fix_modes,
+                                      executable_rpath, plan_edits,
+                                      plan_relocation, relativize_install_name,
+                                      relocatablize)
+from locallibs.thin import thin_framework
+from locallibs.zipstdlib import zip_path, zip_stdlib
+
+VERSION = "3.11"
+OTOOL = "/usr/bin/otool"
+# how many earlier runs with the same parameters make up the baseline
+BASELINE_RUNS = 5
+# what the import benchmarks import, along with everything they import
+IMPORT_MODULES = (
+    "argparse", "datetime", "email.message", "http.client", "json",
+    "logging", "subprocess", "tempfile", "textwrap", "zipfile",
+)
+# prints the top-level stdlib modules that importing argv[1] loads
+IMPORT_CLOSURE_SCRIPT = """
+import sys, sysconfig
+for name in sys.argv[1].split(","):
+    __import__(name)
+stdlib = sysconfig.get_paths()["stdlib"]
+for module in list(sys.modules.values()):
+    path = getattr(module, "__file__", None) or ""
+    if path.startswith(stdlib + "/"):
+        print(path[len(stdlib) + 1:].split("/")[0])
+"""
+# imports argv[2] with sys.path set to argv[1] and the interpreter's
+# lib-dynload, and prints the import time and the stat, open and listdir
+# calls the import system made
+IMPORT_SCRIPT = """
+import sys, time
+from importlib import _bootstrap_external
+counts = {"stat": 0, "open": 0, "listdir": 0}
+path_stat = _bootstrap_external._path_stat
+def counting_stat(path):
+    counts["stat"] += 1
+    return path_stat(path)
+def hook(event, args):
+    if event == "open":
+        counts["open"] += 1
+    elif event in ("os.listdir", "os.scandir"):
+        counts["listdir"] += 1
+dynload = [path for path in sys.path if path.endswith("lib-dynload")]
+sys.path[:] = sys.argv[1].split(":") + dynload
+sys.path_importer_cache.clear()
+_bootstrap_external._path_stat = counting_stat
+sys.addaudithook(hook)
+start = time.perf_counter()
+for name in sys.argv[2].split(","):
+    __import__(name)
+seconds = time.perf_counter() - start
+print(seconds, counts["stat"], counts["open"], counts["listdir"])
+"""
+# benchmark name -> {call: count} for benchmarks that count filesystem
+# calls as well as time
+FS_CALLS = {}
+
+
+class CountingScandir(object):
+    """Wraps an os.scandir iterator so the stat calls made on its entries
+    are counted"""
+
+    def __init__(self, iterator, counts):
+        self.iterator = iterator
+        self.counts = counts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return CountingEntry(next(self.iterator), self.counts)
+
+    def close(self):
+        """Closes the wrapped iterator"""
+        self.iterator.close()
+
+
+class CountingEntry(object):
+    """A DirEntry whose stat calls are counted"""
+
+    def __init__(self, dir_entry, counts):
+        self.dir_entry = dir_entry
+        self.counts = counts
+
+    def __getattr__(self, name):
+        return getattr(self.dir_entry, name)
+
+    def stat(self, follow_symlinks=True):
+        """Counts the call, which costs a syscall outside Windows"""
+        self.counts["stat" if follow_symlinks else "lstat"] += 1
+        return self.dir_entry.stat(follow_symlinks=follow_symlinks)
+
+
+@contextlib.contextmanager
+def counting_fs_calls():
+    """Counts the lstat, stat, chmod, listdir (and scandir) and open calls
+    made through the os module and open() while in the context. Yields the
+    counts"""
+    counts = dict.fromkeys(("lstat", "stat", "chmod", "listdir", "open"), 0)
+    originals = {}
+
+    def counted(module, name, call, wrap=None):
+        """Replaces module.name with a version that counts calls as call"""
+        original = getattr(module, name)
+        originals[(module, name)] = original
+
+        def replacement(*args, **kwargs):
+            counts[call] += 1
+            result = original(*args, **kwargs)
+            return wrap(result) if wrap else result
+        setattr(module, name, replacement)
+
+    counted(os, "lstat", "lstat")
+    counted(os, "stat", "stat")
+    counted(os, "chmod", "chmod")
+    counted(os, "listdir", "listdir")
+    counted(os, "scandir", "listdir",
+            lambda iterator: CountingScandir(iterator, counts))
+    counted(builtins, "open", "open")
+    try:
+        yield counts
+    finally:
+        for (module, name), original in originals.items():
+            setattr(module, name, original)
+
+
+def timed_and_counted(name, func, framework_path):
+    """Times func(framework_path), then runs it again to count its
+    filesystem calls into FS_CALLS[name]. Returns the seconds"""
+    start = time.time()
+    func(framework_path)
+    seconds = time.time() - start
+    with counting_fs_calls() as counts:
+        func(framework_path)
+    FS_CALLS[name] = counts
+    return seconds
+
+
+def inventory_passes(framework_path):
+    """What the build does with one inventory: fix modes, read the head of
+    every file for analysis, and look for scripts in bin"""
+    inventory = Inventory(framework_path)
+    fix_modes(framework_path, inventory)
+    sum(len(entry.head) for entry in inventory.files())
+    bin_dir = os.path.join(framework_path, "Versions", VERSION, "bin")
+    [entry.head for entry in inventory.listdir(bin_dir)
+     if entry.kind == "file"]
+
+
+def walk_passes(framework_path):
+    """The separate walks the build made before it took an inventory:
+    chmod -R, then os.walk with islink and a read of every file for
+    analysis, a listdir of Versions, and a listdir of bin with islink,
+    isdir and a read of every entry for the shebangs"""
+    for dirpath, _dirs, files in os.walk(framework_path):
+        # chmod -R changes every entry, whether or not it needs it
+        for path in [dirpath] + [os.path.join(dirpath, filename)
+                                 for filename in files]:
+            mode = os.lstat(path).st_mode
+            if not stat.S_ISLNK(mode):
+                os.chmod(path, (stat.S_IMODE(mode) | 0o644) & ~0o022)
+    for dirpath, _dirs, files in os.walk(framework_path):
+        for filename in files:
+            path = os.path.join(dirpath, filename)
+            if os.path.islink(path):
+                continue
+            with open(path, "rb") as fileobj:
+                fileobj.read(HEAD_SIZE)
+    versions_dir = os.path.join(framework_path, "Versions")
+    [item for item in os.listdir(versions_dir)
+     if not os.path.islink(os.path.join(versions_dir, item))]
+    bin_dir = os.path.join(framework_path, "Versions", VERSION, "bin")
+    for filename in os.listdir(bin_dir):
+        path = os.path.join(bin_dir, filename)
+        if os.path.islink(path) or os.path.isdir(path):
+            continue
+        with open(path, "rb") as fileobj:
+            fileobj.readline()
+
+
+def bench_inventory(framework_path, jobs):
+    """Takes an inventory and makes the build's passes over it, counting
+    filesystem calls"""
+    return timed_and_counted("inventory", inventory_passes, framework_path)
+
+
+def bench_walk_baseline(framework_path, jobs):
+    """Makes the build's passes with separate walks, as it did before the
+    inventory, counting filesystem calls"""
+    return timed_and_counted("walk-baseline", walk_passes, framework_path)
+
+
+def bench_analyze(framework_path, jobs):
+    """Runs analyze() on an inventory taken beforehand"""
+    inventory = Inventory(framework_path)
+    start = time.time()
+    analyze(framework_path, jobs=jobs, inventory=inventory)
+    return time.time() - start
+
+
+def bench_analyze_otool(framework_path, jobs):
+    """Runs the otool commands analysis ran per Mach-O file before it read
+    load commands in-process, for comparison with analyze"""
+    inventory = Inventory(framework_path)
+    files = [entry.path for entry in inventory.files(framework_path)
+             if macho.file_type(entry.path, entry.head)]
+    start = time.time()
+    for path in files:
+        subprocess.check_output([OTOOL, "-D", path])
+        subprocess.check_output([OTOOL, "-L", path])
+        if macho.file_type(path) == macho.MH_EXECUTE:
+            subprocess.check_output([OTOOL, "-l", path])
+    return time.time() - start
+
+
+def scan_plan_edits(framework_data):
+    """Works out the same load command edits as plan_edits() the way
+    relocatablize did before analyze() indexed dependents: for every
+    renamed dylib, every Mach-O file is scanned for the old install name.
+    Kept as the baseline for the dylib sweep. Returns the plans"""
+    plans = {}
+    files = (framework_data["executables"] + framework_data["dylibs"]
+             + framework_data["so_files"])
+    for dylib in framework_data["dylibs"]:
+        old_install_name = dylib.install_name
+        new_install_name = relativize_install_name(
+            dylib.path, old_install_name)
+        if old_install_name != new_install_name:
+            plans.setdefault(
+                dylib.path, macho.RewritePlan()
+            ).set_install_name(new_install_name)
+            for item in files:
+                if old_install_name in item.dependencies:
+                    plans.setdefault(
+                        item.path, macho.RewritePlan()
+                    ).change(old_install_name, new_install_name)
+    for item in framework_data["executables"]:
+        rpath = executable_rpath(item.path)
+        if rpath not in item.rpaths:
+            plans.setdefault(item.path, macho.RewritePlan()).add_rpath(rpath)
+    return plans
+
+
+def best_time(func, repeat):
+    """Returns the best of repeat timings of func()"""
+    timings = []
+    for _index in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def bench_dylib_sweep(work_dir, count, links_per_file, repeat):
+    """Generates a framework with count dylibs and count extension modules,
+    each loading links_per_file of the dylibs, and times analyze() and
+    working out the edits with the dependents index and with the scan.
+    Returns {step: best seconds}"""
+    framework_path = synthetic.generate(
+        os.path.join(work_dir, "dylibs-%d" % count), version=VERSION,
+        dylibs=count, so_files=count, stdlib_files=0, scripts=0,
+        text_size=SWEEP_TEXT_SIZE, links_per_file=links_per_file)
+    inventory = Inventory(framework_path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            framework_data = analyze(framework_path, inventory=inventory)
+            return {
+                "analyze": best_time(
+                    lambda: analyze(framework_path, inventory=inventory),
+                    repeat),
+                "plan": best_time(lambda: plan_edits(framework_data),
+                                  repeat),
+                "scan": best_time(lambda: scan_plan_edits(framework_data),
+                                  repeat),
+            }
+    finally:
+        shutil.rmtree(os.path.dirname(framework_path), ignore_errors=True)
+
+
+def bench_relocatablize(framework_path, jobs):
+    """Runs relocatablize()"""
+    relocatablize(framework_path, jobs=jobs)
+
+
+def bench_apply_plan(framework_path, jobs):
+    """Runs apply_relocation() with a plan made beforehand"""
+    relocation_plan = plan_relocation(framework_path, jobs=jobs)
+    start = time.time()
+    apply_relocation(framework_path, relocation_plan, jobs=jobs)
+    return time.time() - start
+
+
+def bench_sign(framework_path, jobs):
+    """Signs every Mach-O file in-process after relocatablizing"""
+    files = relocatablize(framework_path, jobs=jobs)
+    start = time.time()
+    fix_broken_signatures(files, jobs=jobs, native=True)
+    return time.time() - start
+
+
+def bench_shebangs(framework_path, jobs):
+    """Runs fix_script_shebangs()"""
+    fix_script_shebangs(framework_path, VERSION, jobs=jobs)
+
+
+def bench_thin(framework_path, jobs):
+    """Thins fat files to arm64"""
+    thin_framework(framework_path, set([macho.CPU_TYPES["arm64"]]),
+                   jobs=jobs)
+
+
+def bench_zip_stdlib(framework_path, jobs):
+    """Packs the stdlib sources into pythonXY.zip"""
+    zip_stdlib(framework_path, VERSION, precompiled=True)
+
+
+def import_framework(destination):
+    """Creates a framework in destination whose stdlib holds what
+    IMPORT_MODULES needs from the running interpreter's stdlib, and whose
+    python is the running interpreter. Returns the framework path and its
+    version"""
+    version = "%d.%d" % sys.version_info[:2]
+    stdlib = sysconfig.get_paths()["stdlib"]
+    output = subprocess.check_output(
+        [sys.executable, "-I", "-S", "-c", IMPORT_CLOSURE_SCRIPT,
+         ",".join(IMPORT_MODULES)])
+    framework_path = os.path.join(destination, "Python.framework")
+    version_dir = os.path.join(framework_path, "Versions", version)
+    lib_dir = os.path.join(version_dir, "lib", "python" + version)
+    os.makedirs(lib_dir)
+    for name in sorted(set(output.decode("UTF-8").split())):
+        source = os.path.join(stdlib, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(lib_dir, name),
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        else:
+            shutil.copy(source, lib_dir)
+    os.makedirs(os.path.join(version_dir, "bin"))
+    os.symlink(sys.executable,
+               os.path.join(version_dir, "bin", "python" + version))
+    return framework_path, version
+
+
+def bench_import(name, zipped):
+    """Imports IMPORT_MODULES in a fresh interpreter from a precompiled
+    stdlib, packed into pythonXY.zip if zipped, and records the stat, open
+    and listdir calls made as FS_CALLS[name]"""
+    work_dir = tempfile.mkdtemp(prefix="relocatable-python-import-")
+    try:
+        framework_path, version = import_framework(work_dir)
+        lib_dir = os.path.join(
+            framework_path, "Versions", version, "lib", "python" + version)
+        if zipped:
+            if not zip_stdlib(framework_path, version):
+                raise RuntimeError("Could not zip the stdlib")
+            paths = [zip_path(framework_path, version), lib_dir]
+        else:
+            if not precompile(framework_path, version):
+                raise RuntimeError("Could not precompile the stdlib")
+            paths = [lib_dir]
+        output = subprocess.check_output(
+            [sys.executable, "-I", "-S", "-c", IMPORT_SCRIPT,
+             ":".join(paths), ",".join(IMPORT_MODULES)])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    seconds, stats, opens, listdirs = output.decode("UTF-8").split()
+    FS_CALLS[name] = {
+        "stat": int(stats), "open": int(opens), "listdir": int(listdirs)}
+    return float(seconds)
+
+
+def bench_import_zipped(framework_path, jobs):
+    """Imports a fixed set of modules from a zipped stdlib"""
+    return bench_import("import-zipped", True)
+
+
+def bench_import_unpacked(framework_path, jobs):
+    """Imports the same modules from an unpacked stdlib"""
+    return bench_import("import-unpacked", False)
+
+
+def bench_pipeline(framework_path, jobs):
+    """Runs the steps a build runs once it has the framework, with the
+    same scheduling"""
+    inventory = Inventory(framework_path)
+    state = {}
+
+    def relocate():
+        """relocatablize step"""
+        state["files"] = relocatablize(
+            framework_path, jobs=jobs, inventory=inventory)
+
+    pipeline = Pipeline()
+    pipeline.add("relocate", relocate)
+    pipeline.add("sign", lambda: fix_broken_signatures(
+        state["files"], jobs=jobs, native=True), ["relocate"])
+    pipeline.add("current-link", lambda: ensure_current_version_link(
+        framework_path, VERSION))
+    pipeline.add("shebangs", lambda: fix_script_shebangs(
+        framework_path, VERSION, inventory, jobs=jobs), ["relocate"])
+    if not pipeline.run():
+        raise RuntimeError("Pipeline failed")
+
+
+# benchmarks that run on the many-file tree of --walk-files
+WALK_BENCHMARKS = set(["inventory", "walk-baseline"])
+# size in bytes of each stdlib file in that tree
+WALK_FILE_SIZE = 256
+# benchmarks that --jobs-sweep times at each worker count
+SWEEP_BENCHMARKS = ("analyze", "relocatablize", "sign")
+# bytes of code in each Mach-O slice of the --dylib-sweep frameworks
+SWEEP_TEXT_SIZE = 4096
+# name -> (function, whether it changes the framework)
+BENCHMARKS = {
+    # every generated mode is already right, so the mode fixes change
+    # nothing
+    "inventory": (bench_inventory, False),
+    "walk-baseline": (bench_walk_baseline, False),
+    "analyze": (bench_analyze, False),
+    "analyze-otool": (bench_analyze_otool, False),
+    "relocatablize": (bench_relocatablize, True),
+    "apply-plan": (bench_apply_plan, True),
+    "sign": (bench_sign, True),
+    "shebangs": (bench_shebangs, True),
+    "thin": (bench_thin, True),
+    "zip-stdlib": (bench_zip_stdlib, True),
+    "import-zipped": (bench_import_zipped, False),
+    "import-unpacked": (bench_import_unpacked, False),
+    "pipeline": (bench_pipeline, True),
+}
+
+
+def run_benchmark(name, pristine, work_dir, repeat, jobs):
+    """Times benchmark name repeat times, each on a fresh copy of the
+    pristine framework if it changes it. Returns the list of seconds"""
+    func, changes_framework = BENCHMARKS[name]
+    timings = []
+    for _index in range(repeat):
+        framework_path = pristine
+        if changes_framework:
+            copy_dir = os.path.join(work_dir, "copy")
+            shutil.rmtree(copy_dir, ignore_errors=True)
+            framework_path = os.path.join(copy_dir, "Python.framework")
+            shutil.copytree(pristine, framework_path, symlinks=True)
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = func(framework_path, jobs)
+        # a benchmark returns its own timing when it has setup to leave out
+        timings.append(seconds if seconds is not None
+                       else time.time() - start)
+    return timings
+
+
+def parse_jobs_sweep(text):
+    """Converts a comma separated list of worker counts like "1,2,4,N",
+    where N stands for the number of CPUs, into a sorted list of ints"""
+    counts = set()
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        count = (os.cpu_count() or 1) if item == "N" else int(item)
+        if count < 1:
+            raise ValueError("Worker counts must be at least 1")
+        counts.add(count)
+    if not counts:
+        raise ValueError("No worker counts given")
+    return sorted(counts)
+
+
+def parse_dylib_sweep(text):
+    """Converts a comma separated list of dylib counts like "10,100,1000"
+    into a sorted list of ints"""
+    counts = set(int(item) for item in text.split(",") if item.strip())
+    if not counts:
+        raise ValueError("No dylib counts given")
+    if min(counts) < 1:
+        raise ValueError("Dylib counts must be at least 1")
+    return sorted(counts)
+
+
+def git_commit():
+    """Returns the commit of the checkout this runs from, or None"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode("UTF-8").strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def read_history(path):
+    """Returns the runs recorded in the history file at path"""
+    runs = []
+    try:
+        with open(path) as fileobj:
+            for line in fileobj:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    pass
+    except (IOError, OSError):
+        pass
+    return runs
+
+
+def baseline(runs, params, name):
+    """Returns the median of the best times for benchmark name in the
+    latest earlier runs with the same parameters, or None"""
+    times = [run["results"][name] for run in runs
+             if run.get("params") == params and name in run.get("results", {})]
+    times = sorted(times[-BASELINE_RUNS:])
+    if not times:
+        return None
+    return times[len(times) // 2]
+
+
+def main():
+    """Main"""
+    usage = "usage: %prog [options]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option(
+        "--dylibs", default=10, type="int",
+        help="Number of dylibs in the generated framework. Defaults to 10.")
+    parser.add_option(
+        "--so-files", default=200, type="int",
+        help="Number of extension modules. Defaults to 200.")
+    parser.add_option(
+        "--stdlib-files", default=5000, type="int",
+        help="Number of stdlib text files. Defaults to 5000.")
+    parser.add_option(
+        "--stdlib-file-size", default=8192, type="int",
+        help="Size in bytes of each stdlib file. Defaults to 8192.")
+    parser.add_option(
+        "--walk-files", default=50000, type="int",
+        help="Number of small stdlib files in the separate tree the "
+        "inventory and walk-baseline benchmarks walk. Defaults to 50000.")
+    parser.add_option(
+        "--scripts", default=20, type="int",
+        help="Number of bin scripts. Defaults to 20.")
+    parser.add_option(
+        "--text-size", default=65536, type="int",
+        help="Bytes of code in each Mach-O slice. Defaults to 65536.")
+    parser.add_option(
+        "--fat", default=False, action="store_true",
+        help="Generate universal2 Mach-O files instead of arm64 ones.")
+    parser.add_option(
+        "--benchmarks", default=",".join(sorted(BENCHMARKS)),
+        help="Comma-separated benchmarks to run. Defaults to all of them: "
+        "%s." % ", ".join(sorted(BENCHMARKS)))
+    parser.add_option(
+        "--repeat", default=3, type="int",
+        help="Times to run each benchmark; the best time counts. "
+        "Defaults to 3.")
+    parser.add_option(
+        "--jobs", default=1, type="int",
+        help="Number of files to work on concurrently. Defaults to 1.")
+    parser.add_option(
+        "--jobs-sweep",
+        help="Comma-separated worker counts, with N for the number of CPUs, "
+        "to also time %s at, for instance 1,2,4,N. The speedup over the "
+        "smallest count is reported." % ", ".join(SWEEP_BENCHMARKS))
+    parser.add_option(
+        "--dylib-sweep",
+        help="Comma-separated dylib counts, for instance 10,100,1000. For "
+        "each a framework with that many dylibs and extension modules is "
+        "generated, and analysis and working out the edits are timed, the "
+        "latter both with the dependents index and with the scan of every "
+        "file it replaced.")
+    parser.add_option(
+        "--links-per-file", default=2, type="int",
+        help="Number of dylibs each dylib and extension module loads. "
+        "Defaults to 2.")
+    parser.add_option(
+        "--history", default="benchmark_history.jsonl",
+        help="File to append results to and compare them against. "
+        'Defaults to "benchmark_history.jsonl".')
+    parser.add_option(
+        "--no-history", dest="history", action="store_const", const=None,
+        help="Neither record nor compare results.")
+    parser.add_option(
+        "--threshold", default=1.2, type="float",
+        help="Ratio to the baseline above which a time counts as a "
+        "regression. Defaults to 1.2.")
+    options, _arguments = parser.parse_args()
+    names = [name for name in options.benchmarks.split(",") if name]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("Unknown benchmarks: %s" % ", ".join(unknown))
+    if "thin" in names and not options.fat:
+        names.remove("thin")
+    if "analyze-otool" in names and not os.path.exists(OTOOL):
+        names.remove("analyze-otool")
+    jobs_sweep = []
+    if options.jobs_sweep:
+        try:
+            jobs_sweep = parse_jobs_sweep(options.jobs_sweep)
+        except ValueError as err:
+            parser.error("Bad --jobs-sweep: %s" % err)
+    dylib_sweep = []
+    if options.dylib_sweep:
+        try:
+            dylib_sweep = parse_dylib_sweep(options.dylib_sweep)
+        except ValueError as err:
+            parser.error("Bad --dylib-sweep: %s" % err)
+
+    params = {
+        "dylibs": options.dylibs,
+        "so_files": options.so_files,
+        "stdlib_files": options.stdlib_files,
+        "stdlib_file_size": options.stdlib_file_size,
+        "walk_files": options.walk_files,
+        "scripts": options.scripts,
+        "text_size": options.text_size,
+        "fat": options.fat,
+        "jobs": options.jobs,
+        "jobs_sweep": jobs_sweep,
+        "dylib_sweep": dylib_sweep,
+        "links_per_file": options.links_per_file,
+        "python": "%d.%d" % sys.version_info[:2],
+        "platform": sys.platform,
+    }
+    work_dir = tempfile.mkdtemp(prefix="relocatable-python-bench-")
+    try:
+        print("Generating framework in %s..." % work_dir)
+        pristine = synthetic.generate(
+            os.path.join(work_dir, "pristine"), version=VERSION,
+            dylibs=options.dylibs, so_files=options.so_files,
+            fat=options.fat, stdlib_files=options.stdlib_files,
+            stdlib_file_size=options.stdlib_file_size,
+            scripts=options.scripts, text_size=options.text_size,
+            links_per_file=options.links_per_file)
+        walk_tree = None
+        if WALK_BENCHMARKS.intersection(names):
+            print("Generating a %d-file framework..." % options.walk_files)
+            walk_tree = synthetic.generate(
+                os.path.join(work_dir, "walk"), version=VERSION,
+                dylibs=options.dylibs, so_files=options.so_files,
+                fat=options.fat, stdlib_files=options.walk_files,
+                stdlib_file_size=WALK_FILE_SIZE, scripts=options.scripts,
+                text_size=options.text_size,
+                links_per_file=options.links_per_file)
+        results = {}
+        for name in names:
+            timings = run_benchmark(
+                name, walk_tree if name in WALK_BENCHMARKS else pristine,
+                work_dir, options.repeat, options.jobs)
+            results[name] = min(timings)
+        # benchmark name -> {worker count: best seconds}
+        sweep = {}
+        for name in names:
+            if jobs_sweep and name in SWEEP_BENCHMARKS:
+                sweep[name] = {}
+                for jobs in jobs_sweep:
+                    sweep[name][jobs] = min(run_benchmark(
+                        name, pristine, work_dir, options.repeat, jobs))
+        # dylib count -> {step: best seconds}
+        dylib_results = {}
+        for count in dylib_sweep:
+            print("Timing analysis of %d dylibs..." % count)
+            dylib_results[count] = bench_dylib_sweep(
+                work_dir, count, options.links_per_file, options.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    runs = read_history(options.history) if options.history else []
+    regressions = []
+    print()
+    print("%-16s %10s %10s %8s" % ("Benchmark", "Best s", "Baseline", "Ratio"))
+    for name in names:
+        base = baseline(runs, params, name)
+        ratio = results[name] / base if base else None
+        flag = ""
+        if ratio is not None and ratio > options.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print("%-16s %10.3f %10s %8s %s" % (
+            name, results[name],
+            "%.3f" % base if base else "-",
+            "%.2f" % ratio if ratio else "-", flag))
+    if sweep:
+        print()
+        print("%-16s %6s %10s %8s" % ("Scaling", "Jobs", "Best s", "Speedup"))
+        for name in names:
+            for jobs in sorted(sweep.get(name, {})):
+                print("%-16s %6d %10.3f %8.2f" % (
+                    name, jobs, sweep[name][jobs],
+                    sweep[name][jobs_sweep[0]] / sweep[name][jobs]))
+    if dylib_results:
+        print()
+        print("%-16s %10s %10s %10s %8s" % (
+            "Dylibs", "Analyze s", "Index s", "Scan s", "Speedup"))
+        for count in sorted(dylib_results):
+            steps = dylib_results[count]
+            print("%-16d %10.3f %10.4f %10.4f %8.1f" % (
+                count, steps["analyze"], steps["plan"], steps["scan"],
+                steps["scan"] / steps["plan"] if steps["plan"] else 0))
+    if FS_CALLS:
+        calls = sorted(set(call for counts in FS_CALLS.values()
+                           for call in counts))
+        print()
+        print("%-16s" % "Filesystem calls"
+              + "".join(" %10s" % call for call in calls))
+        for name in names:
+            if name in FS_CALLS:
+                print("%-16s" % name + "".join(
+                    " %10s" % FS_CALLS[name].get(call, "-")
+                    for call in calls))
+    if options.history:
+        with open(options.history, "a") as fileobj:
+            fileobj.write(json.dumps({
+                "date": datetime.datetime.now().isoformat(),
+                "commit": git_commit(),
+                "params": params,
+                "results": results,
+                "fs_calls": FS_CALLS,
+                "sweep": sweep,
+                "dylib_sweep": dylib_results,
+            }, sort_keys=True) + "\n")
+    if regressions:
+        print("Slower than the baseline: %s" % ", ".join(regressions),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
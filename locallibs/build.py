@@ -0,0 +1,276 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object describing the steps of a framework build and what each one
+requires"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import threading
+
+from . import get
+from .fix import (ensure_current_version_link, fix_broken_signatures,
+                  fix_script_shebangs)
+from .install import install_extras
+from .inventory import Inventory
+from .manifest import Manifest
+from .pipeline import Pipeline, state_path
+from .precompile import precompile
+from .prune import prune
+from .relocatablizer import apply_relocation, manifest_record, relocatablize
+from .template import TemplateCache
+from .thin import thin_framework
+from .zipstdlib import zip_stdlib
+
+# options that don't change what a build produces, so a build can resume
+# with different values for them
+RESUMABLE_OPTIONS = ("jobs", "resume", "step_retries", "critical_path",
+                     "trace")
+
+
+class Build(object):
+    """Builds a relocatable framework as a graph of steps that run as soon
+    as the steps they require have completed"""
+
+    def __init__(self, options, precompile_levels=(0,), thin_cputypes=None,
+                 early_pruned=(), late_pruned=(), relocation_plan=None):
+        self.options = options
+        self.version = ".".join(options.python_version.split(".")[0:2])
+        self.precompile_levels = precompile_levels
+        self.thin_cputypes = thin_cputypes
+        self.early_pruned = list(early_pruned)
+        self.late_pruned = list(late_pruned)
+        self.relocation_plan = relocation_plan
+        self.getter = get.FrameworkGetter(
+            python_version=options.python_version,
+            os_version=options.os_version,
+            base_url=options.baseurl,
+            cache_dir=options.cache_dir,
+            cache_size_limit=options.cache_size_limit * 1024 * 1024,
+            offline=options.offline,
+            connections=options.connections,
+        )
+        self.destination = get.framework_destination(options.destination)
+        self.templates = None
+        self.template_key = None
+        if options.cache_dir and options.template_cache:
+            self.templates = TemplateCache(
+                os.path.join(options.cache_dir, "templates"))
+            self.template_key = self.templates.key(
+                self.getter.url(), options.unsign,
+                native_signing=options.native_signing,
+                pruned=self.early_pruned, archs=thin_cputypes)
+        self.pipeline = Pipeline(state_path(self.destination),
+                                 key=self.key())
+        self._inventory = None
+        self._manifest = None
+        self._lock = threading.Lock()
+        self.add_steps()
+
+    def key(self):
+        """Returns a hash of the options that decide what the build
+        produces"""
+        values = dict((name, value)
+                      for (name, value) in vars(self.options).items()
+                      if name not in RESUMABLE_OPTIONS)
+        return hashlib.sha256(
+            json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @property
+    def state(self):
+        """Values the steps share, saved so a build can resume"""
+        return self.pipeline.state
+
+    @property
+    def framework_path(self):
+        """Path of the framework being built, once it has been fetched"""
+        return self.state.get("framework_path")
+
+    @property
+    def inventory(self):
+        """Inventory of the framework, taken when first needed"""
+        with self._lock:
+            if self._inventory is None:
+                self._inventory = Inventory(self.framework_path)
+            return self._inventory
+
+    @property
+    def manifest(self):
+        """Manifest of the framework if the build keeps one, loaded when
+        first needed"""
+        with self._lock:
+            if self._manifest is None and (
+                    self.options.incremental or self.templates):
+                self._manifest = Manifest(self.framework_path)
+            return self._manifest
+
+    def add_steps(self):
+        """Adds the build's steps to the pipeline"""
+        options = self.options
+        retries = options.step_retries
+        add = self.pipeline.add
+        add("fetch", self.fetch, retries=retries)
+        if self.early_pruned:
+            add("prune", self.prune, ["fetch"])
+        if self.thin_cputypes:
+            add("thin", self.thin, ["prune", "fetch"])
+        add("relocate", self.relocate, ["thin", "prune", "fetch"])
+        if options.unsign:
+            add("sign", self.sign, ["relocate"])
+        add("current-link", self.current_link, ["fetch"])
+        # scripts aren't signed, so their shebangs are fixed while signing
+        add("shebangs", self.shebangs, ["relocate"], retries=retries)
+        if self.templates:
+            add("template", self.store_template,
+                ["sign", "shebangs", "current-link"])
+        add("install", self.install,
+            ["template", "sign", "shebangs", "current-link"], retries=retries)
+        if self.late_pruned:
+            add("prune-pip", self.prune_pip, ["install"])
+        if options.precompile:
+            add("precompile", self.precompile, ["prune-pip", "install"])
+        add("bin-shebangs", self.shebangs, ["install"], retries=retries)
+        if options.zip_stdlib:
+            add("zip-stdlib", self.zip_stdlib,
+                ["precompile", "prune-pip", "bin-shebangs"])
+
+    def fetch(self):
+        """Reuses, clones from a template or downloads the framework"""
+        options = self.options
+        manifest = None
+        if options.incremental or self.templates:
+            manifest = Manifest(self.destination)
+        downloaded = False
+        if options.incremental and manifest \
+                and os.path.isdir(manifest.framework_path):
+            framework_path = manifest.framework_path
+            print("Updating existing framework at %s..." % framework_path)
+        elif self.templates and self.templates.restore(
+                self.template_key, self.destination):
+            framework_path = self.destination
+        else:
+            framework_path = self.getter.download_and_extract(
+                destination=options.destination)
+            downloaded = True
+        if not framework_path:
+            return False
+        if manifest is not None:
+            # a freshly extracted framework starts a new manifest
+            self._manifest = Manifest(framework_path, load=not downloaded)
+        self.state["framework_path"] = framework_path
+        self.state["downloaded"] = downloaded
+        return True
+
+    def prune(self):
+        """Removes the components not needed, except those pip needs"""
+        prune(self.framework_path, self.version, self.early_pruned,
+              self.inventory)
+
+    def thin(self):
+        """Removes unwanted architectures from fat Mach-O files"""
+        return thin_framework(self.framework_path, self.thin_cputypes,
+                              self.inventory, jobs=self.options.jobs)
+
+    def relocate(self):
+        """Rewrites install names so the framework is relocatable, using
+        the relocation plan if there is one"""
+        if self.relocation_plan is not None:
+            self.state["relocatablized"] = apply_relocation(
+                self.framework_path, self.relocation_plan,
+                jobs=self.options.jobs, manifest=self.manifest,
+                inventory=self.inventory)
+            return
+        self.state["relocatablized"] = relocatablize(
+            self.framework_path, jobs=self.options.jobs,
+            manifest=self.manifest, inventory=self.inventory,
+            plan_path=self.options.write_relocation_plan)
+
+    def sign(self):
+        """Re-signs the files that were rewritten"""
+        files_relocatablized = self.state.get("relocatablized", [])
+        fix_broken_signatures(
+            files_relocatablized,
+            jobs=self.options.jobs,
+            native=self.options.native_signing,
+        )
+        manifest = self.manifest
+        if manifest is not None:
+            manifest.mark(files_relocatablized, manifest_record, signed=True)
+            manifest.save()
+
+    def current_link(self):
+        """Makes sure the framework has Versions/Current"""
+        return ensure_current_version_link(self.framework_path, self.version)
+
+    def shebangs(self):
+        """Makes the framework's scripts find its python relatively"""
+        return fix_script_shebangs(self.framework_path, self.version,
+                                   self.inventory, jobs=self.options.jobs)
+
+    def store_template(self):
+        """Keeps a freshly downloaded, relocated framework as a template"""
+        if self.state.get("downloaded"):
+            self.templates.store(self.template_key, self.framework_path)
+
+    def install(self):
+        """Installs pip and the extra modules"""
+        options = self.options
+        install_extras(
+            self.framework_path,
+            version=self.version,
+            requirements_file=options.pip_requirements,
+            upgrade_pip=options.upgrade_pip,
+            without_pip=options.without_pip,
+            wheelhouse=options.wheelhouse,
+            offline=options.offline,
+            jobs=options.jobs,
+            direct_install=options.direct_install,
+        )
+
+    def prune_pip(self):
+        """Removes the components pip needed"""
+        prune(self.framework_path, self.version, self.late_pruned,
+              self.inventory)
+
+    def precompile(self):
+        """Compiles the stdlib and site-packages"""
+        return precompile(self.framework_path, self.version,
+                          levels=self.precompile_levels)
+
+    def zip_stdlib(self):
+        """Packs the pure-Python stdlib into pythonXY.zip"""
+        modules = None
+        if self.options.zip_stdlib_modules:
+            modules = set(self.options.zip_stdlib_modules.split(","))
+        return zip_stdlib(self.framework_path, self.version, modules=modules,
+                          precompiled=self.options.precompile)
+
+    def run(self):
+        """Runs the steps that haven't completed, resuming an earlier
+        failed build with the same options if asked to. Returns False if a
+        step failed"""
+        if self.options.resume:
+            skipped = self.pipeline.resume()
+            if skipped:
+                print("Resuming build; skipping %s" % ", ".join(skipped))
+        success = self.pipeline.run()
+        if self.options.critical_path:
+            self.pipeline.report()
+        if success:
+            self.pipeline.discard()
+        return success
@@ -0,0 +1,172 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to keep a local cache of downloaded Python.org pkgs"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+DEFAULT_CACHE_SIZE_LIMIT = 2 * 1024 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """Returns the hex SHA-256 digest of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fileobj:
+        for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadCache(object):
+    """A directory of downloaded pkgs, keyed by python version, os version
+    and URL, each stored with its SHA-256 and evicted least recently used
+    first once the cache grows past size_limit bytes"""
+
+    def __init__(self, cache_dir, size_limit=DEFAULT_CACHE_SIZE_LIMIT):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.size_limit = size_limit
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def key(python_version, os_version, url):
+        """Returns the cache key for a download"""
+        return hashlib.sha256(
+            "\n".join([python_version, os_version, url]).encode("utf-8")
+        ).hexdigest()
+
+    def _paths(self, key):
+        """Returns the paths of the pkg and metadata files for key"""
+        base = os.path.join(self.cache_dir, key)
+        return (base + ".pkg", base + ".json")
+
+    def download_path(self, key):
+        """Returns the path at which to download the pkg for key before it
+        is stored"""
+        return os.path.join(self.cache_dir, key + ".download")
+
+    def _remove(self, key):
+        """Removes an entry from the cache"""
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _remove_partial(self, key):
+        """Removes what an unfinished download for key left behind"""
+        prefix = os.path.basename(self.download_path(key))
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(prefix):
+                os.unlink(os.path.join(self.cache_dir, filename))
+
+    def lookup(self, key):
+        """Returns the path to the cached pkg for key, or None if it isn't
+        cached or fails its SHA-256 check"""
+        pkg_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as fileobj:
+                meta = json.load(fileobj)
+        except (IOError, OSError, ValueError):
+            return None
+        if not os.path.exists(pkg_path) or file_sha256(pkg_path) != meta.get(
+                "sha256"):
+            print("Cached %s is damaged; discarding it." % meta.get("url"),
+                  file=sys.stderr)
+            self._remove(key)
+            return None
+        meta["last_used"] = time.time()
+        self._write_meta(meta_path, meta)
+        return pkg_path
+
+    def store(self, key, path, url):
+        """Moves the downloaded file at path into the cache. Returns the
+        path to the cached pkg"""
+        pkg_path, meta_path = self._paths(key)
+        shutil.move(path, pkg_path)
+        meta = {
+            "url": url,
+            "sha256": file_sha256(pkg_path),
+            "size": os.path.getsize(pkg_path),
+            "last_used": time.time(),
+        }
+        self._write_meta(meta_path, meta)
+        self.evict(keep=key)
+        return pkg_path
+
+    @staticmethod
+    def _write_meta(meta_path, meta):
+        """Atomically writes an entry's metadata"""
+        temp_path = meta_path + ".temp"
+        with open(temp_path, "w") as fileobj:
+            json.dump(meta, fileobj)
+        os.rename(temp_path, meta_path)
+
+    def entries(self):
+        """Returns a list of (last_used, size, key, partial) for every cache
+        entry and every unfinished download. A download's files count
+        together, and were last used when the newest was modified"""
+        entries = []
+        partials = {}
+        for filename in os.listdir(self.cache_dir):
+            if ".download" in filename:
+                key = filename.split(".download")[0]
+                try:
+                    stat_result = os.stat(
+                        os.path.join(self.cache_dir, filename))
+                except OSError:
+                    continue
+                last_used, size = partials.get(key, (0, 0))
+                partials[key] = (max(last_used, stat_result.st_mtime),
+                                 size + stat_result.st_size)
+                continue
+            if not filename.endswith(".json"):
+                continue
+            key = filename[:-5]
+            try:
+                with open(os.path.join(self.cache_dir, filename)) as fileobj:
+                    meta = json.load(fileobj)
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append(
+                (meta.get("last_used", 0), meta.get("size", 0), key, False))
+        entries.extend((last_used, size, key, True)
+                       for (key, (last_used, size)) in partials.items())
+        return entries
+
+    def evict(self, keep=None):
+        """Removes least recently used entries and unfinished downloads
+        until the cache fits in size_limit. Nothing for keep is removed"""
+        entries = sorted(self.entries())
+        total = sum(size for (_last_used, size, _key, _partial) in entries)
+        for (_last_used, size, key, partial) in entries:
+            if total <= self.size_limit:
+                break
+            if key == keep:
+                continue
+            if partial:
+                print("Evicting unfinished download %s from download "
+                      "cache..." % key)
+                self._remove_partial(key)
+            else:
+                print("Evicting %s from download cache..." % key)
+                self._remove(key)
+            total -= size
@@ -0,0 +1,146 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to copy a directory tree as cheaply as the filesystem allows:
+copy-on-write clones, then hardlinks, then plain copies"""
+
+from __future__ import print_function
+
+import ctypes
+import errno
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl to share a file's extents with another file (btrfs, xfs...)
+FICLONE = 0x40049409
+# clonefile(2) flag: clone a symlink itself rather than its target
+CLONE_NOFOLLOW = 0x0001
+# errors meaning the filesystem can't clone, as opposed to a real failure
+UNSUPPORTED_ERRNOS = set(
+    getattr(errno, name) for name in
+    ("EOPNOTSUPP", "ENOTSUP", "EXDEV", "ENOTTY", "EINVAL", "ENOSYS")
+    if hasattr(errno, name))
+
+
+def _load_clonefile():
+    """Returns the macOS clonefile(2) function, or None"""
+    if sys.platform != "darwin":
+        return None
+    try:
+        libc = ctypes.CDLL("/usr/lib/libSystem.B.dylib", use_errno=True)
+        clonefile = libc.clonefile
+    except (OSError, AttributeError):
+        return None
+    clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+    clonefile.restype = ctypes.c_int
+    return clonefile
+
+
+class TreeCloner(object):
+    """Copies directory trees. Each file is cloned copy-on-write when the
+    filesystem supports it (clonefile on APFS, FICLONE on Linux); failing
+    that, files for which may_hardlink(path) is true are hardlinked and
+    everything else is copied. Counts of each method are kept in
+    counts"""
+
+    def __init__(self, may_hardlink=None):
+        self.may_hardlink = may_hardlink or (lambda path: False)
+        self.use_reflink = True
+        self._clonefile = _load_clonefile()
+        self.counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+
+    def _reflink(self, src, dst):
+        """Clones src to dst copy-on-write. Returns False if the filesystem
+        can't, after which no more clones are attempted"""
+        if not self.use_reflink:
+            return False
+        try:
+            if self._clonefile is not None:
+                if self._clonefile(
+                        os.fsencode(src), os.fsencode(dst), CLONE_NOFOLLOW):
+                    code = ctypes.get_errno()
+                    raise OSError(code, os.strerror(code))
+                return True
+            if fcntl is None:
+                raise OSError(errno.ENOSYS, "no FICLONE")
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                try:
+                    fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                except (IOError, OSError):
+                    dst_file.close()
+                    os.unlink(dst)
+                    raise
+            shutil.copystat(src, dst)
+            return True
+        except (IOError, OSError) as err:
+            if err.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            self.use_reflink = False
+            return False
+
+    def clone_file(self, src, dst):
+        """Copies the regular file src to dst by the cheapest method.
+        Returns the name of the method used"""
+        if self._reflink(src, dst):
+            method = "reflink"
+        elif self.may_hardlink(src):
+            try:
+                os.link(src, dst)
+                method = "hardlink"
+            except OSError:
+                shutil.copy2(src, dst)
+                method = "copy"
+        else:
+            shutil.copy2(src, dst)
+            method = "copy"
+        self.counts[method] += 1
+        return method
+
+    def clone_tree(self, src, dst):
+        """Copies the directory src to the new path dst, keeping symlinks,
+        modes and mtimes"""
+        if self._clonefile is not None and self._reflink(src, dst):
+            # clonefile copies a whole directory hierarchy in one call
+            self.counts["reflink"] += 1
+            return
+        directories = []
+        pending = [(src, dst)]
+        while pending:
+            src_dir, dst_dir = pending.pop()
+            os.mkdir(dst_dir)
+            directories.append((src_dir, dst_dir))
+            for entry in os.scandir(src_dir):
+                dst_path = os.path.join(dst_dir, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), dst_path)
+                elif entry.is_dir():
+                    pending.append((entry.path, dst_path))
+                elif entry.is_file():
+                    self.clone_file(entry.path, dst_path)
+        # set directory modes last so read-only directories can be filled
+        for src_dir, dst_dir in reversed(directories):
+            shutil.copystat(src_dir, dst_dir)
+
+    def summary(self):
+        """Returns a description of how files were cloned"""
+        return "%d cloned, %d hardlinked, %d copied" % (
+            self.counts["reflink"], self.counts["hardlink"],
+            self.counts["copy"])
@@ -0,0 +1,115 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Script run by the framework's own python to compile .py files into
+unchecked-hash .pycs on every core. Prints one JSON line per package with
+the files compiled, the compile time and the bytes of bytecode added"""
+
+from __future__ import print_function
+
+import importlib.util
+import json
+import os
+import py_compile
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 64
+UNCHECKED_HASH = py_compile.PycInvalidationMode.UNCHECKED_HASH
+
+
+def cache_paths(path, levels):
+    """Returns the .pyc path for path at each optimization level"""
+    return [
+        importlib.util.cache_from_source(path, optimization=level or "")
+        for level in levels
+    ]
+
+
+def total_size(paths):
+    """Returns the combined size of the files in paths that exist"""
+    return sum(os.path.getsize(path) for path in paths
+               if os.path.exists(path))
+
+
+def compile_source(item):
+    """Compiles one .py file at every level. Returns (seconds, bytes
+    added, succeeded)"""
+    path, levels = item
+    caches = cache_paths(path, levels)
+    before = total_size(caches)
+    start = time.time()
+    succeeded = True
+    for level, cache in zip(levels, caches):
+        try:
+            py_compile.compile(
+                path, cfile=cache, doraise=True, optimize=level,
+                invalidation_mode=UNCHECKED_HASH)
+        except (py_compile.PyCompileError, IOError, OSError, SyntaxError,
+                UnicodeDecodeError):
+            succeeded = False
+    return (time.time() - start, total_size(caches) - before, succeeded)
+
+
+def sources(root, skip):
+    """Yields (package, path) for every .py file below root, except those
+    below the directories in skip"""
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(
+            name for name in dirs if name != "__pycache__"
+            and os.path.join(dirpath, name) not in skip)
+        for filename in sorted(files):
+            if filename.endswith(".py"):
+                path = os.path.join(dirpath, filename)
+                top = os.path.relpath(path, root).split(os.sep)[0]
+                if top.endswith(".py"):
+                    top = top[:-3]
+                yield (top, path)
+
+
+def main():
+    """Compiles the roots given as JSON [[label, path], ...] at the
+    optimization levels given as a JSON list"""
+    roots = json.loads(sys.argv[1])
+    levels = json.loads(sys.argv[2])
+    skip = set(path for (_label, path) in roots)
+    work = []
+    for label, root in roots:
+        for package, path in sources(root, skip - set([root])):
+            work.append(("%s/%s" % (label, package), path))
+    packages = {}
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(
+            compile_source, [(path, levels) for (_package, path) in work],
+            chunksize=CHUNK_SIZE)
+        for (package, _path), (seconds, added, succeeded) in zip(
+                work, results):
+            stats = packages.setdefault(
+                package, {"files": 0, "seconds": 0.0, "bytes": 0,
+                          "errors": 0})
+            stats["files"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += added
+            stats["errors"] += 0 if succeeded else 1
+    for package in sorted(packages):
+        stats = packages[package]
+        stats["package"] = package
+        print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
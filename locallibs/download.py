@@ -0,0 +1,276 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to download a file over several resumable HTTP connections"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import file_sha256
+
+try:
+    from http.client import HTTPException
+    from urllib.error import HTTPError, URLError
+    from urllib.request import Request, urlopen
+except ImportError:
+    from httplib import HTTPException
+    from urllib2 import HTTPError, Request, URLError, urlopen
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_RETRIES = 5
+CHUNK_SIZE = 64 * 1024
+# don't bother splitting downloads into parts smaller than this
+MIN_PART_SIZE = 1024 * 1024
+# how many bytes a connection downloads between saves of the resume state
+STATE_SAVE_INTERVAL = 1024 * 1024
+NETWORK_ERRORS = (HTTPError, HTTPException, URLError, IOError, OSError)
+
+
+class DownloadFailed(Exception):
+    """Raised when a download can't be completed"""
+
+
+class Downloader(object):
+    """Downloads url to destination using HTTP Range requests over several
+    connections. Progress is saved next to the partial file so an
+    interrupted download picks up where it left off. With sha256, a
+    download that doesn't match it is discarded"""
+
+    def __init__(
+        self,
+        url,
+        destination,
+        connections=DEFAULT_CONNECTIONS,
+        retries=DEFAULT_RETRIES,
+        backoff=1.0,
+        timeout=60,
+        sha256=None,
+    ):
+        self.url = url
+        self.destination = destination
+        self.partial_path = destination + ".partial"
+        self.state_path = destination + ".partial.state"
+        self.connections = max(connections, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sha256 = sha256
+        self.parts = []
+        # how much of each part is flushed to the partial file
+        self.flushed = []
+        self.size = None
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def _open(self, start=None, end=None):
+        """Opens url, optionally for an inclusive byte range"""
+        request = Request(self.url)
+        if start is not None:
+            request.add_header("Range", "bytes=%d-%d" % (start, end))
+        return urlopen(request, timeout=self.timeout)
+
+    def _probe(self):
+        """Returns (size, accepts_ranges) for url"""
+        response = self._open(0, 0)
+        try:
+            content_range = response.headers.get("Content-Range", "")
+            if response.getcode() == 206 and "/" in content_range:
+                total = content_range.rsplit("/", 1)[1]
+                if total.isdigit():
+                    return (int(total), True)
+            length = response.headers.get("Content-Length")
+            return (int(length) if length else None, False)
+        finally:
+            response.close()
+
+    def _load_state(self):
+        """Returns the saved parts list if a compatible partial download
+        exists, otherwise None"""
+        if not os.path.exists(self.partial_path):
+            return None
+        try:
+            with open(self.state_path) as fileobj:
+                state = json.load(fileobj)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get("url") != self.url or state.get("size") != self.size:
+            return None
+        return state.get("parts")
+
+    def _save_state(self, index=None):
+        """Records how much of each part has been downloaded and flushed
+        to the partial file. index is the part whose progress was just
+        flushed; other parts keep the progress saved for them before"""
+        with self._lock:
+            if index is not None:
+                self.flushed[index] = self.parts[index][2]
+            parts = [[start, end, flushed] for ((start, end, _done), flushed)
+                     in zip(self.parts, self.flushed)]
+            state = {"url": self.url, "size": self.size, "parts": parts}
+            temp_path = self.state_path + ".temp"
+            with open(temp_path, "w") as fileobj:
+                json.dump(state, fileobj)
+            os.rename(temp_path, self.state_path)
+
+    def _plan_parts(self):
+        """Splits the download into [start, end, done] parts"""
+        count = min(self.connections, max(self.size // MIN_PART_SIZE, 1))
+        part_size = -(-self.size // count)
+        parts = []
+        for start in range(0, self.size, part_size):
+            end = min(start + part_size, self.size) - 1
+            parts.append([start, end, 0])
+        return parts
+
+    def _fetch_part(self, index):
+        """Downloads the remainder of a part, retrying with backoff"""
+        part = self.parts[index]
+        attempt = 0
+        while True:
+            start, end, done = part
+            if start + done > end:
+                return
+            try:
+                response = self._open(start + done, end)
+                try:
+                    if response.getcode() != 206:
+                        raise DownloadFailed(
+                            "Server ignored range request for %s" % self.url)
+                    self._copy(response, start + done, index, end)
+                finally:
+                    response.close()
+            except NETWORK_ERRORS as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadFailed(
+                        "Giving up on %s after %d attempts: %s"
+                        % (self.url, attempt, err))
+                delay = self.backoff * 2 ** (attempt - 1)
+                print("Connection problem downloading %s (%s); retrying in "
+                      "%.1f seconds..." % (self.url, err, delay),
+                      file=sys.stderr)
+                time.sleep(delay)
+
+    def _copy(self, response, offset, index, end):
+        """Copies response into the partial file at offset, updating part
+        index"""
+        part = self.parts[index]
+        unsaved = 0
+        with open(self.partial_path, "r+b") as fileobj:
+            fileobj.seek(offset)
+            while offset <= end:
+                chunk = response.read(min(CHUNK_SIZE, end + 1 - offset))
+                if not chunk:
+                    break
+                fileobj.write(chunk)
+                offset += len(chunk)
+                with self._lock:
+                    part[2] += len(chunk)
+                    self.bytes_downloaded += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= STATE_SAVE_INTERVAL:
+                    fileobj.flush()
+                    self._save_state(index)
+                    unsaved = 0
+        self._save_state(index)
+        if offset <= end:
+            raise IOError("Connection closed early")
+
+    def _download_ranges(self):
+        """Downloads all parts concurrently"""
+        self.parts = self._load_state()
+        if self.parts:
+            done = sum(part[2] for part in self.parts)
+            print("Resuming download of %s (%d of %d bytes already done)..."
+                  % (self.url, done, self.size))
+        else:
+            self.parts = self._plan_parts()
+            with open(self.partial_path, "wb") as fileobj:
+                fileobj.truncate(self.size)
+        self.flushed = [part[2] for part in self.parts]
+        self._save_state()
+        with ThreadPoolExecutor(max_workers=len(self.parts)) as executor:
+            for _result in executor.map(
+                    self._fetch_part, range(len(self.parts))):
+                pass
+
+    def _download_stream(self):
+        """Downloads url over a single connection, retrying from the
+        beginning since the server can't resume"""
+        attempt = 0
+        while True:
+            try:
+                response = self._open()
+                received = 0
+                try:
+                    with open(self.partial_path, "wb") as fileobj:
+                        for chunk in iter(
+                                lambda: response.read(CHUNK_SIZE), b""):
+                            fileobj.write(chunk)
+                            received += len(chunk)
+                            self.bytes_downloaded += len(chunk)
+                finally:
+                    response.close()
+                # a dropped connection just ends the response early
+                if self.size is not None and received < self.size:
+                    raise IOError("Connection closed early")
+                return
+            except NETWORK_ERRORS as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise DownloadFailed(
+                        "Giving up on %s after %d attempts: %s"
+                        % (self.url, attempt, err))
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _discard(self):
+        """Removes the partial file and its saved state"""
+        for path in (self.partial_path, self.state_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def download(self):
+        """Downloads url to destination. Returns destination"""
+        start_time = time.time()
+        try:
+            self.size, accepts_ranges = self._probe()
+        except NETWORK_ERRORS as err:
+            raise DownloadFailed("Could not download %s: %s" % (self.url, err))
+        if accepts_ranges and self.size:
+            self._download_ranges()
+        else:
+            self._download_stream()
+        if self.size is not None and \
+           os.path.getsize(self.partial_path) != self.size:
+            raise DownloadFailed("Downloaded size of %s is wrong" % self.url)
+        if self.sha256 and file_sha256(self.partial_path) != self.sha256:
+            # start over next time rather than resume a bad file
+            self._discard()
+            raise DownloadFailed("Checksum of %s doesn't match" % self.url)
+        os.rename(self.partial_path, self.destination)
+        if os.path.exists(self.state_path):
+            os.unlink(self.state_path)
+        elapsed = max(time.time() - start_time, 0.001)
+        print("Downloaded %.1f MB in %.1f seconds (%.1f MB/s)"
+              % (self.bytes_downloaded / 1048576.0, elapsed,
+                 self.bytes_downloaded / 1048576.0 / elapsed))
+        return self.destination
@@ -17,10 +17,23 @@
 
 from __future__ import print_function
 
+import functools
 import os
 import shutil
-import subprocess
 import sys
+import tempfile
+import time
+
+from . import parallel, signing, trace
+from .inventory import Inventory
+
+CODESIGN = "/usr/bin/codesign"
+# --deep is unnecessary: everything we sign is a single Mach-O file
+CODESIGN_ARGS = [
+    "-s", "-", "--force",
+    "--preserve-metadata=identifier,entitlements,flags,runtime",
+]
+SIGNING_BATCH_SIZE = 50
 
 
 def ensure_current_version_link(framework_path, short_version):
@@ -72,68 +85,169 @@ def is_framework_shebang(framework_path, text):
     return any(text.startswith(x) for x in prefixes)
 
 
-def fix_script_shebangs(framework_path, short_version):
-    '''Attempt to make the scripts in the bin directory relocatable'''
-
-    relocatable_shebang = b"""#!/bin/sh
+RELOCATABLE_SHEBANG = b"""#!/bin/sh
 '''exec' "$(dirname "$0")/%s" "$0" "$@"
 ' '''
 # the above calls the %s interpreter relative to the directory of this script
 """
-    bin_dir = os.path.join(framework_path, "Versions", short_version, "bin")
-    for filename in os.listdir(bin_dir):
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def is_script_candidate(entry, bin_dir):
+    """Returns a boolean to indicate if an inventory entry may be a script
+    to fix: any regular file directly in bin_dir, as the scripts there were
+    always fixed whatever their mode, and any other executable regular
+    file"""
+    if entry.kind != "file":
+        return False
+    return (os.path.dirname(entry.path) == bin_dir
+            or bool(entry.mode & 0o111))
+
+
+def fix_script_shebang(framework_path, entry):
+    """Rewrites the shebang of the script at entry.path if it references an
+    interpreter inside the framework. Only the inventory's bounded prefix of
+    the file is examined; the rest is streamed into a temp file that
+    atomically replaces the original. Returns (path, changed, error)"""
+    with trace.file_work("shebang", entry.path):
         try:
-            original_filepath = os.path.join(bin_dir, filename)
-            if (os.path.islink(original_filepath) or
-                    os.path.isdir(original_filepath)):
-                # skip symlinks and directories
-                continue
-            with open(original_filepath, 'rb') as original_file:
-                first_line = original_file.readline().strip()
-                if is_framework_shebang(framework_path, first_line):
-                    # we found a script that references an interpreter inside
-                    # the framework
-                    print("Modifying shebang for %s..." % original_filepath)
-                    relative_interpreter_path = relativize_interpreter_path(
-                        framework_path, bin_dir, first_line)
-                    new_filepath = original_filepath + ".temp"
-                    with open(new_filepath, 'wb') as new_file:
-                        new_file.write(
-                            relocatable_shebang
-                            % (relative_interpreter_path,
-                               relative_interpreter_path)
-                        )
-                        for line in original_file.readlines():
-                            new_file.write(line)
-                    # replace original with modified
-                    shutil.copymode(original_filepath, new_filepath)
-                    os.remove(original_filepath)
-                    os.rename(new_filepath, original_filepath)
+            head = entry.head
+            line_end = head.find(b"\n")
+            if line_end == -1:
+                if len(head) < entry.size:
+                    # a first line too long to be a shebang
+                    return (entry.path, False, None)
+                line_end = len(head)
+            first_line = head[:line_end].strip()
+            if not is_framework_shebang(framework_path, first_line):
+                return (entry.path, False, None)
+            script_dir = os.path.dirname(entry.path)
+            relative_interpreter_path = relativize_interpreter_path(
+                framework_path, script_dir, first_line)
+            fd, temp_path = tempfile.mkstemp(
+                dir=script_dir, prefix="." + os.path.basename(entry.path))
+            try:
+                with os.fdopen(fd, "wb") as new_file, \
+                        open(entry.path, "rb") as original_file:
+                    new_file.write(RELOCATABLE_SHEBANG % (
+                        relative_interpreter_path, relative_interpreter_path))
+                    original_file.seek(line_end + 1)
+                    shutil.copyfileobj(
+                        original_file, new_file, COPY_BUFFER_SIZE)
+                    trace.count_bytes(read=original_file.tell(),
+                                      written=new_file.tell())
+                # replace original with modified
+                shutil.copymode(entry.path, temp_path)
+                os.rename(temp_path, entry.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
         except (IOError, OSError) as err:
-            print("Could not fix shebang for %s: %s"
-                  % (os.path.join(bin_dir, filename), err))
-            return False
-    return True
+            return (entry.path, False, err)
+        return (entry.path, True, None)
 
 
-def fix_other_things(framework_path, short_version):
+def fix_script_shebangs(framework_path, short_version, inventory=None,
+                        jobs=1):
+    '''Attempt to make the scripts in the framework relocatable: those in the
+    bin directory, including any pip installed, and any other executable
+    script that references an interpreter inside the framework. Returns
+    False if any script could not be fixed'''
+    bin_dir = os.path.abspath(
+        os.path.join(framework_path, "Versions", short_version, "bin"))
+    if inventory is None:
+        inventory = Inventory(framework_path)
+    else:
+        # pip may have installed scripts since the inventory was taken
+        inventory.scan(bin_dir)
+    candidates = [
+        entry for entry in inventory.files(framework_path)
+        if is_script_candidate(entry, bin_dir)
+    ]
+    success = True
+    for path, changed, err in parallel.ordered_map(
+            functools.partial(fix_script_shebang, framework_path),
+            candidates, jobs):
+        if err:
+            print("Could not fix shebang for %s: %s" % (path, err),
+                  file=sys.stderr)
+            success = False
+        elif changed:
+            inventory.refresh(path)
+            print("Modified shebang for %s" % path)
+    return success
+
+
+def fix_other_things(framework_path, short_version, inventory=None, jobs=1):
     '''Wrapper function in case there are other things we need to fix in the
     future'''
     return (ensure_current_version_link(framework_path, short_version) and
-            fix_script_shebangs(framework_path, short_version))
+            fix_script_shebangs(
+                framework_path, short_version, inventory, jobs=jobs))
+
 
+def sign_batch(batch, runner=trace.check_call, codesign=CODESIGN):
+    """Ad-hoc signs a list of files with a single codesign invocation.
+    Returns the elapsed time"""
+    start = time.time()
+    runner([codesign] + CODESIGN_ARGS + list(batch))
+    return time.time() - start
 
-def fix_broken_signatures(files_relocatablized):
+
+def fix_broken_signatures(
+    files_relocatablized,
+    jobs=1,
+    batch_size=SIGNING_BATCH_SIZE,
+    runner=trace.check_call,
+    codesign=CODESIGN,
+    native=False,
+):
     """
     Re-sign the binaries and libraries that were relocatablized with ad-hoc
     signatures to avoid them having invalid signatures and to allow them to
-    run on Apple Silicon
+    run on Apple Silicon. Files are passed to codesign in batches, with up to
+    jobs batches running at once; with native, files are signed in-process
+    one at a time instead. Returns a dict of the (average) seconds spent
+    signing each file
     """
-    CODESIGN_CMD = ["/usr/bin/codesign",
-                    "-s", "-", "--deep", "--force",
-                    "--preserve-metadata=identifier,entitlements,flags,runtime"]
-    for pathname in files_relocatablized:
-        print("Re-signing %s with ad-hoc signature..."
-              % pathname)
-        cmd = CODESIGN_CMD + [pathname]
-        subprocess.check_call(cmd)
+    files = list(files_relocatablized)
+    if native:
+        batch_size = 1
+    batches = [
+        files[index:index + batch_size]
+        for index in range(0, len(files), batch_size)
+    ]
+    timings = {}
+    total_start = time.time()
+
+    def sign(batch):
+        """Signs one batch"""
+        if native:
+            start = time.time()
+            for pathname in batch:
+                with trace.file_work("sign", pathname):
+                    signing.sign(pathname)
+            return (batch, time.time() - start)
+        return (batch, sign_batch(batch, runner=runner, codesign=codesign))
+
+    with trace.phase("signing"):
+        for batch, elapsed in parallel.ordered_map(sign, batches, jobs):
+            if len(batch) == 1:
+                print("Re-signed %s with ad-hoc signature in %.1f ms"
+                      % (batch[0], elapsed * 1000))
+            else:
+                # codesign signs a batch in one go, so only its total time
+                # is known
+                for pathname in batch:
+                    print("Re-signed %s with ad-hoc signature" % pathname)
+                print("Re-signed a batch of %d files in %.1f ms "
+                      "(%.1f ms per file on average)"
+                      % (len(batch), elapsed * 1000,
+                         elapsed * 1000 / len(batch)))
+            for pathname in batch:
+                timings[pathname] = elapsed / len(batch)
+    if files:
+        total = time.time() - total_start
+        print("Re-signed %d files in %.2f seconds (%.1f ms per file)"
+              % (len(files), total, total * 1000 / len(files)))
+    return timings
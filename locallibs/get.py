@@ -19,90 +19,125 @@ from __future__ import print_function
 
 import os
 import shutil
-import subprocess
 import sys
 import tempfile
 
-CURL = "/usr/bin/curl"
-DITTO = "/usr/bin/ditto"
-PKGUTIL = "/usr/sbin/pkgutil"
+from . import trace
+from .cache import DownloadCache, DEFAULT_CACHE_SIZE_LIMIT
+from .download import Downloader, DownloadFailed, DEFAULT_CONNECTIONS
+from .payload import PayloadError, extract_payload
+from .xar import XarReader, XarError
+
+FRAMEWORK_PAYLOAD = "Python_Framework.pkg/Payload"
 DEFAULT_BASEURL = "https://www.python.org/ftp/python/%s/python-%s-macosx%s.pkg"
 DEFAULT_PYTHON_VERSION = "2.7.15"
 DEFAULT_OS_VERSION = "10.9"
 
 
+def framework_destination(destination):
+    """Returns the path of the Python.framework for a --destination"""
+    destination = os.path.expanduser(destination)
+    if os.path.basename(destination) != "Python.framework":
+        destination = os.path.join(destination, "Python.framework")
+    return destination
+
+
+class DownloadError(Exception):
+    """Raised when the pkg can't be downloaded"""
+
+
 class FrameworkGetter(object):
     """Handles getting the Python.org pkg and extracting the framework"""
 
     downloaded_pkg_path = ""
-    expanded_path = ""
+    temp_dir = ""
 
     def __init__(
         self,
         python_version=DEFAULT_PYTHON_VERSION,
         os_version=DEFAULT_OS_VERSION,
         base_url=DEFAULT_BASEURL,
+        cache_dir=None,
+        cache_size_limit=DEFAULT_CACHE_SIZE_LIMIT,
+        offline=False,
+        connections=DEFAULT_CONNECTIONS,
     ):
         self.python_version = python_version
         self.os_version = os_version
         self.base_url = base_url
         self.destination = ""
+        self.cache = None
+        if cache_dir:
+            self.cache = DownloadCache(cache_dir, size_limit=cache_size_limit)
+        self.offline = offline
+        self.connections = connections
 
     def __del__(self):
         """Clean up"""
-        if self.expanded_path:
-            shutil.rmtree(self.expanded_path)
-        if self.downloaded_pkg_path:
-            os.unlink(self.downloaded_pkg_path)
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir)
 
-    def download(self):
-        """Downloads a macOS installer pkg from python.org.
-           Returns path to the download."""
+    def url(self):
+        """Returns the URL of the pkg to download"""
         if self.base_url == DEFAULT_BASEURL and \
            not self.os_version.startswith('10'):
             base_url = self.base_url.replace('macosx', 'macos')
         else:
             base_url = self.base_url
-        url = base_url % (
+        return base_url % (
             self.python_version,
             self.python_version,
             self.os_version,
         )
-        (file_handle, destination_path) = tempfile.mkstemp()
-        os.close(file_handle)
-        cmd = [CURL, "--fail", "-o", destination_path, url]
+
+    def download(self):
+        """Downloads a macOS installer pkg from python.org, or finds it in
+           the download cache. Returns path to the download."""
+        url = self.url()
+        if not self.temp_dir:
+            self.temp_dir = tempfile.mkdtemp()
+        if self.cache:
+            key = self.cache.key(self.python_version, self.os_version, url)
+            cached_path = self.cache.lookup(key)
+            if cached_path:
+                print("Using cached download of %s..." % url)
+                self.downloaded_pkg_path = cached_path
+                return cached_path
+        if self.offline:
+            raise DownloadError(
+                "%s is not in the download cache and offline mode is on" % url)
+        if self.cache:
+            # keep partial downloads in the cache so a later run can resume
+            destination_path = self.cache.download_path(key)
+        else:
+            destination_path = os.path.join(self.temp_dir, "download.pkg")
         print("Downloading %s..." % url)
-        subprocess.check_call(cmd)
+        with trace.phase("download"):
+            Downloader(
+                url, destination_path, connections=self.connections
+            ).download()
+        trace.count_bytes(written=os.path.getsize(destination_path))
+        if self.cache:
+            destination_path = self.cache.store(key, destination_path, url)
         self.downloaded_pkg_path = destination_path
-
-    def expand(self):
-        """Uses pkgutil to expand our downloaded pkg. Returns a path to the
-           expanded contents."""
-        self.expanded_path = self.downloaded_pkg_path + "__expanded__"
-        cmd = [
-            PKGUTIL,
-            "--expand",
-            self.downloaded_pkg_path,
-            self.expanded_path,
-        ]
-        print("Expanding %s..." % self.downloaded_pkg_path)
-        subprocess.check_call(cmd)
+        return destination_path
 
     def extract_framework(self):
-        """Extracts the Python framework from the expanded pkg"""
-        payload = os.path.join(
-            self.expanded_path, "Python_Framework.pkg/Payload"
-        )
-        cmd = [DITTO, "-xz", payload, self.destination]
-        print("Extracting %s to %s..." % (payload, self.destination))
-        subprocess.check_call(cmd)
+        """Streams the framework Payload out of our downloaded pkg and
+           extracts it to the destination"""
+        print("Extracting %s from %s to %s..." % (
+            FRAMEWORK_PAYLOAD, self.downloaded_pkg_path, self.destination))
+        reader = XarReader(self.downloaded_pkg_path)
+        with trace.phase("extract"):
+            extract_payload(
+                reader.read_chunks(FRAMEWORK_PAYLOAD), self.destination)
 
     def download_and_extract(self, destination="."):
         """Downloads and extracts the Python framework.
-           Returns path to the framework."""
-        destination = os.path.expanduser(destination)
-        if os.path.basename(destination) != "Python.framework":
-            destination = os.path.join(destination, "Python.framework")
+           Returns path to the framework, or None if it couldn't be
+           downloaded or extracted; a partly extracted framework is
+           removed so a retry can start over."""
+        destination = framework_destination(destination)
         if os.path.exists(destination):
             print(
                 "Destination %s already exists!" % destination, file=sys.stderr
@@ -111,8 +146,10 @@ class FrameworkGetter(object):
         self.destination = destination
         try:
             self.download()
-            self.expand()
             self.extract_framework()
             return destination
-        except subprocess.CalledProcessError as err:
-            sys.exit("%s" % err)
+        except (DownloadError, DownloadFailed, XarError, PayloadError) as err:
+            print("%s" % err, file=sys.stderr)
+            if os.path.exists(destination):
+                shutil.rmtree(destination, ignore_errors=True)
+            return None
@@ -17,10 +17,16 @@
 
 from __future__ import print_function
 
+import hashlib
 import os
+import shutil
 import subprocess
 import sys
 
+from . import parallel, trace, wheelinstall
+
+WHEEL_EXTENSION = ".whl"
+
 
 def ensure_pip(framework_path, version):
     """Ensure pip is installed in our Python framework"""
@@ -32,7 +38,7 @@ def ensure_pip(framework_path, version):
         return
     cmd = [python_path, "-s", "-m", "ensurepip"]
     print("Ensuring pip is installed...")
-    subprocess.check_call(cmd)
+    trace.check_call(cmd)
 
 
 def install(pkgname, framework_path, version):
@@ -45,7 +51,7 @@ def install(pkgname, framework_path, version):
         return
     cmd = [python_path, "-s", "-m", "pip", "install", pkgname]
     print("Installing %s..." % pkgname)
-    subprocess.check_call(cmd)
+    trace.check_call(cmd)
 
 
 def upgrade_pip_install(framework_path, version):
@@ -58,7 +64,7 @@ def upgrade_pip_install(framework_path, version):
         return
     cmd = [python_path, "-s", "-m", "pip", "install", "--upgrade", "pip"]
     print("Upgrading pip installation...")
-    subprocess.check_call(cmd)
+    trace.check_call(cmd)
 
 
 def install_requirements(requirements_file, framework_path, version):
@@ -76,7 +82,202 @@ def install_requirements(requirements_file, framework_path, version):
     pip_env = os.environ
     pip_env["CPPFLAGS"] = "-I%s" % headers_path
     print("Installing modules from %s..." % requirements_file)
-    subprocess.check_call(cmd, env=pip_env)
+    trace.check_call(cmd, env=pip_env)
+
+
+def framework_python(framework_path, version):
+    """Returns the path to the framework's python, or None if it's
+    missing"""
+    python_path = os.path.join(
+        framework_path, "Versions", version, "bin/python" + version
+    )
+    if not os.path.exists(python_path):
+        print("No python at %s" % python_path, file=sys.stderr)
+        return None
+    return python_path
+
+
+def build_env(framework_path, version):
+    """Returns the environment in which to build modules with C
+    extensions against the framework's headers"""
+    headers_path = os.path.abspath(os.path.join(
+        framework_path, "Versions", version, "include/python" + version
+    ))
+    pip_env = dict(os.environ)
+    pip_env["CPPFLAGS"] = "-I%s" % headers_path
+    return pip_env
+
+
+def wheelhouse_dir(wheelhouse, python_path, version):
+    """Returns the subdirectory of wheelhouse holding wheels for the
+    framework's python version and platform"""
+    platform_tag = trace.check_output(
+        [python_path, "-s", "-c",
+         "import sysconfig; print(sysconfig.get_platform())"]
+    ).decode("UTF-8").strip()
+    return os.path.join(
+        os.path.abspath(os.path.expanduser(wheelhouse)),
+        "%s-%s" % (version, platform_tag.replace("-", "_").replace(".", "_")))
+
+
+def wheelhouse_stamp(house, requirements_file, upgrade_pip):
+    """Returns the path of the file marking that house holds every wheel
+    needed for requirements_file. It lists those wheels, one per line"""
+    digest = hashlib.sha256(b"upgrade_pip" if upgrade_pip else b"")
+    if requirements_file:
+        with open(requirements_file, "rb") as fileobj:
+            digest.update(fileobj.read())
+    return os.path.join(house, ".complete-%s" % digest.hexdigest())
+
+
+def build_wheel(python_path, house, sdist, env):
+    """Builds a wheel from a downloaded sdist into house. Returns
+    (sdist, error)"""
+    cmd = [python_path, "-s", "-m", "pip", "wheel", "--no-deps",
+           "--find-links", house, "--wheel-dir", house, sdist]
+    try:
+        trace.check_call(cmd, env=env)
+    except (subprocess.CalledProcessError, OSError) as err:
+        return (sdist, err)
+    return (sdist, None)
+
+
+def read_stamp(stamp):
+    """Returns the wheel filenames listed in stamp, or None if it doesn't
+    exist"""
+    try:
+        with open(stamp) as fileobj:
+            return fileobj.read().split()
+    except (IOError, OSError):
+        return None
+
+
+def wheel_mtimes(house):
+    """Returns the mtime of every wheel in house, by filename"""
+    return dict((entry.name, entry.stat().st_mtime_ns)
+                for entry in os.scandir(house)
+                if entry.name.endswith(WHEEL_EXTENSION))
+
+
+def fill_wheelhouse(framework_path, version, house, requirements_file=None,
+                    upgrade_pip=False, jobs=1):
+    """Downloads every requirement (and wheel, and pip if upgrading) into
+    house and builds wheels from any sdists, several at a time. Returns
+    the filenames of the wheels needed, or None if any couldn't be
+    built"""
+    python_path = framework_python(framework_path, version)
+    if not python_path:
+        return None
+    downloads = os.path.join(house, "downloads")
+    if not os.path.isdir(downloads):
+        os.makedirs(downloads)
+    cmd = [python_path, "-s", "-m", "pip", "download", "--dest", downloads,
+           "--find-links", house, "wheel"]
+    if upgrade_pip:
+        cmd.append("pip")
+    if requirements_file:
+        cmd.extend(["-r", requirements_file])
+    print("Downloading requirements to wheelhouse %s..." % house)
+    trace.check_call(cmd, env=build_env(framework_path, version))
+    sdists = []
+    wheels = []
+    for filename in sorted(os.listdir(downloads)):
+        path = os.path.join(downloads, filename)
+        if filename.endswith(WHEEL_EXTENSION):
+            shutil.move(path, os.path.join(house, filename))
+            wheels.append(filename)
+        else:
+            sdists.append(path)
+    # a wheel rebuilt under an existing filename only changes its mtime
+    before = wheel_mtimes(house)
+    env = build_env(framework_path, version)
+    success = True
+    for sdist, err in parallel.ordered_map(
+            lambda sdist: build_wheel(python_path, house, sdist, env),
+            sdists, jobs):
+        if err:
+            print("Could not build a wheel from %s: %s" % (sdist, err),
+                  file=sys.stderr)
+            success = False
+        else:
+            # the wheel replaces the sdist
+            os.unlink(sdist)
+    if not success:
+        return None
+    after = wheel_mtimes(house)
+    wheels.extend(
+        filename for filename in sorted(after)
+        if after[filename] != before.get(filename) and filename not in wheels)
+    return wheels
+
+
+def install_from_wheelhouse(framework_path, version, house,
+                            requirements_file=None, upgrade_pip=False,
+                            wheel_paths=None):
+    """Installs wheel, an upgraded pip if wanted, and the requirements from
+    house with a single pip invocation that never touches the network.
+    If wheel_paths is given, just those wheels are installed instead"""
+    python_path = framework_python(framework_path, version)
+    if not python_path:
+        return
+    cmd = [python_path, "-s", "-m", "pip", "install", "--no-index",
+           "--find-links", house]
+    if wheel_paths is not None:
+        cmd.extend(wheel_paths)
+    else:
+        if upgrade_pip:
+            cmd.extend(["--upgrade", "pip"])
+        cmd.append("wheel")
+        if requirements_file:
+            cmd.extend(["-r", requirements_file])
+    print("Installing modules from wheelhouse %s..." % house)
+    trace.check_call(cmd, env=build_env(framework_path, version))
+
+
+def install_with_wheelhouse(
+    framework_path,
+    version,
+    wheelhouse,
+    requirements_file=None,
+    upgrade_pip=False,
+    offline=False,
+    jobs=1,
+    direct=False,
+):
+    """Fills the wheelhouse if it doesn't already hold everything needed
+    (unless offline), then installs from it. With direct, wheels that
+    match the framework are unpacked without pip"""
+    python_path = framework_python(framework_path, version)
+    if not python_path:
+        return
+    house = wheelhouse_dir(wheelhouse, python_path, version)
+    if not os.path.isdir(house):
+        os.makedirs(house)
+    stamp = wheelhouse_stamp(house, requirements_file, upgrade_pip)
+    wheels = read_stamp(stamp)
+    if wheels is not None:
+        print("Wheelhouse %s is up to date." % house)
+    elif offline:
+        print("Offline: installing from wheelhouse %s as it is." % house)
+    else:
+        wheels = fill_wheelhouse(framework_path, version, house,
+                                 requirements_file=requirements_file,
+                                 upgrade_pip=upgrade_pip, jobs=jobs)
+        if wheels is not None:
+            with open(stamp, "w") as fileobj:
+                fileobj.write("".join(wheel + "\n" for wheel in wheels))
+    if direct and wheels is not None:
+        # the wheelhouse holds the resolved set, so no resolving is needed
+        leftover = wheelinstall.install_wheels(
+            framework_path, version,
+            [os.path.join(house, wheel) for wheel in wheels], jobs=jobs)
+        if leftover:
+            install_from_wheelhouse(framework_path, version, house,
+                                    wheel_paths=leftover)
+        return
+    install_from_wheelhouse(framework_path, version, house,
+                            requirements_file=requirements_file,
+                            upgrade_pip=upgrade_pip)
 
 
 def install_extras(
@@ -85,8 +286,14 @@ def install_extras(
     requirements_file=None,
     upgrade_pip=False,
     without_pip=False,
+    wheelhouse=None,
+    offline=False,
+    jobs=1,
+    direct_install=False,
 ):
-    """install all extra pkgs into Python framework path"""
+    """install all extra pkgs into Python framework path. With a
+    wheelhouse, wheels are cached there and installed without going to
+    the index"""
     print()
     python_guard_path = (
         os.path.expanduser("~/Library/Python/%s/lib/python/site-packages") % version
@@ -104,7 +311,19 @@ def install_extras(
         print("*********************************************************")
         print()
 
-    if not without_pip:
+    if not without_pip and wheelhouse:
+        ensure_pip(framework_path, version)
+        install_with_wheelhouse(
+            framework_path,
+            version,
+            wheelhouse,
+            requirements_file=requirements_file,
+            upgrade_pip=upgrade_pip,
+            offline=offline,
+            jobs=jobs,
+            direct=direct_install,
+        )
+    elif not without_pip:
         ensure_pip(framework_path, version)
         install("wheel", framework_path, version)
         if upgrade_pip:
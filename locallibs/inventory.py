@@ -0,0 +1,162 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to walk a framework once and share what was found with every
+step that needs to look at its files"""
+
+from __future__ import print_function
+
+import os
+import stat
+
+# how many bytes of each regular file to keep; enough for a Mach-O header
+# or a shebang line
+HEAD_SIZE = 1024
+
+
+class Entry(object):
+    """A file, directory or symlink found by an Inventory"""
+
+    __slots__ = ("path", "kind", "mode", "size", "ino", "mtime_ns", "_head")
+
+    def __init__(self, path, stat_result):
+        self.path = path
+        if stat.S_ISLNK(stat_result.st_mode):
+            self.kind = "symlink"
+        elif stat.S_ISDIR(stat_result.st_mode):
+            self.kind = "dir"
+        elif stat.S_ISREG(stat_result.st_mode):
+            self.kind = "file"
+        else:
+            self.kind = "other"
+        self.mode = stat.S_IMODE(stat_result.st_mode)
+        self.size = stat_result.st_size
+        self.ino = stat_result.st_ino
+        self.mtime_ns = getattr(
+            stat_result, "st_mtime_ns", int(stat_result.st_mtime * 1e9))
+        self._head = None
+
+    @property
+    def identity(self):
+        """The parts of the stat result that identify a version of the
+        file"""
+        return [self.ino, self.size, self.mtime_ns]
+
+    @property
+    def head(self):
+        """The first HEAD_SIZE bytes of a regular file, read on first use
+        so mode fixes can happen before any file is opened"""
+        if self._head is None:
+            if self.kind != "file":
+                self._head = b""
+            else:
+                with open(self.path, "rb") as fileobj:
+                    self._head = fileobj.read(HEAD_SIZE)
+        return self._head
+
+
+class Inventory(object):
+    """Records every entry below root in a single os.scandir walk. Entries
+    are kept in the same order os.walk with sorted names would visit
+    them"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.entries = {}
+        self.children = {}
+        self.scan(self.root)
+
+    def _forget(self, some_dir):
+        """Drops everything recorded below some_dir"""
+        for child in self.children.pop(some_dir, []):
+            self.entries.pop(child, None)
+            self._forget(child)
+
+    def scan(self, some_dir):
+        """(Re)records some_dir and everything below it, for instance after
+        another tool added files there"""
+        some_dir = os.path.abspath(some_dir)
+        self._forget(some_dir)
+        siblings = self.children.get(os.path.dirname(some_dir))
+        if siblings is not None and some_dir in siblings:
+            siblings.remove(some_dir)
+        try:
+            self.entries[some_dir] = Entry(some_dir, os.lstat(some_dir))
+        except OSError:
+            self.entries.pop(some_dir, None)
+            return
+        if siblings is not None:
+            siblings.append(some_dir)
+            siblings.sort(key=os.path.basename)
+        pending = [some_dir]
+        while pending:
+            dirpath = pending.pop()
+            children = []
+            for dir_entry in sorted(os.scandir(dirpath),
+                                    key=lambda item: item.name):
+                entry = Entry(
+                    dir_entry.path, dir_entry.stat(follow_symlinks=False))
+                self.entries[entry.path] = entry
+                children.append(entry.path)
+                if entry.kind == "dir":
+                    pending.append(entry.path)
+            self.children[dirpath] = children
+
+    def refresh(self, path):
+        """Re-records the file at path after it was rewritten"""
+        path = os.path.abspath(path)
+        self.entries[path] = Entry(path, os.lstat(path))
+
+    def remove(self, path):
+        """Forgets path, and everything below it, after it was deleted"""
+        path = os.path.abspath(path)
+        self._forget(path)
+        self.entries.pop(path, None)
+        siblings = self.children.get(os.path.dirname(path))
+        if siblings is not None and path in siblings:
+            siblings.remove(path)
+
+    def walk(self, some_dir=None):
+        """Yields every Entry below some_dir (default: root), parents
+        before children and each directory's files before its
+        subdirectories"""
+        pending = [os.path.abspath(some_dir or self.root)]
+        while pending:
+            children = [
+                self.entries[path]
+                for path in self.children.get(pending.pop(), [])]
+            subdirs = []
+            for entry in children:
+                if entry.kind == "dir":
+                    subdirs.append(entry.path)
+                else:
+                    yield entry
+            for path in subdirs:
+                yield self.entries[path]
+            pending.extend(reversed(subdirs))
+
+    def files(self, some_dir=None):
+        """Returns the regular files (not symlinks) below some_dir"""
+        return [entry for entry in self.walk(some_dir)
+                if entry.kind == "file"]
+
+    def listdir(self, some_dir):
+        """Returns the entries directly inside some_dir"""
+        return [self.entries[path] for path in
+                self.children.get(os.path.abspath(some_dir), [])]
+
+    def get(self, path):
+        """Returns the Entry for path, or None"""
+        return self.entries.get(os.path.abspath(path))
@@ -0,0 +1,569 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to read and rewrite Mach-O load commands without calling otool
+or install_name_tool"""
+
+from __future__ import print_function
+
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+
+from . import trace
+
+MH_MAGIC = 0xFEEDFACE
+MH_CIGAM = 0xCEFAEDFE
+MH_MAGIC_64 = 0xFEEDFACF
+MH_CIGAM_64 = 0xCFFAEDFE
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+
+CPU_TYPE_X86 = 0x7
+CPU_TYPE_ARM = 0xC
+CPU_TYPE_POWERPC = 0x12
+CPU_ARCH_ABI64 = 0x01000000
+# cputypes by the architecture names lipo uses
+CPU_TYPES = {
+    "i386": CPU_TYPE_X86,
+    "x86_64": CPU_TYPE_X86 | CPU_ARCH_ABI64,
+    "arm64": CPU_TYPE_ARM | CPU_ARCH_ABI64,
+    "ppc": CPU_TYPE_POWERPC,
+    "ppc64": CPU_TYPE_POWERPC | CPU_ARCH_ABI64,
+}
+
+MH_EXECUTE = 0x2
+MH_DYLIB = 0x6
+MH_BUNDLE = 0x8
+
+LC_REQ_DYLD = 0x80000000
+LC_SEGMENT = 0x1
+LC_LOAD_DYLIB = 0xC
+LC_ID_DYLIB = 0xD
+LC_SEGMENT_64 = 0x19
+LC_LOAD_WEAK_DYLIB = 0x18 | LC_REQ_DYLD
+LC_RPATH = 0x1C | LC_REQ_DYLD
+LC_CODE_SIGNATURE = 0x1D
+LC_REEXPORT_DYLIB = 0x1F | LC_REQ_DYLD
+LC_LAZY_LOAD_DYLIB = 0x20
+LC_LOAD_UPWARD_DYLIB = 0x23 | LC_REQ_DYLD
+
+# load commands that reference another dylib, in the order otool -L
+# reports them
+DYLIB_LOAD_COMMANDS = (
+    LC_LOAD_DYLIB,
+    LC_LOAD_WEAK_DYLIB,
+    LC_REEXPORT_DYLIB,
+    LC_LAZY_LOAD_DYLIB,
+    LC_LOAD_UPWARD_DYLIB,
+)
+
+# a Java class file also starts with 0xCAFEBABE; its minor/major version
+# takes the place of nfat_arch and is always much larger than this
+MAX_FAT_ARCHS = 30
+
+
+class MachOError(Exception):
+    """Raised when a file can't be parsed as Mach-O"""
+
+
+class MachOSlice(object):
+    """Load command information for a single architecture"""
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+        self.cputype = 0
+        self.cpusubtype = 0
+        self.align = 0
+        self.byteorder = "<"
+        self.is_64 = False
+        self.filetype = 0
+        self.flags = 0
+        self.ncmds = 0
+        self.sizeofcmds = 0
+        self.header_size = 0
+        self.first_section_offset = 0
+        self.commands = []
+        self.install_name = ""
+        self.dependencies = []
+        self.rpaths = []
+        self.segments = []
+        self.code_signature = None
+
+    @property
+    def load_commands_end(self):
+        """Offset (within the slice) of the end of the load commands"""
+        return self.header_size + self.sizeofcmds
+
+    @property
+    def padding(self):
+        """Free bytes between the load commands and the first section"""
+        if not self.first_section_offset:
+            return 0
+        return max(self.first_section_offset - self.load_commands_end, 0)
+
+
+class Segment(object):
+    """Name and file/VM extents of a segment load command"""
+
+    __slots__ = ("name", "cmd", "cmd_offset", "vmaddr", "vmsize", "fileoff",
+                 "filesize")
+
+    def __init__(self, name, cmd, cmd_offset, vmaddr, vmsize, fileoff,
+                 filesize):
+        self.name = name
+        self.cmd = cmd
+        self.cmd_offset = cmd_offset
+        self.vmaddr = vmaddr
+        self.vmsize = vmsize
+        self.fileoff = fileoff
+        self.filesize = filesize
+
+
+class MachO(object):
+    """Install name, dependencies and rpaths of a thin or fat Mach-O file"""
+
+    def __init__(self, path, is_fat, slices):
+        self.path = path
+        self.is_fat = is_fat
+        self.slices = slices
+
+    @property
+    def install_name(self):
+        """The LC_ID_DYLIB name of the first slice that has one"""
+        for item in self.slices:
+            if item.install_name:
+                return item.install_name
+        return ""
+
+    @property
+    def dependencies(self):
+        """Dependencies of all slices, in load command order"""
+        return _merged(item.dependencies for item in self.slices)
+
+    @property
+    def rpaths(self):
+        """LC_RPATH entries of all slices, in load command order"""
+        return _merged(item.rpaths for item in self.slices)
+
+
+def _merged(lists):
+    """Merges lists, dropping duplicates but preserving order"""
+    seen = set()
+    merged = []
+    for some_list in lists:
+        for item in some_list:
+            if item not in seen:
+                seen.add(item)
+                merged.append(item)
+    return merged
+
+
+def _read_lc_str(data, cmd_offset, cmdsize, str_offset):
+    """Returns the NUL-terminated string stored in a load command"""
+    start = cmd_offset + str_offset
+    end = cmd_offset + cmdsize
+    if str_offset >= cmdsize or end > len(data):
+        raise MachOError("Bad string offset in load command")
+    nul = data.find(b"\0", start, end)
+    if nul == -1:
+        nul = end
+    return data[start:nul].decode("utf-8", "surrogateescape")
+
+
+def _parse_sections(data, byteorder, cmd, cmd_offset, nsects):
+    """Returns the lowest non-zero file offset of the sections in a
+    segment command"""
+    if cmd == LC_SEGMENT_64:
+        section_start = cmd_offset + 72
+        section_size = 80
+        offset_field = 48
+    else:
+        section_start = cmd_offset + 56
+        section_size = 68
+        offset_field = 40
+    lowest = 0
+    for index in range(nsects):
+        field = section_start + index * section_size + offset_field
+        (section_offset,) = struct.unpack_from(byteorder + "I", data, field)
+        if section_offset and (not lowest or section_offset < lowest):
+            lowest = section_offset
+    return lowest
+
+
+def parse_slice(data, offset=0, size=None):
+    """Parses the Mach-O header and load commands found at offset in data.
+    Returns a MachOSlice"""
+    if size is None:
+        size = len(data) - offset
+    if size < 28:
+        raise MachOError("File too short for a Mach-O header")
+    (magic,) = struct.unpack_from("<I", data, offset)
+    macho = MachOSlice(offset, size)
+    if magic in (MH_MAGIC, MH_MAGIC_64):
+        macho.byteorder = "<"
+    elif magic in (MH_CIGAM, MH_CIGAM_64):
+        macho.byteorder = ">"
+    else:
+        raise MachOError("Bad Mach-O magic 0x%08x" % magic)
+    macho.is_64 = magic in (MH_MAGIC_64, MH_CIGAM_64)
+    macho.header_size = 32 if macho.is_64 else 28
+    (
+        _magic,
+        macho.cputype,
+        macho.cpusubtype,
+        macho.filetype,
+        macho.ncmds,
+        macho.sizeofcmds,
+        macho.flags,
+    ) = struct.unpack_from(macho.byteorder + "7I", data, offset)
+    if macho.load_commands_end > size:
+        raise MachOError("Load commands extend past end of file")
+
+    byteorder = macho.byteorder
+    # parse relative to the start of the slice
+    view = data[offset:offset + macho.load_commands_end]
+    cmd_offset = macho.header_size
+    for _index in range(macho.ncmds):
+        if cmd_offset + 8 > len(view):
+            raise MachOError("Truncated load command")
+        cmd, cmdsize = struct.unpack_from(byteorder + "2I", view, cmd_offset)
+        if cmdsize < 8 or cmd_offset + cmdsize > len(view):
+            raise MachOError("Bad load command size %d" % cmdsize)
+        macho.commands.append((cmd, cmd_offset, cmdsize))
+        if cmd == LC_ID_DYLIB or cmd in DYLIB_LOAD_COMMANDS:
+            (str_offset,) = struct.unpack_from(
+                byteorder + "I", view, cmd_offset + 8)
+            name = _read_lc_str(view, cmd_offset, cmdsize, str_offset)
+            if cmd == LC_ID_DYLIB:
+                macho.install_name = name
+            else:
+                macho.dependencies.append(name)
+        elif cmd == LC_RPATH:
+            (str_offset,) = struct.unpack_from(
+                byteorder + "I", view, cmd_offset + 8)
+            macho.rpaths.append(
+                _read_lc_str(view, cmd_offset, cmdsize, str_offset))
+        elif cmd == LC_CODE_SIGNATURE:
+            # (load command offset, dataoff, datasize)
+            macho.code_signature = (cmd_offset,) + struct.unpack_from(
+                byteorder + "2I", view, cmd_offset + 8)
+        elif cmd in (LC_SEGMENT, LC_SEGMENT_64):
+            if cmd == LC_SEGMENT_64:
+                fields = struct.unpack_from(
+                    byteorder + "16s4Q", view, cmd_offset + 8)
+                nsects_field = cmd_offset + 64
+            else:
+                fields = struct.unpack_from(
+                    byteorder + "16s4I", view, cmd_offset + 8)
+                nsects_field = cmd_offset + 48
+            macho.segments.append(Segment(
+                fields[0].rstrip(b"\0").decode("ascii", "replace"),
+                cmd, cmd_offset, *fields[1:]))
+            (nsects,) = struct.unpack_from(byteorder + "I", view, nsects_field)
+            lowest = _parse_sections(view, byteorder, cmd, cmd_offset, nsects)
+            if lowest and (not macho.first_section_offset
+                           or lowest < macho.first_section_offset):
+                macho.first_section_offset = lowest
+        cmd_offset += cmdsize
+    return macho
+
+
+def parse_fat_header(data):
+    """Returns a list of (offset, size, cputype, cpusubtype, align) tuples
+    for each architecture in a fat file, or None if data isn't fat"""
+    if len(data) < 8:
+        return None
+    magic, nfat_arch = struct.unpack_from(">2I", data, 0)
+    if magic == FAT_MAGIC:
+        arch_format, arch_size = ">5I", 20
+    elif magic == FAT_MAGIC_64:
+        arch_format, arch_size = ">2i2QI4x", 32
+    else:
+        return None
+    if nfat_arch > MAX_FAT_ARCHS:
+        return None
+    if 8 + nfat_arch * arch_size > len(data):
+        raise MachOError("Truncated fat header")
+    archs = []
+    for index in range(nfat_arch):
+        cputype, cpusubtype, offset, size, align = struct.unpack_from(
+            arch_format, data, 8 + index * arch_size)
+        if offset + size > len(data):
+            raise MachOError("Fat architecture extends past end of file")
+        archs.append((offset, size, cputype, cpusubtype, align))
+    return archs
+
+
+def parse(data, path=""):
+    """Parses a thin or fat Mach-O image held in a bytes-like object.
+    Returns a MachO"""
+    archs = parse_fat_header(data)
+    if archs is None:
+        return MachO(path, False, [parse_slice(data)])
+    slices = []
+    for (offset, size, _cputype, _cpusubtype, align) in archs:
+        macho = parse_slice(data, offset, size)
+        macho.align = align
+        slices.append(macho)
+    return MachO(path, True, slices)
+
+
+def thin(data, cputypes):
+    """Returns a copy of the fat Mach-O image in data holding only the
+    architectures whose cputype is in cputypes: the bare slice if one is
+    left, otherwise a fat image with every slice at its original
+    alignment. Returns None if data isn't fat or nothing would be removed.
+    Raises MachOError if no architecture would be left"""
+    archs = parse_fat_header(data)
+    if archs is None:
+        return None
+    kept = [arch for arch in archs if arch[2] in cputypes]
+    if len(kept) == len(archs):
+        return None
+    if not kept:
+        raise MachOError("No slice for the architectures to keep")
+    if len(kept) == 1:
+        offset, size = kept[0][:2]
+        return bytes(data[offset:offset + size])
+    (magic,) = struct.unpack_from(">I", data)
+    if magic == FAT_MAGIC:
+        arch_format, arch_size = ">5I", 20
+    else:
+        arch_format, arch_size = ">2i2QI4x", 32
+    output = bytearray(struct.pack(">2I", magic, len(kept)))
+    output.extend(b"\0" * (len(kept) * arch_size))
+    for index, (offset, size, cputype, cpusubtype, align) in enumerate(kept):
+        alignment = 1 << align
+        new_offset = (len(output) + alignment - 1) // alignment * alignment
+        output.extend(b"\0" * (new_offset - len(output)))
+        output.extend(data[offset:offset + size])
+        struct.pack_into(arch_format, output, 8 + index * arch_size,
+                         cputype, cpusubtype, new_offset, size, align)
+    return bytes(output)
+
+
+def _thin_file_type(header):
+    """Returns the filetype from a thin Mach-O header, or 0"""
+    if len(header) < 16:
+        return 0
+    (magic,) = struct.unpack_from("<I", header)
+    if magic in (MH_MAGIC, MH_MAGIC_64):
+        return struct.unpack_from("<I", header, 12)[0]
+    if magic in (MH_CIGAM, MH_CIGAM_64):
+        return struct.unpack_from(">I", header, 12)[0]
+    return 0
+
+
+def file_type(some_file, header=None):
+    """Returns the Mach-O filetype (MH_EXECUTE, MH_DYLIB, MH_BUNDLE...) of
+    some_file by reading only its headers, or 0 if it isn't Mach-O. For a
+    fat file the filetype of the first architecture is returned. If the
+    first bytes of the file are passed as header, thin and non-Mach-O files
+    aren't opened at all"""
+    if header is not None:
+        if len(header) < 8:
+            return 0
+        magic, nfat_arch = struct.unpack_from(">2I", header)
+        if magic not in (FAT_MAGIC, FAT_MAGIC_64):
+            return _thin_file_type(header)
+        if not 0 < nfat_arch <= MAX_FAT_ARCHS:
+            return 0
+    with open(some_file, "rb") as fileobj:
+        header = fileobj.read(48)
+        if len(header) < 8:
+            return 0
+        magic, nfat_arch = struct.unpack_from(">2I", header)
+        if magic not in (FAT_MAGIC, FAT_MAGIC_64):
+            return _thin_file_type(header)
+        if not 0 < nfat_arch <= MAX_FAT_ARCHS:
+            return 0
+        if magic == FAT_MAGIC:
+            (offset,) = struct.unpack_from(">I", header, 16)
+        else:
+            (offset,) = struct.unpack_from(">Q", header, 16)
+        fileobj.seek(offset)
+        return _thin_file_type(fileobj.read(16))
+
+
+def read(some_file):
+    """Memory-maps some_file and returns a MachO describing it. Raises
+    MachOError if it isn't a Mach-O file"""
+    with open(some_file, "rb") as fileobj:
+        if os.fstat(fileobj.fileno()).st_size == 0:
+            raise MachOError("%s is empty" % some_file)
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return parse(mapped, some_file)
+        finally:
+            mapped.close()
+
+
+class RewritePlan(object):
+    """All of the load command edits to make to a single file"""
+
+    def __init__(self):
+        self.install_name = None
+        self.changes = {}
+        self.add_rpaths = []
+
+    def __bool__(self):
+        return bool(self.install_name or self.changes or self.add_rpaths)
+
+    __nonzero__ = __bool__
+
+    def set_install_name(self, install_name):
+        """Equivalent of install_name_tool -id"""
+        self.install_name = install_name
+
+    def change(self, old_install_name, new_install_name):
+        """Equivalent of install_name_tool -change"""
+        self.changes[old_install_name] = new_install_name
+
+    def add_rpath(self, rpath):
+        """Equivalent of install_name_tool -add_rpath"""
+        if rpath not in self.add_rpaths:
+            self.add_rpaths.append(rpath)
+
+    def describe(self):
+        """Returns install_name_tool-style arguments describing the plan"""
+        args = []
+        if self.install_name:
+            args.extend(["-id", self.install_name])
+        for old_install_name in sorted(self.changes):
+            args.extend(
+                ["-change", old_install_name, self.changes[old_install_name]])
+        for rpath in self.add_rpaths:
+            args.extend(["-add_rpath", rpath])
+        return args
+
+    def as_dict(self):
+        """Returns the plan as a dict that can be stored as JSON"""
+        return {"install_name": self.install_name,
+                "changes": dict(self.changes),
+                "add_rpaths": list(self.add_rpaths)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Returns a plan made from a dict returned by as_dict"""
+        plan = cls()
+        plan.install_name = data.get("install_name")
+        plan.changes = dict(data.get("changes", {}))
+        plan.add_rpaths = list(data.get("add_rpaths", []))
+        return plan
+
+
+def _build_lc_str(byteorder, cmd, fixed, string, alignment):
+    """Builds a load command made of fixed fields followed by a string"""
+    raw = string.encode("utf-8", "surrogateescape") + b"\0"
+    str_offset = 8 + 4 + len(fixed)
+    cmdsize = str_offset + len(raw)
+    cmdsize += -cmdsize % alignment
+    return (
+        struct.pack(byteorder + "3I", cmd, cmdsize, str_offset)
+        + fixed
+        + raw.ljust(cmdsize - str_offset, b"\0")
+    )
+
+
+def _rewrite_slice(data, macho, plan):
+    """Rewrites the load commands of one slice in data (a bytearray)
+    according to plan. Returns True if anything changed"""
+    byteorder = macho.byteorder
+    alignment = 8 if macho.is_64 else 4
+    base = macho.offset
+    existing_rpaths = set(macho.rpaths)
+    new_commands = []
+    for (cmd, cmd_offset, cmdsize) in macho.commands:
+        start = base + cmd_offset
+        original = bytes(data[start:start + cmdsize])
+        new_name = None
+        if cmd == LC_ID_DYLIB and plan.install_name:
+            new_name = plan.install_name
+        elif cmd in DYLIB_LOAD_COMMANDS:
+            (str_offset,) = struct.unpack_from(byteorder + "I", original, 8)
+            name = _read_lc_str(original, 0, cmdsize, str_offset)
+            new_name = plan.changes.get(name)
+        if new_name is None:
+            new_commands.append(original)
+        else:
+            # keep timestamp, current_version and compatibility_version
+            new_commands.append(_build_lc_str(
+                byteorder, cmd, original[12:24], new_name, alignment))
+    for rpath in plan.add_rpaths:
+        if rpath not in existing_rpaths:
+            new_commands.append(
+                _build_lc_str(byteorder, LC_RPATH, b"", rpath, alignment))
+
+    new_sizeofcmds = sum(len(item) for item in new_commands)
+    if macho.first_section_offset:
+        limit = macho.first_section_offset
+    else:
+        limit = macho.load_commands_end
+    if macho.header_size + new_sizeofcmds > limit:
+        raise MachOError(
+            "Not enough header padding: load commands need %d bytes but only "
+            "%d are available"
+            % (new_sizeofcmds, limit - macho.header_size))
+    old_end = base + macho.load_commands_end
+    new_end = base + macho.header_size + new_sizeofcmds
+    region = slice(base + macho.header_size, max(old_end, new_end))
+    new_region = b"".join(new_commands).ljust(
+        region.stop - region.start, b"\0")
+    counts = slice(base + 16, base + 24)
+    new_counts = struct.pack(
+        byteorder + "2I", len(new_commands), new_sizeofcmds)
+    if data[region] == new_region and data[counts] == new_counts:
+        return False
+    data[region] = new_region
+    data[counts] = new_counts
+    return True
+
+
+def rewrite(some_file, plan, sha256=None):
+    """Applies every edit in plan to every slice of some_file with a single
+    read and a single write. Raises MachOError without touching the file if
+    any slice lacks the header padding to hold its new load commands.
+    Returns False, without writing, if the file already matched plan, and
+    None if sha256 is given and the file's contents don't have that hash"""
+    with open(some_file, "rb") as fileobj:
+        data = bytearray(fileobj.read())
+    trace.count_bytes(read=len(data))
+    if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256:
+        return None
+    parsed = parse(data, some_file)
+    changed = False
+    for macho in parsed.slices:
+        try:
+            changed = _rewrite_slice(data, macho, plan) or changed
+        except MachOError as err:
+            raise MachOError("Can't rewrite %s: %s" % (some_file, err))
+    if not changed:
+        return False
+    temp_path = some_file + ".rewrite"
+    try:
+        with open(temp_path, "wb") as fileobj:
+            fileobj.write(data)
+        trace.count_bytes(written=len(data))
+        shutil.copymode(some_file, temp_path)
+        os.rename(temp_path, some_file)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return True
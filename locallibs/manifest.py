@@ -0,0 +1,164 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to remember per-file analysis results between runs so unchanged
+files aren't analyzed, rewritten or signed again"""
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+
+from .cache import file_sha256
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(framework_path):
+    """Returns the path of the manifest kept next to framework_path"""
+    framework_path = os.path.abspath(framework_path).rstrip("/")
+    return os.path.join(
+        os.path.dirname(framework_path),
+        "." + os.path.basename(framework_path) + ".manifest.json")
+
+
+class Manifest(object):
+    """Maps each file in a framework, by relative path, to its stat
+    identity, content hash (Mach-O files only), analysis result and whether
+    it has been rewritten and signed. Also remembers the install name
+    prefix found by the first analysis and every install name changed so
+    far"""
+
+    def __init__(self, framework_path, load=True):
+        self.framework_path = os.path.abspath(framework_path)
+        self.path = manifest_path(framework_path)
+        self.entries = {}
+        self.prefix = ""
+        self.renames = {}
+        self._lock = threading.Lock()
+        if not load:
+            return
+        try:
+            with open(self.path) as fileobj:
+                data = json.load(fileobj)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("files", {})
+                self.prefix = data.get("prefix", "")
+                self.renames = data.get("renames", {})
+        except (IOError, OSError, ValueError):
+            pass
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    __nonzero__ = __bool__
+
+    def _key(self, filepath):
+        """Returns the manifest key for filepath"""
+        return os.path.relpath(filepath, self.framework_path)
+
+    @staticmethod
+    def _identity(stat_result):
+        """Returns the parts of a stat result that identify a version of a
+        file"""
+        return [stat_result.st_ino, stat_result.st_size,
+                getattr(stat_result, "st_mtime_ns",
+                        int(stat_result.st_mtime * 1e9))]
+
+    def lookup(self, filepath, identity=None):
+        """Returns (True, result) if filepath is unchanged since its analysis
+        result was recorded, otherwise (False, None). identity is
+        [st_ino, st_size, st_mtime_ns] if the caller already has it"""
+        entry = self.entries.get(self._key(filepath))
+        if entry is None:
+            return (False, None)
+        if identity is None:
+            identity = self._identity(os.stat(filepath))
+        if entry["stat"] != identity:
+            # stat changed; a Mach-O file might still have the same bytes
+            if not entry.get("sha256") or entry["stat"][1] != identity[1] \
+                    or file_sha256(filepath) != entry["sha256"]:
+                return (False, None)
+            with self._lock:
+                entry["stat"] = identity
+        return (True, entry["result"])
+
+    def record(self, filepath, result):
+        """Records the analysis result for filepath. result is None or a
+        dict holding its category, install_name, dependencies and rpaths"""
+        entry = {
+            "stat": self._identity(os.stat(filepath)),
+            "result": result,
+            "sha256": file_sha256(filepath) if result else None,
+            "rewritten": False,
+            "signed": False,
+        }
+        with self._lock:
+            old_entry = self.entries.get(self._key(filepath))
+            if old_entry and old_entry.get("sha256") == entry["sha256"]:
+                entry["rewritten"] = old_entry.get("rewritten", False)
+                entry["signed"] = old_entry.get("signed", False)
+            self.entries[self._key(filepath)] = entry
+
+    def mark(self, filepaths, result_for, rewritten=None, signed=None):
+        """Re-records filepaths after they were modified, using result_for
+        to get each fresh analysis result, and updates their flags"""
+        for filepath in filepaths:
+            self.record(filepath, result_for(filepath))
+            entry = self.entries[self._key(filepath)]
+            if rewritten is not None:
+                entry["rewritten"] = rewritten
+            if signed is not None:
+                entry["signed"] = signed
+
+    def unsigned(self):
+        """Returns paths of files that were rewritten but never signed"""
+        return sorted(
+            os.path.join(self.framework_path, key)
+            for (key, entry) in self.entries.items()
+            if entry.get("rewritten") and not entry.get("signed")
+            and os.path.exists(os.path.join(self.framework_path, key)))
+
+    def prune(self, filepaths):
+        """Drops entries for files that are no longer in filepaths"""
+        keep = set(self._key(filepath) for filepath in filepaths)
+        for key in list(self.entries):
+            if key not in keep:
+                del self.entries[key]
+
+    def retarget(self, framework_path):
+        """Points the manifest at a copy of its framework, taking the stat
+        identities of the copied files since those differ from the
+        originals"""
+        self.framework_path = os.path.abspath(framework_path)
+        self.path = manifest_path(framework_path)
+        for key, entry in list(self.entries.items()):
+            try:
+                stat_result = os.lstat(
+                    os.path.join(self.framework_path, key))
+            except OSError:
+                del self.entries[key]
+                continue
+            entry["stat"] = self._identity(stat_result)
+
+    def save(self):
+        """Writes the manifest"""
+        temp_path = self.path + ".temp"
+        with open(temp_path, "w") as fileobj:
+            json.dump({"version": MANIFEST_VERSION, "prefix": self.prefix,
+                       "renames": self.renames, "files": self.entries},
+                      fileobj, sort_keys=True)
+        os.rename(temp_path, self.path)
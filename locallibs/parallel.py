@@ -0,0 +1,33 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to spread work across a pool of worker threads"""
+
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_map(func, items, jobs=1):
+    """Yields func(item) for each item, in the order of items, using up to
+    jobs worker threads. With jobs of 1 or less everything runs in the
+    calling thread"""
+    if jobs is None or jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(func, items):
+            yield result
@@ -0,0 +1,315 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to stream-extract a pkg Payload (gzip or pbzx compressed cpio)
+without ditto"""
+
+from __future__ import print_function
+
+import lzma
+import os
+import stat
+import struct
+import zlib
+
+from . import trace
+
+CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+PBZX_MAGIC = b"pbzx"
+CPIO_TRAILER = "TRAILER!!!"
+
+
+class PayloadError(Exception):
+    """Raised when a Payload can't be decoded or extracted"""
+
+
+class ChunkReader(object):
+    """File-like reader over an iterable of byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self._offset = 0
+
+    def read(self, size):
+        """Returns up to size bytes; fewer only at the end of the stream"""
+        pieces = []
+        while size > 0:
+            if self._offset >= len(self._buffer):
+                self._buffer = next(self._chunks, b"")
+                self._offset = 0
+                if not self._buffer:
+                    break
+            piece = self._buffer[self._offset:self._offset + size]
+            self._offset += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+        return b"".join(pieces)
+
+    def read_exactly(self, size):
+        """Returns exactly size bytes or raises PayloadError"""
+        data = self.read(size)
+        if len(data) != size:
+            raise PayloadError("Unexpected end of Payload")
+        return data
+
+    def peek(self, size):
+        """Returns the next size bytes without consuming them"""
+        data = self.read(size)
+        self._buffer = data + self._buffer[self._offset:]
+        self._offset = 0
+        return data
+
+    def chunks(self):
+        """Yields the rest of the stream"""
+        if self._offset < len(self._buffer):
+            yield self._buffer[self._offset:]
+        self._buffer = b""
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _gunzip(reader):
+    """Yields decompressed chunks of a gzip stream"""
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in reader.chunks():
+        data = decoder.decompress(chunk)
+        if data:
+            yield data
+    tail = decoder.flush()
+    if tail:
+        yield tail
+
+
+def _unpbzx(reader):
+    """Yields decompressed chunks of a pbzx stream: a header followed by
+    (uncompressed size, compressed size, data) records, each xz compressed
+    unless the two sizes are equal"""
+    reader.read_exactly(12)
+    while True:
+        header = reader.read(16)
+        if not header:
+            return
+        if len(header) != 16:
+            raise PayloadError("Truncated pbzx chunk header")
+        uncompressed_size, compressed_size = struct.unpack(">QQ", header)
+        data = reader.read_exactly(compressed_size)
+        if compressed_size == uncompressed_size:
+            yield data
+        else:
+            try:
+                yield lzma.decompress(data)
+            except lzma.LZMAError as err:
+                raise PayloadError("Bad xz chunk in pbzx Payload: %s" % err)
+
+
+def decompressed_chunks(chunks):
+    """Yields the decompressed contents of a gzip, pbzx or uncompressed
+    Payload given as an iterable of byte chunks"""
+    reader = ChunkReader(chunks)
+    magic = reader.peek(4)
+    if magic.startswith(GZIP_MAGIC):
+        return _gunzip(reader)
+    if magic == PBZX_MAGIC:
+        return _unpbzx(reader)
+    if magic.startswith(b"0707"):
+        return reader.chunks()
+    raise PayloadError("Unknown Payload format")
+
+
+def _read_cpio_header(reader):
+    """Returns a dict describing the next cpio entry"""
+    magic = reader.read_exactly(6)
+    if magic == b"070707":
+        fields = reader.read_exactly(70)
+        values = [
+            int(fields[start:start + size], 8)
+            for (start, size) in (
+                (0, 6), (6, 6), (12, 6), (30, 6), (42, 11), (53, 6), (59, 11))
+        ]
+        entry = dict(zip(
+            ("dev", "ino", "mode", "nlink", "mtime", "namesize", "filesize"),
+            values))
+        entry["name"] = reader.read_exactly(entry["namesize"])
+        entry["padding"] = 0
+        entry["format"] = "odc"
+    elif magic in (b"070701", b"070702"):
+        fields = reader.read_exactly(104)
+        values = [int(fields[index:index + 8], 16)
+                  for index in range(0, 104, 8)]
+        entry = {
+            "ino": values[0], "mode": values[1], "nlink": values[4],
+            "mtime": values[5], "filesize": values[6],
+            "dev": (values[7], values[8]), "namesize": values[11],
+        }
+        entry["name"] = reader.read_exactly(entry["namesize"])
+        reader.read_exactly(-(110 + entry["namesize"]) % 4)
+        entry["padding"] = -entry["filesize"] % 4
+        entry["format"] = "newc"
+    else:
+        raise PayloadError("Bad cpio header magic %r" % magic)
+    entry["name"] = entry["name"].rstrip(b"\0").decode(
+        "utf-8", "surrogateescape")
+    return entry
+
+
+def _safe_path(destination, name):
+    """Returns the path at which to extract name, refusing anything that
+    would land outside destination"""
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise PayloadError("Refusing to extract %s" % name)
+    return os.path.join(destination, *parts) if parts else destination
+
+
+def _check_parents(name, path, checked):
+    """Refuses to extract name to path if a directory between path and the
+    destination, which is in checked, is a symlink, since the entry would
+    land wherever it points. Directories found to be real are added to
+    checked"""
+    pending = []
+    directory = os.path.dirname(path)
+    while directory not in checked:
+        pending.append(directory)
+        directory = os.path.dirname(directory)
+    for directory in reversed(pending):
+        try:
+            mode = os.lstat(directory).st_mode
+        except OSError:
+            # it will be created as a real directory
+            return
+        if stat.S_ISLNK(mode):
+            raise PayloadError("Refusing to extract %s through the symlink %s"
+                               % (name, directory))
+        checked.add(directory)
+
+
+def _check_link_target(name, target):
+    """Refuses a symlink named name whose target is absolute or could
+    resolve outside the destination: ".." may only lead the target, and
+    may not climb above the top of the destination"""
+    if target.startswith("/"):
+        raise PayloadError("Refusing absolute symlink %s -> %s"
+                           % (name, target))
+    parts = [part for part in target.split("/") if part not in ("", ".")]
+    ups = 0
+    while ups < len(parts) and parts[ups] == "..":
+        ups += 1
+    depth = len([part for part in name.split("/")
+                 if part not in ("", ".")]) - 1
+    if ".." in parts[ups:] or ups > depth:
+        raise PayloadError("Refusing symlink %s -> %s leading outside the "
+                           "destination" % (name, target))
+
+
+def _copy_data(reader, path, size):
+    """Streams size bytes from reader into a new file at path"""
+    trace.count_bytes(written=size)
+    with open(path, "wb") as fileobj:
+        while size:
+            data = reader.read_exactly(min(CHUNK_SIZE, size))
+            fileobj.write(data)
+            size -= len(data)
+
+
+def _skip(reader, size):
+    """Discards size bytes from reader"""
+    while size:
+        size -= len(reader.read_exactly(min(CHUNK_SIZE, size)))
+
+
+def extract_cpio(chunks, destination):
+    """Extracts an odc or newc cpio stream, given as an iterable of byte
+    chunks, into destination, keeping modes, mtimes, symlinks and
+    hardlinks. Entries that would be written through a symlink, and
+    symlinks that could point outside destination, are refused. Returns
+    the number of entries extracted"""
+    reader = ChunkReader(chunks)
+    destination = os.path.abspath(destination)
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    # directories inside destination known not to be symlinks
+    checked = set([destination])
+    links = {}
+    pending_links = {}
+    directories = []
+    count = 0
+    while True:
+        entry = _read_cpio_header(reader)
+        if entry["name"] == CPIO_TRAILER:
+            break
+        path = _safe_path(destination, entry["name"])
+        if path != destination:
+            _check_parents(entry["name"], path, checked)
+        mode = entry["mode"]
+        size = entry["filesize"]
+        link_key = (entry["dev"], entry["ino"])
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if stat.S_ISDIR(mode):
+            if not os.path.isdir(path):
+                os.mkdir(path, 0o700)
+            directories.append((path, entry))
+            _skip(reader, size)
+        elif stat.S_ISLNK(mode):
+            target = reader.read_exactly(size).decode(
+                "utf-8", "surrogateescape")
+            _check_link_target(entry["name"], target)
+            if os.path.lexists(path):
+                os.unlink(path)
+            os.symlink(target, path)
+        elif stat.S_ISREG(mode):
+            if os.path.lexists(path):
+                os.unlink(path)
+            if entry["nlink"] > 1 and links.get(link_key, path) != path:
+                # odc repeats the data for every link; newc stores it once
+                os.link(links[link_key], path)
+                _skip(reader, size)
+            elif entry["nlink"] > 1 and size == 0 \
+                    and entry["format"] == "newc":
+                # newc puts the data on the last link; create the others
+                # once it arrives
+                pending_links.setdefault(link_key, []).append(path)
+            else:
+                _copy_data(reader, path, size)
+                os.chmod(path, stat.S_IMODE(mode))
+                os.utime(path, (entry["mtime"], entry["mtime"]))
+                if entry["nlink"] > 1:
+                    links[link_key] = path
+                    for other_path in pending_links.pop(link_key, []):
+                        os.link(path, other_path)
+        else:
+            # device nodes, fifos and sockets don't belong in a framework
+            _skip(reader, size)
+        _skip(reader, entry["padding"])
+        count += 1
+    for paths in pending_links.values():
+        # links whose data never arrived are empty files
+        for path in paths:
+            open(path, "wb").close()
+    # set directory modes last so read-only directories can be filled
+    for path, entry in reversed(directories):
+        os.chmod(path, stat.S_IMODE(entry["mode"]))
+        os.utime(path, (entry["mtime"], entry["mtime"]))
+    return count
+
+
+def extract_payload(chunks, destination):
+    """Decompresses and extracts a pkg Payload, given as an iterable of
+    byte chunks, into destination. Returns the number of entries
+    extracted"""
+    return extract_cpio(decompressed_chunks(chunks), destination)
@@ -0,0 +1,204 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to run build steps as a dependency graph, several at a time,
+resuming after a failure from the steps that completed"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+import traceback
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import trace
+
+STATE_VERSION = 1
+DEFAULT_WORKERS = 4
+
+
+def state_path(framework_path):
+    """Returns the path of the build state kept next to framework_path"""
+    framework_path = os.path.abspath(framework_path).rstrip("/")
+    return os.path.join(
+        os.path.dirname(framework_path),
+        "." + os.path.basename(framework_path) + ".build.json")
+
+
+class Step(object):
+    """A named unit of work and the names of the steps it requires"""
+
+    __slots__ = ("name", "func", "requires", "retries", "attempts", "start",
+                 "finish")
+
+    def __init__(self, name, func, requires, retries):
+        self.name = name
+        self.func = func
+        self.requires = requires
+        self.retries = retries
+        self.attempts = 0
+        self.start = None
+        self.finish = None
+
+    @property
+    def seconds(self):
+        """How long the step's last attempt took"""
+        return self.finish - self.start
+
+
+class Pipeline(object):
+    """Runs each step as soon as every step it requires has completed. A
+    step fails if it returns False or raises; it is retried up to its
+    retries, after which no new steps start. Steps share the JSON-able
+    values in state. With a path, the completed steps and state are saved
+    after every step so a later run with the same key can resume"""
+
+    def __init__(self, path=None, key="", workers=DEFAULT_WORKERS):
+        self.path = path
+        self.key = key
+        self.workers = workers
+        self.steps = []
+        self.state = {}
+        self.completed = set()
+        self.started = None
+
+    def add(self, name, func, requires=(), retries=0):
+        """Adds a step. Requirements on steps that were never added are
+        ignored, so optional steps can be left out"""
+        self.steps.append(Step(name, func, list(requires), retries))
+
+    def _step_names(self):
+        """Returns the names of all added steps"""
+        return set(step.name for step in self.steps)
+
+    def resume(self):
+        """Loads the completed steps and state of an earlier run with the
+        same key. Returns the names of the steps that will be skipped"""
+        try:
+            with open(self.path) as fileobj:
+                data = json.load(fileobj)
+        except (IOError, OSError, ValueError):
+            return []
+        if data.get("version") != STATE_VERSION or \
+                data.get("key") != self.key:
+            return []
+        self.state.clear()
+        self.state.update(data.get("state", {}))
+        self.completed = set(data.get("completed", [])) & self._step_names()
+        return [step.name for step in self.steps
+                if step.name in self.completed]
+
+    def save(self):
+        """Writes the completed steps and state"""
+        if not self.path:
+            return
+        temp_path = self.path + ".temp"
+        with open(temp_path, "w") as fileobj:
+            json.dump({"version": STATE_VERSION, "key": self.key,
+                       "completed": sorted(self.completed),
+                       "state": dict(self.state)}, fileobj, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def discard(self):
+        """Removes the saved state, once there is nothing to resume"""
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _ready(self, running):
+        """Returns the steps whose requirements have all completed"""
+        names = self._step_names()
+        return [
+            step for step in self.steps
+            if step.name not in self.completed and step not in running
+            and all(name in self.completed or name not in names
+                    for name in step.requires)]
+
+    @staticmethod
+    def _attempt(step):
+        """Runs step once. Returns a boolean to indicate success"""
+        step.attempts += 1
+        step.start = time.time()
+        try:
+            with trace.phase(step.name):
+                result = step.func()
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+            result = False
+        step.finish = time.time()
+        return result is not False
+
+    def run(self):
+        """Runs every step that hasn't completed. Returns False if a step
+        failed for good"""
+        self.started = time.time()
+        failed = False
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                if not failed:
+                    for step in self._ready(running.values()):
+                        running[executor.submit(self._attempt, step)] = step
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    if future.result():
+                        self.completed.add(step.name)
+                        self.save()
+                    elif step.attempts <= step.retries:
+                        print("Step %s failed; retrying..." % step.name,
+                              file=sys.stderr)
+                        running[executor.submit(self._attempt, step)] = step
+                    else:
+                        print("Step %s failed" % step.name, file=sys.stderr)
+                        failed = True
+        return not failed and self._step_names() <= self.completed
+
+    def critical_path(self):
+        """Returns the steps run this time that bounded the build's length,
+        from first to last: the last step to finish, the required step
+        that finished last before it started, and so on"""
+        timed = dict((step.name, step) for step in self.steps
+                     if step.finish is not None)
+        path = []
+        step = max(timed.values(), key=lambda item: item.finish, default=None)
+        while step is not None:
+            path.append(step)
+            gating = [timed[name] for name in step.requires if name in timed]
+            step = max(gating, key=lambda item: item.finish, default=None)
+        return list(reversed(path))
+
+    def report(self):
+        """Prints when each step ran and how long it took, marking the
+        steps on the critical path"""
+        critical = self.critical_path()
+        if not critical:
+            return
+        total = max(step.finish for step in critical) - self.started
+        print()
+        print("%-16s %9s %9s" % ("Step", "Start", "Seconds"))
+        for step in sorted((step for step in self.steps
+                            if step.finish is not None),
+                           key=lambda item: item.start):
+            print("%-16s %9.2f %9.2f %s" % (
+                step.name, step.start - self.started, step.seconds,
+                "*" if step in critical else ""))
+        print("Critical path: %s (%.2f of %.2f seconds)" % (
+            " -> ".join(step.name for step in critical),
+            sum(step.seconds for step in critical), total))
@@ -0,0 +1,86 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to precompile the framework's stdlib and site-packages"""
+
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from . import trace
+
+COMPILE_WORKER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "compile_worker.py")
+# unchecked-hash pycs arrived in Python 3.7
+MIN_VERSION = (3, 7)
+
+
+def parse_levels(text):
+    """Converts a comma separated list of optimization levels like "0,2"
+    into a list of ints"""
+    levels = sorted(set(int(level) for level in text.split(",") if level))
+    if not levels or any(level not in (0, 1, 2) for level in levels):
+        raise ValueError("Optimization levels must be 0, 1 or 2")
+    return levels
+
+
+def precompile(framework_path, version, levels=(0,)):
+    """Compiles every .py file in the framework's stdlib and site-packages
+    at each optimization level in levels, on every core, using the
+    framework's own python. The pycs use unchecked-hash invalidation so
+    relocating or copying the framework never makes them stale. Reports
+    the compile time and bytecode size added per package. Returns False
+    if compiling couldn't be run"""
+    if tuple(int(part) for part in version.split(".")) < MIN_VERSION:
+        print("Skipping precompilation: Python %s has no unchecked-hash pycs"
+              % version)
+        return True
+    python_path = os.path.join(
+        framework_path, "Versions", version, "bin/python" + version
+    )
+    if not os.path.exists(python_path):
+        print("No python at %s" % python_path, file=sys.stderr)
+        return False
+    lib_dir = os.path.abspath(os.path.join(
+        framework_path, "Versions", version, "lib", "python" + version))
+    roots = [["stdlib", lib_dir],
+             ["site-packages", os.path.join(lib_dir, "site-packages")]]
+    print("Precompiling %s at optimization levels %s..."
+          % (lib_dir, ", ".join(str(level) for level in levels)))
+    start = time.time()
+    try:
+        output = trace.check_output(
+            [python_path, "-s", COMPILE_WORKER,
+             json.dumps(roots), json.dumps(list(levels))])
+    except (subprocess.CalledProcessError, OSError) as err:
+        print("Could not precompile: %s" % err, file=sys.stderr)
+        return False
+    packages = [json.loads(line)
+                for line in output.decode("UTF-8").splitlines()
+                if line.startswith("{")]
+    packages.sort(key=lambda stats: stats["seconds"], reverse=True)
+    for stats in packages:
+        print("  %-50s %5d files %7.2f s %9.1f KB%s" % (
+            stats["package"], stats["files"], stats["seconds"],
+            stats["bytes"] / 1024.0,
+            " (%d failed)" % stats["errors"] if stats["errors"] else ""))
+    print("Precompiled %d files in %.1f seconds, adding %.1f MB of bytecode"
+          % (sum(stats["files"] for stats in packages), time.time() - start,
+             sum(stats["bytes"] for stats in packages) / 1048576.0))
+    return True
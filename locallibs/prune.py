@@ -0,0 +1,131 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to remove parts of the framework that aren't needed"""
+
+from __future__ import print_function
+
+import fnmatch
+import os
+import shutil
+
+from .inventory import Inventory
+
+# glob patterns, relative to Versions/<version>, for each removable
+# component. "*" matches across directories
+COMPONENTS = {
+    "tests": [
+        "lib/python%(version)s/test",
+        "lib/python%(version)s/*/test",
+        "lib/python%(version)s/*/tests",
+        "lib/python%(version)s/idlelib/idle_test",
+    ],
+    "idle": [
+        "bin/idle*",
+        "lib/python%(version)s/idlelib",
+    ],
+    "tkinter": [
+        "lib/python%(version)s/tkinter",
+        "lib/python%(version)s/turtle.py",
+        "lib/python%(version)s/turtledemo",
+        "lib/python%(version)s/lib-dynload/_tkinter.*",
+        "lib/libtcl*",
+        "lib/libtk*",
+        "lib/tcl8*",
+        "lib/tk8*",
+        "lib/itcl*",
+        "lib/thread2*",
+        "lib/tdbc*",
+    ],
+    "ensurepip": [
+        "lib/python%(version)s/ensurepip",
+    ],
+    "static-libs": [
+        "lib/*.a",
+        "lib/python%(version)s/config-*/*.a",
+    ],
+    "optimized-pycs": [
+        "lib/*/__pycache__/*.opt-1.pyc",
+        "lib/*/__pycache__/*.opt-2.pyc",
+    ],
+}
+PROFILES = {
+    "tests": ["tests"],
+    "headless": ["tests", "idle", "tkinter"],
+    "minimal": ["tests", "idle", "tkinter", "ensurepip", "static-libs",
+                "optimized-pycs"],
+}
+# components install_extras needs, so they can only go after it has run
+PIP_COMPONENTS = ("ensurepip",)
+
+
+def components_for(profile):
+    """Returns the component names for a profile name"""
+    return list(PROFILES[profile])
+
+
+def matching_entries(inventory, version_dir, patterns):
+    """Returns inventory entries below version_dir matching any of
+    patterns. Nothing below a matching directory is returned separately"""
+    matches = []
+    covered_dirs = set()
+    for entry in inventory.walk(version_dir):
+        if os.path.dirname(entry.path) in covered_dirs:
+            if entry.kind == "dir":
+                covered_dirs.add(entry.path)
+            continue
+        relative_path = os.path.relpath(entry.path, version_dir)
+        if any(fnmatch.fnmatchcase(relative_path, pattern)
+               for pattern in patterns):
+            matches.append(entry)
+            if entry.kind == "dir":
+                covered_dirs.add(entry.path)
+    return matches
+
+
+def totals(inventory, some_dir):
+    """Returns (file count, total bytes) for regular files below
+    some_dir"""
+    files = inventory.files(some_dir)
+    return (len(files), sum(entry.size for entry in files))
+
+
+def prune(framework_path, version, components, inventory=None):
+    """Removes the named components from the framework and reports its
+    file count and size before and after. Keeps the inventory up to
+    date"""
+    if not components:
+        return
+    framework_path = os.path.abspath(framework_path)
+    if inventory is None:
+        inventory = Inventory(framework_path)
+    version_dir = os.path.join(framework_path, "Versions", version)
+    patterns = [
+        pattern % {"version": version}
+        for name in components for pattern in COMPONENTS[name]
+    ]
+    before = totals(inventory, framework_path)
+    print("Pruning %s from %s..." % (", ".join(components), framework_path))
+    for entry in matching_entries(inventory, version_dir, patterns):
+        if entry.kind == "dir":
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+        inventory.remove(entry.path)
+    after = totals(inventory, framework_path)
+    print("Before: %d files, %.1f MB. After: %d files, %.1f MB. "
+          "Removed %d files, %.1f MB."
+          % (before[0], before[1] / 1048576.0, after[0], after[1] / 1048576.0,
+             before[0] - after[0], (before[1] - after[1]) / 1048576.0))
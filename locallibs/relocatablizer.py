@@ -17,28 +17,31 @@
 
 from __future__ import print_function
 
+import functools
 import os
-import subprocess
 import sys
 
-CHMOD = "/bin/chmod"
-OTOOL = "/usr/bin/otool"
-INSTALL_NAME_TOOL = "/usr/bin/install_name_tool"
-FILETOOL = "/usr/bin/file"
+from . import macho, parallel, trace
+from .cache import file_sha256
+from .inventory import Inventory
+from .relocationplan import RelocationPlan
 
 
-def run(cmd):
-    """Prints and executes cmd"""
-    print(" ".join(cmd))
-    subprocess.check_call(cmd)
-
-
-def fix_modes(framework_dir):
+def fix_modes(framework_dir, inventory=None):
     """Make sure all files are set so owner can read/write and everyone else
-       can only read"""
-    cmd = [CHMOD, "-R", "u+rw,g+r,g-w,o+r,o-w", framework_dir]
+       can only read. Like chmod -R u+rw,g+r,g-w,o+r,o-w, but only entries
+       whose mode actually changes are touched"""
     print("Ensuring correct modes for files in %s..." % framework_dir)
-    subprocess.check_call(cmd)
+    if inventory is None:
+        inventory = Inventory(framework_dir)
+    entries = [inventory.get(framework_dir)] + list(inventory.walk())
+    for entry in entries:
+        if entry.kind not in ("file", "dir"):
+            continue
+        new_mode = (entry.mode | 0o644) & ~0o022
+        if new_mode != entry.mode:
+            os.chmod(entry.path, new_mode)
+            entry.mode = new_mode
 
 
 def framework_dir(some_file):
@@ -66,127 +69,93 @@ def framework_lib_name(some_file):
     return os.path.splitext(framework_name(some_file))[0]
 
 
-def relativize_install_name(some_file):
-    """Replaces original install name with an rpath; returns new
-    install_name"""
-    original_install_name = get_install_name(some_file)
+def relativize_install_name(some_file, original_install_name):
+    """Returns an rpath-based install name to replace original_install_name,
+    or original_install_name if it doesn't need replacing"""
     if original_install_name and not original_install_name.startswith("@"):
         framework_loc = framework_dir(some_file)
-        new_install_name = os.path.join(
+        return os.path.join(
             "@rpath", os.path.relpath(some_file, framework_loc)
         )
-        cmd = [INSTALL_NAME_TOOL, "-id", new_install_name, some_file]
-        run(cmd)
-        return new_install_name
     return original_install_name
 
 
-def fix_dep(some_file, old_install_name, new_install_name):
-    """Updates old_install_name to new_install_name inside some file"""
-    cmd = [
-        INSTALL_NAME_TOOL,
-        "-change",
-        old_install_name,
-        new_install_name,
-        some_file,
-    ]
-    run(cmd)
-
-
 def get_rpaths(some_file):
     """returns rpaths stored in an executable"""
-    cmd = [OTOOL, "-l", some_file]
-    output_lines = subprocess.check_output(cmd).decode("utf-8").splitlines()
-    rpaths = []
-    for (index, line) in enumerate(output_lines):
-        if "cmd LC_RPATH" in line and index + 2 <= len(output_lines):
-            rpath_line = output_lines[index + 2]
-            rpath_line = rpath_line.lstrip()
-            if rpath_line.startswith("path "):
-                rpath_line = rpath_line[5:]
-            tail = rpath_line.find(" (offset ")
-            if tail != -1:
-                rpath_line = rpath_line[0:tail]
-            rpaths.append(rpath_line)
-    return rpaths
-
-
-def add_rpath(some_file):
-    """adds an rpath to the file"""
+    return macho.read(some_file).rpaths
+
+
+def executable_rpath(some_file):
+    """Returns the rpath an executable needs to find its framework"""
     framework_loc = framework_dir(some_file)
-    rpath = (
+    return (
         os.path.join(
             "@executable_path",
             os.path.relpath(framework_loc, os.path.dirname(some_file)),
         )
         + "/"
     )
-    if rpath not in get_rpaths(some_file):
-        cmd = [INSTALL_NAME_TOOL, "-add_rpath", rpath, some_file]
-        run(cmd)
 
 
 def get_deps(some_file):
-    """Return a list of dependencies for some_file"""
-    cmd = [OTOOL, "-L", some_file]
-    output_lines = subprocess.check_output(cmd).decode("utf-8").splitlines()
-    deps = []
-    if len(output_lines) > 1:
-        for line in output_lines[1:]:
-            line = line.lstrip()
-            tail = line.find(" (compatibility")
-            if tail != -1:
-                line = line[0:tail]
-            deps.append(line)
-    return deps
+    """Return a list of dependencies for some_file. Like otool -L, the
+    install_name of a shared library is listed first"""
+    info = macho.read(some_file)
+    if info.install_name:
+        return [info.install_name] + info.dependencies
+    return info.dependencies
 
 
 def get_install_name(some_file):
     """Returns the install_name of a shared library"""
-    cmd = [OTOOL, "-D", some_file]
-    output_lines = subprocess.check_output(cmd).decode("utf-8").splitlines()
-    if len(output_lines) > 1:
-        return output_lines[1]
-    return ""
+    return macho.read(some_file).install_name
+
+
+class FileInfo(object):
+    """What analysis found out about a single Mach-O file"""
+
+    __slots__ = ("path", "install_name", "dependencies", "rpaths")
+
+    def __init__(self, path, install_name="", dependencies=(), rpaths=()):
+        self.path = path
+        self.install_name = install_name
+        self.dependencies = tuple(dependencies)
+        self.rpaths = tuple(rpaths)
 
 
 def make_info(some_file):
-    """Return a dict containing info about the file"""
-    info = {}
-    info["path"] = some_file
-    install_name = get_install_name(some_file)
-    if install_name:
-        info["install_name"] = install_name
-        info["dependencies"] = get_deps(some_file)[1:]
-    else:
-        info["dependencies"] = get_deps(some_file)
-    return info
+    """Return a FileInfo containing info about the file, or None if it is
+    not a Mach-O file"""
+    try:
+        parsed = macho.read(some_file)
+    except (macho.MachOError, IOError, OSError) as err:
+        print("Skipping %s: %s" % (some_file, err), file=sys.stderr)
+        return None
+    return FileInfo(
+        some_file,
+        install_name=parsed.install_name,
+        dependencies=parsed.dependencies,
+        rpaths=parsed.rpaths,
+    )
 
 
 def deps_contain_prefix(info_item, prefix):
     """Do the deps or install_name contain the prefix?"""
-    matching_dep_items = (
-        len(
-            [
-                dep_item
-                for dep_item in info_item.get("dependencies", [])
-                if dep_item.startswith(prefix)
-            ]
-        )
-        > 0
+    if info_item is None:
+        return False
+    return info_item.install_name.startswith(prefix) or any(
+        dep_item.startswith(prefix) for dep_item in info_item.dependencies
     )
-    matching_install_name = info_item.get("install_name", "").startswith(prefix)
-    return matching_dep_items or matching_install_name
 
 
-def base_install_name(full_framework_path):
+def base_install_name(full_framework_path, inventory=None):
     """Generates a base install name for the framework"""
     versions_dir = os.path.join(full_framework_path, "Versions")
+    if inventory is None:
+        inventory = Inventory(versions_dir)
     versions = [
-        os.path.join(versions_dir, item)
-        for item in os.listdir(versions_dir)
-        if os.path.isdir(os.path.join(versions_dir, item))
-        and not os.path.islink(os.path.join(versions_dir, item))
+        entry.path for entry in inventory.listdir(versions_dir)
+        if entry.kind == "dir"
     ]
     for version_dir in versions:
         dylib_name = os.path.join(version_dir, "Python")
@@ -197,76 +166,362 @@ def base_install_name(full_framework_path):
     return ""
 
 
-def analyze(some_dir):
-    """Finds files we need to tweak"""
+def inspect_file(filepath, head=None):
+    """Returns a (category, info) tuple for a file we might need to tweak,
+    or None. head, the first bytes of the file if already known, saves
+    opening files that aren't Mach-O"""
+    ext = os.path.splitext(filepath)[1]
+    if ext == ".so":
+        category = "so_files"
+    elif ext == ".dylib":
+        category = "dylibs"
+    else:
+        filetype = macho.file_type(filepath, head)
+        if filetype == macho.MH_EXECUTE:
+            category = "executables"
+        elif filetype == macho.MH_DYLIB:
+            category = "dylibs"
+        else:
+            return None
+    return (category, make_info(filepath))
+
+
+def result_record(result):
+    """Converts an inspect_file() result into a dict for the manifest"""
+    if result is None:
+        return None
+    category, info = result
+    record = {"category": category}
+    if info is not None:
+        record["install_name"] = info.install_name
+        record["dependencies"] = list(info.dependencies)
+        record["rpaths"] = list(info.rpaths)
+    return record
+
+
+def result_from_record(filepath, record):
+    """Converts a manifest dict back into an inspect_file() result"""
+    if record is None:
+        return None
+    info = None
+    if "install_name" in record:
+        info = FileInfo(
+            filepath,
+            install_name=record["install_name"],
+            dependencies=record["dependencies"],
+            rpaths=record["rpaths"],
+        )
+    return (record["category"], info)
+
+
+def manifest_record(filepath):
+    """Inspects filepath and returns the dict to record in the manifest"""
+    return result_record(inspect_file(filepath))
+
+
+def inspect_entry(entry):
+    """Calls inspect_file for an inventory Entry"""
+    with trace.file_work("analyze", entry.path):
+        return inspect_file(entry.path, entry.head)
+
+
+def inspect_entry_cached(manifest, entry):
+    """Like inspect_entry, but returns the manifest's result for files that
+    haven't changed and records the result for those that have"""
+    hit, record = manifest.lookup(entry.path, entry.identity)
+    if hit:
+        return result_from_record(entry.path, record)
+    result = inspect_entry(entry)
+    manifest.record(entry.path, result_record(result))
+    return result
+
+
+def analyze(some_dir, jobs=1, manifest=None, inventory=None):
+    """Finds files we need to tweak. With a manifest, files that haven't
+    changed since the last run aren't inspected again"""
     print("Analyzing %s..." % some_dir)
-    prefix = base_install_name(some_dir)
+    if inventory is None:
+        inventory = Inventory(some_dir)
+    if manifest is not None and manifest.prefix:
+        # once relocatablized, the framework no longer has the prefix
+        prefix = manifest.prefix
+    else:
+        prefix = base_install_name(some_dir, inventory)
+    inspect = inspect_entry
+    entries = inventory.files(some_dir)
+    if manifest is not None:
+        manifest.prefix = prefix
+        manifest.prune(entry.path for entry in entries)
+        inspect = functools.partial(inspect_entry_cached, manifest)
     data = {}
+    data["prefix"] = prefix
+    # every Mach-O file found, whether or not it needs tweaking
+    data["macho_files"] = []
     data["executables"] = []
     data["dylibs"] = []
     data["so_files"] = []
+    # maps an install name to the files that depend on it
+    data["dependents"] = {}
     count = 0
-    for dirpath, _dirs, files in os.walk(some_dir):
-        for some_file in files:
-            count += 1
-            if count % 100 == 0:
-                sys.stdout.write(".")
-                sys.stdout.flush()
-            filepath = os.path.join(dirpath, some_file)
-            if os.path.islink(filepath):
-                continue
-            ext = os.path.splitext(filepath)[1]
-            if ext == ".so":
-                info = make_info(filepath)
-                if deps_contain_prefix(info, prefix):
-                    data["so_files"].append(info)
-            elif ext == ".dylib":
-                info = make_info(filepath)
-                if deps_contain_prefix(info, prefix):
-                    data["dylibs"].append(info)
-            else:
-                cmd = [FILETOOL, "-b", filepath]
-                output = subprocess.check_output(cmd).decode("utf-8")
-                if "Mach-O 64-bit executable" in output:
-                    info = make_info(filepath)
-                    if deps_contain_prefix(info, prefix):
-                        data["executables"].append(info)
-                if "Mach-O 64-bit dynamically linked shared library" in output:
-                    info = make_info(filepath)
-                    if deps_contain_prefix(info, prefix):
-                        data["dylibs"].append(info)
+    for result in parallel.ordered_map(inspect, entries, jobs):
+        count += 1
+        if count % 100 == 0:
+            sys.stdout.write(".")
+            sys.stdout.flush()
+        if result:
+            category, info = result
+            if info is not None:
+                data["macho_files"].append(info.path)
+            if deps_contain_prefix(info, prefix):
+                data[category].append(info)
+                for dep_item in info.dependencies:
+                    data["dependents"].setdefault(dep_item, []).append(info)
     sys.stdout.write("\n")
     return data
 
 
-def relocatablize(framework_path):
-    """Changes install names and rpaths inside a (Python) framework to make
-    it relocatable. Might work with non-Python frameworks..."""
-    full_framework_path = os.path.abspath(
-        os.path.normpath(os.path.expanduser(framework_path))
-    )
-    fix_modes(full_framework_path)
-    framework_data = analyze(full_framework_path)
-    files_changed = set()
+def apply_plan(item):
+    """Applies all the load command edits in a (path, plan) tuple. Returns
+    a (path, plan, changed) tuple"""
+    some_file, plan = item
+    with trace.file_work("rewrite", some_file):
+        return (some_file, plan, macho.rewrite(some_file, plan))
+
+
+def plan_edits(framework_data, known_renames=None):
+    """Works out every load command edit for the files analysis found,
+    collected so each file is rewritten only once. known_renames maps
+    install names changed earlier to their new ones, for files that still
+    use them. Returns (plans, renames): a RewritePlan per file path and
+    every install name changed"""
+    plans = {}
+    renames = {}
     for dylib in framework_data["dylibs"]:
-        old_install_name = dylib["install_name"]
-        new_install_name = relativize_install_name(dylib["path"])
-        files_changed.add(dylib["path"])
-        # update other files with new install_name
+        old_install_name = dylib.install_name
+        new_install_name = relativize_install_name(
+            dylib.path, old_install_name)
         if old_install_name != new_install_name:
-            files = (
-                framework_data["executables"]
-                + framework_data["dylibs"]
-                + framework_data["so_files"]
-            )
-            for item in files:
-                if old_install_name in item["dependencies"]:
-                    fix_dep(item["path"], old_install_name, new_install_name)
-                    files_changed.add(item["path"])
-        print()
+            plans.setdefault(
+                dylib.path, macho.RewritePlan()
+            ).set_install_name(new_install_name)
+            renames[old_install_name] = new_install_name
+    for old_install_name, new_install_name in (known_renames or {}).items():
+        renames.setdefault(old_install_name, new_install_name)
+    for old_install_name, new_install_name in sorted(renames.items()):
+        # update other files with new install_name
+        for item in framework_data["dependents"].get(old_install_name, []):
+            plans.setdefault(
+                item.path, macho.RewritePlan()
+            ).change(old_install_name, new_install_name)
     # add rpaths to executables
     for item in framework_data["executables"]:
-        add_rpath(item["path"])
-        files_changed.add(item["path"])
+        rpath = executable_rpath(item.path)
+        if rpath not in item.rpaths:
+            plans.setdefault(item.path, macho.RewritePlan()).add_rpath(rpath)
+    return (plans, renames)
+
+
+def rewrite_files(work, jobs=1):
+    """Applies each (path, plan) in work. Returns the files changed"""
+    files_changed = []
+    with trace.phase("rewrite"):
+        for (some_file, plan, changed) in parallel.ordered_map(
+                apply_plan, work, jobs):
+            if changed:
+                print("Rewrote %s %s"
+                      % (" ".join(plan.describe()), some_file))
+                files_changed.append(some_file)
+    return files_changed
+
+
+def hash_file(some_file):
+    """Returns (size, sha256) for some_file"""
+    with trace.file_work("hash", some_file):
+        return (os.path.getsize(some_file), file_sha256(some_file))
+
+
+def make_relocation_plan(framework_path, framework_data, plans, renames,
+                         jobs=1):
+    """Returns a RelocationPlan holding plans and renames for every Mach-O
+    file analyze() found in the framework at framework_path, which must
+    not have been rewritten yet"""
+    relocation_plan = RelocationPlan(framework_data["prefix"], renames)
+    files = framework_data["macho_files"]
+    with trace.phase("hash"):
+        for some_file, (size, sha256) in zip(
+                files, parallel.ordered_map(hash_file, files, jobs)):
+            relocation_plan.record(
+                os.path.relpath(some_file, framework_path), size, sha256,
+                plans.get(some_file))
+    return relocation_plan
+
+
+def plan_relocation(framework_path, jobs=1, inventory=None):
+    """Analyzes a framework and returns the RelocationPlan that would make
+    it relocatable, without changing anything"""
+    full_framework_path = os.path.abspath(framework_path)
+    if inventory is None:
+        inventory = Inventory(full_framework_path)
+    with trace.phase("analyze"):
+        framework_data = analyze(
+            full_framework_path, jobs=jobs, inventory=inventory)
+    plans, renames = plan_edits(framework_data)
+    return make_relocation_plan(
+        full_framework_path, framework_data, plans, renames, jobs=jobs)
+
+
+def record_rewritten(manifest, files_changed):
+    """Marks files_changed as rewritten but unsigned in the manifest, if
+    there is one, and adds the files rewritten earlier but never signed to
+    files_changed"""
+    if manifest is None:
+        return
+    manifest.mark(files_changed, manifest_record,
+                  rewritten=True, signed=False)
+    files_changed += [
+        some_file for some_file in manifest.unsigned()
+        if some_file not in files_changed]
+    manifest.save()
+
+
+def relocatablize(framework_path, jobs=1, manifest=None, inventory=None,
+                  plan_path=None):
+    """Changes install names and rpaths inside a (Python) framework to make
+    it relocatable. Might work with non-Python frameworks...
+    With a manifest from a previous run, only new or changed files are
+    analyzed and rewritten; the returned list also includes files that were
+    rewritten earlier but never signed. With plan_path, the edits are also
+    written there as a relocation plan for apply_relocation()"""
+    full_framework_path = os.path.abspath(
+        os.path.normpath(os.path.expanduser(framework_path))
+    )
+    if inventory is None:
+        inventory = Inventory(full_framework_path)
+    with trace.phase("fix-modes"):
+        fix_modes(full_framework_path, inventory)
+    with trace.phase("analyze"):
+        framework_data = analyze(
+            full_framework_path, jobs=jobs, manifest=manifest,
+            inventory=inventory)
+    known_renames = None
+    if manifest is not None:
+        # files added since the last run may still use install names that
+        # were changed then
+        known_renames = manifest.renames
+    plans, renames = plan_edits(framework_data, known_renames)
+    if manifest is not None:
+        manifest.renames.update(renames)
+    if plan_path:
+        make_relocation_plan(full_framework_path, framework_data, plans,
+                             renames, jobs=jobs).save(plan_path)
+        print("Wrote relocation plan to %s" % plan_path)
+
+    files = (
+        framework_data["executables"]
+        + framework_data["dylibs"]
+        + framework_data["so_files"]
+    )
+    work = [(item.path, plans[item.path])
+            for item in files if item.path in plans]
+    files_changed = rewrite_files(work, jobs)
+    record_rewritten(manifest, files_changed)
+    return files_changed
+
+
+def verify_file(item):
+    """Returns whether the file in a (path, sha256) tuple has that hash"""
+    some_file, sha256 = item
+    with trace.file_work("verify", some_file):
+        return file_sha256(some_file) == sha256
+
 
+def apply_verified_plan(item):
+    """Applies the plan in a (path, plan, sha256) tuple if the file still
+    has that hash. Returns a (path, plan, changed) tuple; changed is None
+    if the hash didn't match"""
+    some_file, plan, sha256 = item
+    with trace.file_work("rewrite", some_file):
+        return (some_file, plan, macho.rewrite(some_file, plan, sha256))
+
+
+def apply_relocation(framework_path, relocation_plan, jobs=1, manifest=None,
+                     inventory=None):
+    """Makes a framework relocatable using a RelocationPlan made from an
+    identical one. Files whose hash matches the plan get its edits without
+    being analyzed, checked against the hash as they are read for
+    rewriting; any other file is analyzed and planned afresh, using the
+    plan's prefix and renames. Returns the files changed, like
+    relocatablize()"""
+    full_framework_path = os.path.abspath(
+        os.path.normpath(os.path.expanduser(framework_path))
+    )
+    if inventory is None:
+        inventory = Inventory(full_framework_path)
+    with trace.phase("fix-modes"):
+        fix_modes(full_framework_path, inventory)
+    print("Applying relocation plan to %s..." % full_framework_path)
+    entries = inventory.files(full_framework_path)
+    planned = []
+    unedited = []
+    unmatched = []
+    for entry in entries:
+        record = relocation_plan.lookup(
+            os.path.relpath(entry.path, full_framework_path), entry.size)
+        if record is None:
+            unmatched.append(entry)
+        elif record["edits"]:
+            planned.append((entry, relocation_plan.edits(record),
+                            record["sha256"]))
+        else:
+            unedited.append((entry, record["sha256"]))
+    with trace.phase("verify"):
+        for (entry, _sha256), matched in zip(unedited, parallel.ordered_map(
+                verify_file, [(entry.path, sha256)
+                              for (entry, sha256) in unedited], jobs)):
+            if not matched:
+                unmatched.append(entry)
+    files_changed = []
+    with trace.phase("rewrite"):
+        for (entry, _plan, _sha256), (some_file, plan, changed) in zip(
+                planned, parallel.ordered_map(
+                    apply_verified_plan,
+                    [(entry.path, plan, sha256)
+                     for (entry, plan, sha256) in planned], jobs)):
+            if changed is None:
+                unmatched.append(entry)
+            elif changed:
+                print("Rewrote %s %s"
+                      % (" ".join(plan.describe()), some_file))
+                files_changed.append(some_file)
+
+    # analyze the files the plan doesn't cover, as relocatablize would
+    framework_data = {
+        "executables": [], "dylibs": [], "so_files": [], "dependents": {}}
+    analyzed = 0
+    with trace.phase("analyze"):
+        for result in parallel.ordered_map(inspect_entry, unmatched, jobs):
+            if not result:
+                continue
+            category, info = result
+            analyzed += 1
+            if deps_contain_prefix(info, relocation_plan.prefix):
+                framework_data[category].append(info)
+                for dep_item in info.dependencies:
+                    framework_data["dependents"].setdefault(
+                        dep_item, []).append(info)
+    print("%d files matched the relocation plan; %d other Mach-O files "
+          "were analyzed" % (len(entries) - len(unmatched), analyzed))
+    plans, renames = plan_edits(framework_data, relocation_plan.renames)
+    files = (
+        framework_data["executables"]
+        + framework_data["dylibs"]
+        + framework_data["so_files"]
+    )
+    files_changed += rewrite_files(
+        [(item.path, plans[item.path])
+         for item in files if item.path in plans], jobs)
+    if manifest is not None:
+        manifest.prefix = relocation_plan.prefix
+        manifest.renames.update(renames)
+    record_rewritten(manifest, files_changed)
     return files_changed
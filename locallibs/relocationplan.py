@@ -0,0 +1,85 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object holding every load command edit that makes a framework
+relocatable, so the edits found by analyzing one framework can be applied
+to identical copies of it"""
+
+from __future__ import print_function
+
+import json
+import os
+
+from .macho import RewritePlan
+
+PLAN_VERSION = 1
+
+
+class RelocationPlan(object):
+    """Maps each Mach-O file in a framework, by relative path, to its size,
+    content hash before relocation and the edits relocation makes to it.
+    Files that need no edits are kept too, so applying the plan knows they
+    need no analysis. Also holds the install name prefix the framework was
+    built with and every install name changed"""
+
+    def __init__(self, prefix="", renames=None, files=None):
+        self.prefix = prefix
+        self.renames = dict(renames or {})
+        self.files = dict(files or {})
+
+    def record(self, key, size, sha256, plan=None):
+        """Records the size, hash and RewritePlan (None if the file needs
+        no edits) for the file at relative path key"""
+        self.files[key] = {
+            "size": size,
+            "sha256": sha256,
+            "edits": plan.as_dict() if plan else None,
+        }
+
+    def lookup(self, key, size):
+        """Returns the record for the file at relative path key, or None if
+        the plan has none for a file of that size"""
+        entry = self.files.get(key)
+        if entry is None or entry["size"] != size:
+            return None
+        return entry
+
+    @staticmethod
+    def edits(entry):
+        """Returns the RewritePlan in a record, or None"""
+        if not entry["edits"]:
+            return None
+        return RewritePlan.from_dict(entry["edits"])
+
+    @classmethod
+    def load(cls, path):
+        """Reads the plan at path. Raises ValueError if it isn't a plan
+        this version can apply"""
+        with open(path) as fileobj:
+            data = json.load(fileobj)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("%s is not a version %d relocation plan"
+                             % (path, PLAN_VERSION))
+        return cls(data.get("prefix", ""), data.get("renames"),
+                   data.get("files"))
+
+    def save(self, path):
+        """Writes the plan"""
+        temp_path = path + ".temp"
+        with open(temp_path, "w") as fileobj:
+            json.dump({"version": PLAN_VERSION, "prefix": self.prefix,
+                       "renames": self.renames, "files": self.files},
+                      fileobj, indent=1, sort_keys=True)
+        os.rename(temp_path, path)
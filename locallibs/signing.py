@@ -0,0 +1,334 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to ad-hoc sign Mach-O files without calling codesign"""
+
+from __future__ import print_function
+
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+
+from . import macho, trace
+
+CSMAGIC_REQUIREMENTS = 0xFADE0C01
+CSMAGIC_CODEDIRECTORY = 0xFADE0C02
+CSMAGIC_EMBEDDED_SIGNATURE = 0xFADE0CC0
+CSMAGIC_BLOBWRAPPER = 0xFADE0B01
+CSSLOT_CODEDIRECTORY = 0
+CSSLOT_REQUIREMENTS = 2
+CSSLOT_SIGNATURESLOT = 0x10000
+
+CS_ADHOC = 0x2
+# the flags codesign --preserve-metadata=flags carries over: hard, kill,
+# restrict, enforcement, library-validation and runtime
+CS_PRESERVED_FLAGS = 0x100 | 0x200 | 0x800 | 0x1000 | 0x2000 | 0x10000
+CS_EXECSEG_MAIN_BINARY = 0x1
+CS_HASHTYPE_SHA256 = 2
+
+CODEDIRECTORY_VERSION = 0x20400
+CODEDIRECTORY_HEADER_SIZE = 88
+PAGE_SIZE_LOG2 = 12
+PAGE_SIZE = 1 << PAGE_SIZE_LOG2
+HASH_SIZE = 32
+# slot -1 is the Info.plist hash, slot -2 the requirements hash
+SPECIAL_SLOTS = 2
+CPU_TYPE_ARM64 = 0x0100000C
+
+EMPTY_REQUIREMENTS = struct.pack(">3I", CSMAGIC_REQUIREMENTS, 12, 0)
+EMPTY_BLOB_WRAPPER = struct.pack(">2I", CSMAGIC_BLOBWRAPPER, 8)
+
+
+def _align(value, alignment):
+    """Rounds value up to a multiple of alignment"""
+    return value + (-value % alignment)
+
+
+def existing_identity(data, slice_info):
+    """Returns (identifier, flags) from the CodeDirectory of a slice's
+    current signature, or (None, 0) if it has none we can read"""
+    if not slice_info.code_signature:
+        return (None, 0)
+    _cmd_offset, dataoff, datasize = slice_info.code_signature
+    start = slice_info.offset + dataoff
+    blob = data[start:start + datasize]
+    if len(blob) < 12:
+        return (None, 0)
+    magic, _length, count = struct.unpack_from(">3I", blob)
+    if magic != CSMAGIC_EMBEDDED_SIGNATURE:
+        return (None, 0)
+    for index in range(count):
+        slot, offset = struct.unpack_from(">2I", blob, 12 + index * 8)
+        if slot != CSSLOT_CODEDIRECTORY or offset + 24 > len(blob):
+            continue
+        (cd_magic, _cd_length, _version, flags, _hash_offset,
+         ident_offset) = struct.unpack_from(">6I", blob, offset)
+        if cd_magic != CSMAGIC_CODEDIRECTORY:
+            break
+        start = offset + ident_offset
+        end = blob.find(b"\0", start)
+        identifier = blob[start:end if end != -1 else None].decode(
+            "utf-8", "replace")
+        return (identifier, flags)
+    return (None, 0)
+
+
+def signature_size(identifier, code_limit):
+    """Returns the size of the ad-hoc signature we generate"""
+    n_code_slots = -(-code_limit // PAGE_SIZE)
+    code_directory = (
+        CODEDIRECTORY_HEADER_SIZE
+        + len(identifier.encode("utf-8")) + 1
+        + (SPECIAL_SLOTS + n_code_slots) * HASH_SIZE
+    )
+    return (12 + 3 * 8 + code_directory + len(EMPTY_REQUIREMENTS)
+            + len(EMPTY_BLOB_WRAPPER))
+
+
+class SlicePlan(object):
+    """A re-signed slice: a patched copy of its header followed by the
+    unchanged bytes up to code_limit and a new signature"""
+
+    def __init__(self, slice_info, header, code_limit, signature, size):
+        self.slice_info = slice_info
+        self.header = header
+        self.code_limit = code_limit
+        self.signature = signature
+        self.size = size
+
+
+def _patched_header(data, slice_info, code_limit, allocation):
+    """Returns the slice header and load commands with LC_CODE_SIGNATURE
+    and __LINKEDIT updated for a signature of allocation bytes at
+    code_limit"""
+    byteorder = slice_info.byteorder
+    base = slice_info.offset
+    linkedit = None
+    for segment in slice_info.segments:
+        if segment.name == "__LINKEDIT":
+            linkedit = segment
+    if linkedit is None:
+        raise macho.MachOError("No __LINKEDIT segment")
+    if slice_info.code_signature:
+        header_size = slice_info.load_commands_end
+        header = bytearray(data[base:base + header_size])
+        cmd_offset = slice_info.code_signature[0]
+    else:
+        if slice_info.padding < 16:
+            raise macho.MachOError(
+                "Not enough header padding to add a code signature")
+        header_size = slice_info.load_commands_end + 16
+        header = bytearray(data[base:base + header_size])
+        cmd_offset = slice_info.load_commands_end
+        struct.pack_into(
+            byteorder + "2I", header, cmd_offset, macho.LC_CODE_SIGNATURE, 16)
+        struct.pack_into(byteorder + "2I", header, 16,
+                         slice_info.ncmds + 1, slice_info.sizeofcmds + 16)
+    struct.pack_into(
+        byteorder + "2I", header, cmd_offset + 8, code_limit, allocation)
+
+    filesize = code_limit + allocation - linkedit.fileoff
+    vm_page = 0x4000 if slice_info.cputype == CPU_TYPE_ARM64 else 0x1000
+    vmsize = max(linkedit.vmsize, _align(filesize, vm_page))
+    if linkedit.cmd == macho.LC_SEGMENT_64:
+        struct.pack_into(byteorder + "Q", header, linkedit.cmd_offset + 32,
+                         vmsize)
+        struct.pack_into(byteorder + "Q", header, linkedit.cmd_offset + 48,
+                         filesize)
+    else:
+        struct.pack_into(byteorder + "I", header, linkedit.cmd_offset + 28,
+                         vmsize)
+        struct.pack_into(byteorder + "I", header, linkedit.cmd_offset + 36,
+                         filesize)
+    return bytes(header)
+
+
+def _page_hashes(data, slice_info, header, code_limit):
+    """Yields the SHA-256 of each page of the slice up to code_limit, as it
+    will be written"""
+    base = slice_info.offset
+    available = slice_info.size
+    for start in range(0, code_limit, PAGE_SIZE):
+        end = min(start + PAGE_SIZE, code_limit)
+        if start < len(header):
+            page = header[start:end]
+            if end > len(header):
+                page += data[base + len(header):base + min(end, available)]
+        else:
+            page = data[base + start:base + min(end, available)]
+        if len(page) < end - start:
+            page += b"\0" * (end - start - len(page))
+        yield hashlib.sha256(page).digest()
+
+
+def _build_signature(data, slice_info, header, code_limit, identifier,
+                     flags):
+    """Builds the SuperBlob holding the CodeDirectory, empty requirements
+    and an empty CMS wrapper"""
+    ident = identifier.encode("utf-8") + b"\0"
+    n_code_slots = -(-code_limit // PAGE_SIZE)
+    ident_offset = CODEDIRECTORY_HEADER_SIZE
+    hash_offset = ident_offset + len(ident) + SPECIAL_SLOTS * HASH_SIZE
+    cd_length = hash_offset + n_code_slots * HASH_SIZE
+    text = None
+    for segment in slice_info.segments:
+        if segment.name == "__TEXT":
+            text = segment
+    exec_seg_flags = (
+        CS_EXECSEG_MAIN_BINARY if slice_info.filetype == macho.MH_EXECUTE
+        else 0)
+    special_slots = (
+        hashlib.sha256(EMPTY_REQUIREMENTS).digest()  # slot -2
+        + b"\0" * HASH_SIZE  # slot -1: no Info.plist
+    )
+    code_directory = b"".join([
+        struct.pack(
+            ">9I4B4IQ3Q",
+            CSMAGIC_CODEDIRECTORY, cd_length, CODEDIRECTORY_VERSION,
+            (flags & CS_PRESERVED_FLAGS) | CS_ADHOC,
+            hash_offset, ident_offset, SPECIAL_SLOTS, n_code_slots,
+            code_limit if code_limit < 1 << 32 else 0,
+            HASH_SIZE, CS_HASHTYPE_SHA256, 0, PAGE_SIZE_LOG2,
+            0, 0, 0, 0,
+            code_limit if code_limit >= 1 << 32 else 0,
+            text.fileoff if text else 0,
+            text.filesize if text else 0,
+            exec_seg_flags,
+        ),
+        ident,
+        special_slots,
+        b"".join(_page_hashes(data, slice_info, header, code_limit)),
+    ])
+    blobs = [
+        (CSSLOT_CODEDIRECTORY, code_directory),
+        (CSSLOT_REQUIREMENTS, EMPTY_REQUIREMENTS),
+        (CSSLOT_SIGNATURESLOT, EMPTY_BLOB_WRAPPER),
+    ]
+    offset = 12 + 8 * len(blobs)
+    index = []
+    for slot, blob in blobs:
+        index.append(struct.pack(">2I", slot, offset))
+        offset += len(blob)
+    return b"".join(
+        [struct.pack(">3I", CSMAGIC_EMBEDDED_SIGNATURE, offset, len(blobs))]
+        + index + [blob for (_slot, blob) in blobs])
+
+
+def plan_slice(data, slice_info, default_identifier):
+    """Works out the new header and signature for one slice"""
+    identifier, flags = existing_identity(data, slice_info)
+    identifier = identifier or default_identifier
+    if slice_info.code_signature:
+        code_limit = slice_info.code_signature[1]
+    else:
+        linkedit_end = max(
+            segment.fileoff + segment.filesize
+            for segment in slice_info.segments)
+        code_limit = _align(linkedit_end, 16)
+    allocation = _align(signature_size(identifier, code_limit), 16)
+    if slice_info.code_signature:
+        # like codesign, reuse the space already set aside for a signature
+        # when it is big enough, so the header and its page hash don't
+        # change
+        allocation = max(allocation, slice_info.code_signature[2])
+    header = _patched_header(data, slice_info, code_limit, allocation)
+    signature = _build_signature(
+        data, slice_info, header, code_limit, identifier, flags)
+    return SlicePlan(slice_info, header, code_limit,
+                     signature.ljust(allocation, b"\0"),
+                     code_limit + allocation)
+
+
+def _write_slice(fileobj, data, plan):
+    """Writes a re-signed slice"""
+    base = plan.slice_info.offset
+    fileobj.write(plan.header)
+    position = len(plan.header)
+    end = min(plan.code_limit, plan.slice_info.size)
+    while position < end:
+        chunk_end = min(position + 1024 * 1024, end)
+        fileobj.write(data[base + position:base + chunk_end])
+        position = chunk_end
+    if position < plan.code_limit:
+        fileobj.write(b"\0" * (plan.code_limit - position))
+    fileobj.write(plan.signature)
+
+
+def sign(some_file, identifier=None):
+    """Replaces the code signature of every slice of some_file with an
+    ad-hoc signature, keeping the existing identifier and flags. Without
+    an existing identifier the file name (minus extension) is used"""
+    default_identifier = identifier or os.path.splitext(
+        os.path.basename(some_file))[0]
+    temp_path = some_file + ".signing"
+    try:
+        with open(some_file, "rb") as fileobj:
+            data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                parsed = macho.parse(data, some_file)
+                try:
+                    plans = [plan_slice(data, slice_info, default_identifier)
+                             for slice_info in parsed.slices]
+                except macho.MachOError as err:
+                    raise macho.MachOError(
+                        "Can't sign %s: %s" % (some_file, err))
+                with open(temp_path, "wb") as out:
+                    if parsed.is_fat:
+                        _write_fat(out, data, plans)
+                    else:
+                        _write_slice(out, data, plans[0])
+                    trace.count_bytes(read=len(data), written=out.tell())
+            finally:
+                data.close()
+        shutil.copymode(some_file, temp_path)
+        os.rename(temp_path, some_file)
+    except Exception:
+        # don't leave a partly written copy beside the file
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return some_file
+
+
+def _write_fat(fileobj, data, plans):
+    """Writes a fat file, laying the re-signed slices out at their
+    required alignment"""
+    magic, nfat_arch = struct.unpack_from(">2I", data, 0)
+    if magic == macho.FAT_MAGIC:
+        arch_format, arch_size = ">5I", 20
+    else:
+        arch_format, arch_size = ">2i2QI4x", 32
+    offset = plans[0].slice_info.offset
+    entries = []
+    for plan in plans:
+        alignment = 1 << plan.slice_info.align
+        offset = _align(offset, alignment)
+        entries.append((plan, offset))
+        offset += plan.size
+    if magic == macho.FAT_MAGIC and offset >= 1 << 32:
+        raise macho.MachOError("Signed slices too large for a fat file")
+    header = bytearray(struct.pack(">2I", magic, nfat_arch))
+    for plan, slice_offset in entries:
+        info = plan.slice_info
+        header += struct.pack(arch_format, info.cputype, info.cpusubtype,
+                              slice_offset, plan.size, info.align)
+    fileobj.write(header)
+    position = len(header)
+    for plan, slice_offset in entries:
+        fileobj.write(b"\0" * (slice_offset - position))
+        _write_slice(fileobj, data, plan)
+        position = slice_offset + plan.size
@@ -0,0 +1,189 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to generate a fake Python.framework, laid out like the
+python.org one, whose Mach-O files reference /Library/Frameworks the same
+way. Lets the relocation pipeline run and be timed on any platform"""
+
+from __future__ import print_function
+
+import os
+import random
+import struct
+
+from . import macho
+
+FRAMEWORK_PREFIX = "/Library/Frameworks/Python.framework"
+LIBSYSTEM = "/usr/lib/libSystem.B.dylib"
+# room for the load commands, like ld's default header padding
+HEADER_PAD = 0x4000
+DYLIB_VERSION = 0x10000
+SLICE_ALIGN = 14
+SOURCE_LINE = b"value_%d = compute(%d)  # a line of generated stdlib code\n"
+
+
+def _lc_str(cmd, fixed, string):
+    """Returns a load command holding fixed fields then string, padded to
+    8 bytes"""
+    raw = string.encode("UTF-8") + b"\0"
+    string_offset = 12 + len(fixed)
+    size = (string_offset + len(raw) + 7) // 8 * 8
+    return (struct.pack("<3I", cmd, size, string_offset) + fixed
+            + raw.ljust(size - string_offset, b"\0"))
+
+
+def _dylib_command(cmd, name):
+    """Returns an LC_ID_DYLIB or LC_LOAD_DYLIB command for name"""
+    return _lc_str(cmd, struct.pack("<3I", 2, DYLIB_VERSION, DYLIB_VERSION),
+                   name)
+
+
+def thin_image(cputype, filetype, install_name=None, dependencies=(),
+               rpaths=(), text_size=16384, linkedit_size=1024):
+    """Returns a 64-bit little-endian Mach-O image with a __TEXT segment
+    holding text_size bytes of code after HEADER_PAD, a __LINKEDIT segment
+    and the given dylib and rpath load commands"""
+    text_end = HEADER_PAD + text_size
+    commands = [
+        struct.pack("<2I16s4Q4I", macho.LC_SEGMENT_64, 72 + 80, b"__TEXT",
+                    0, text_end, 0, text_end, 5, 5, 1, 0)
+        + struct.pack("<16s16s2Q8I", b"__text", b"__TEXT", HEADER_PAD,
+                      text_size, HEADER_PAD, 4, 0, 0, 0x80000400, 0, 0, 0),
+        struct.pack("<2I16s4Q4I", macho.LC_SEGMENT_64, 72, b"__LINKEDIT",
+                    text_end, HEADER_PAD, text_end, linkedit_size, 1, 1, 0,
+                    0),
+    ]
+    if install_name:
+        commands.append(_dylib_command(macho.LC_ID_DYLIB, install_name))
+    for name in dependencies:
+        commands.append(_dylib_command(macho.LC_LOAD_DYLIB, name))
+    for rpath in rpaths:
+        commands.append(_lc_str(macho.LC_RPATH, b"", rpath))
+    load_commands = b"".join(commands)
+    header = struct.pack("<7I4x", macho.MH_MAGIC_64, cputype, 0, filetype,
+                         len(commands), len(load_commands), 0x85)
+    image = bytearray((header + load_commands).ljust(HEADER_PAD, b"\0"))
+    rng = random.Random(install_name or len(load_commands))
+    image += bytes(bytearray(rng.getrandbits(8) for _ in range(256))) \
+        * (text_size // 256) + b"\0" * (text_size % 256)
+    image += b"\0" * linkedit_size
+    return bytes(image)
+
+
+def fat_image(slices):
+    """Returns a fat image holding the (cputype, image) pairs in slices,
+    each aligned to 2^SLICE_ALIGN"""
+    alignment = 1 << SLICE_ALIGN
+    output = bytearray(struct.pack(">2I", macho.FAT_MAGIC, len(slices)))
+    output += b"\0" * (20 * len(slices))
+    for index, (cputype, image) in enumerate(slices):
+        offset = (len(output) + alignment - 1) // alignment * alignment
+        output += b"\0" * (offset - len(output)) + image
+        struct.pack_into(">5I", output, 8 + index * 20, cputype, 0, offset,
+                         len(image), SLICE_ALIGN)
+    return bytes(output)
+
+
+def mach_o(fat, filetype, install_name=None, dependencies=(), rpaths=(),
+           text_size=16384):
+    """Returns an arm64 image, or a universal2 one if fat"""
+    cputypes = [macho.CPU_TYPES["arm64"]]
+    if fat:
+        cputypes.append(macho.CPU_TYPES["x86_64"])
+    slices = [(cputype, thin_image(cputype, filetype, install_name,
+                                   dependencies, rpaths, text_size))
+              for cputype in cputypes]
+    if not fat:
+        return slices[0][1]
+    return fat_image(slices)
+
+
+def _write(path, data, mode=0o644):
+    """Writes data to a new file at path, creating its directory"""
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    with open(path, "wb") as fileobj:
+        fileobj.write(data)
+    os.chmod(path, mode)
+
+
+def generate(destination, version="3.11", dylibs=10, so_files=100,
+             fat=False, stdlib_files=1000, stdlib_file_size=4096, scripts=10,
+             text_size=16384, seed=0, links_per_file=2):
+    """Creates a fake Python.framework in destination with a Python
+    library and python executables, dylibs libraries in lib, so_files
+    extension modules in lib-dynload, stdlib_files text files in the
+    stdlib and scripts bin scripts. The Mach-O files reference each other
+    by their /Library/Frameworks install names; each dylib and extension
+    module loads up to links_per_file of the dylibs. Returns the framework
+    path"""
+    rng = random.Random(seed)
+    framework = os.path.join(os.path.abspath(destination), "Python.framework")
+    version_dir = os.path.join(framework, "Versions", version)
+    prefix = "%s/Versions/%s" % (FRAMEWORK_PREFIX, version)
+    python_lib = prefix + "/Python"
+    python = "python" + version
+    lib_dir = os.path.join(version_dir, "lib", python)
+
+    _write(os.path.join(version_dir, "Python"), mach_o(
+        fat, macho.MH_DYLIB, python_lib, [LIBSYSTEM], text_size=text_size),
+           0o755)
+    executable = mach_o(fat, macho.MH_EXECUTE,
+                        dependencies=[python_lib, LIBSYSTEM],
+                        text_size=text_size)
+    _write(os.path.join(version_dir, "bin", python), executable, 0o755)
+    _write(os.path.join(version_dir, "Resources", "Python.app", "Contents",
+                        "MacOS", "Python"), executable, 0o755)
+    os.symlink(python, os.path.join(version_dir, "bin", "python3"))
+
+    libraries = []
+    for index in range(dylibs):
+        install_name = "%s/lib/libsynthetic%d.dylib" % (prefix, index)
+        dependencies = [LIBSYSTEM] + rng.sample(
+            libraries, min(len(libraries), links_per_file))
+        _write(os.path.join(version_dir, "lib",
+                            "libsynthetic%d.dylib" % index),
+               mach_o(fat, macho.MH_DYLIB, install_name, dependencies,
+                      text_size=text_size), 0o755)
+        libraries.append(install_name)
+    for index in range(so_files):
+        dependencies = [LIBSYSTEM] + rng.sample(
+            libraries, min(len(libraries), links_per_file))
+        rpaths = ["%s/lib" % prefix] if index % 10 == 0 else []
+        _write(os.path.join(lib_dir, "lib-dynload",
+                            "_synthetic%d.cpython-%s-darwin.so"
+                            % (index, version.replace(".", ""))),
+               mach_o(fat, macho.MH_BUNDLE, dependencies=dependencies,
+                      rpaths=rpaths, text_size=text_size), 0o755)
+
+    lines = stdlib_file_size // len(SOURCE_LINE % (0, 0)) + 1
+    for index in range(stdlib_files):
+        package = "package%d" % (index // 50)
+        if index % 50 == 0:
+            _write(os.path.join(lib_dir, package, "__init__.py"), b"")
+        source = b"".join(SOURCE_LINE % (line, index) for line in range(lines))
+        _write(os.path.join(lib_dir, package, "module%d.py" % index),
+               source[:stdlib_file_size])
+    for index in range(scripts):
+        _write(os.path.join(version_dir, "bin", "script%d" % index),
+               b"#!%s/bin/%s\nimport sys\nsys.exit(0)\n" % (
+                   prefix.encode("UTF-8"), python.encode("UTF-8")), 0o755)
+
+    os.symlink(version, os.path.join(framework, "Versions", "Current"))
+    for name in ("Python", "Resources"):
+        os.symlink(os.path.join("Versions", "Current", name),
+                   os.path.join(framework, name))
+    return framework
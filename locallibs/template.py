@@ -0,0 +1,117 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to keep relocated and signed base frameworks so later builds of
+the same pkg can start from a clone instead of downloading, extracting,
+relocatablizing and signing again"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+from .clone import TreeCloner
+from .manifest import Manifest
+
+# bump when a change to relocatablizing or signing makes old templates stale
+TEMPLATE_VERSION = 1
+# directories install_extras writes into; files there are never hardlinked
+MUTABLE_DIRS = ("bin", "site-packages")
+
+
+def may_hardlink(relative_path):
+    """Returns a boolean to indicate if the file at relative_path inside a
+    framework can be shared with a template by hardlink. Every later step
+    replaces files rather than writing to them in place, but pip's
+    directories are left alone to be safe"""
+    parts = relative_path.split(os.sep)
+    return not any(name in parts for name in MUTABLE_DIRS)
+
+
+class TemplateCache(object):
+    """A directory of relocated, signed base frameworks keyed by pkg URL and
+    the build options that change them, each stored with its manifest"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def key(url, signed, native_signing=False, pruned=(), archs=None):
+        """Returns the template key for a build. native_signing tells
+        whether files are signed in-process rather than by codesign,
+        pruned names the components removed and archs the cputypes kept
+        before relocatablizing"""
+        return hashlib.sha256(
+            "\n".join([str(TEMPLATE_VERSION), url, str(bool(signed)),
+                       str(bool(native_signing)),
+                       ",".join(sorted(pruned)),
+                       ",".join(str(arch) for arch in sorted(archs or []))]
+                      ).encode("utf-8")
+        ).hexdigest()
+
+    def _framework(self, key):
+        """Returns the path of the template framework for key"""
+        return os.path.join(self.cache_dir, key, "Python.framework")
+
+    @staticmethod
+    def _clone(source, destination):
+        """Clones the framework at source to destination and points a copy
+        of its manifest at the clone. Returns the TreeCloner used"""
+        cloner = TreeCloner(may_hardlink=lambda path: may_hardlink(
+            os.path.relpath(path, source)))
+        cloner.clone_tree(source, destination)
+        manifest = Manifest(source)
+        manifest.retarget(destination)
+        manifest.save()
+        return cloner
+
+    def restore(self, key, destination):
+        """Clones the template for key to destination. Returns False if
+        there is no such template or destination already exists"""
+        template = self._framework(key)
+        if not os.path.isdir(template) or os.path.exists(destination):
+            return False
+        print("Cloning cached base framework to %s..." % destination)
+        start = time.time()
+        parent = os.path.dirname(os.path.abspath(destination))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        cloner = self._clone(template, destination)
+        print("Cloned in %.1f seconds (%s)"
+              % (time.time() - start, cloner.summary()))
+        return True
+
+    def store(self, key, framework_path):
+        """Saves a clone of the relocated and signed framework_path as the
+        template for key, unless there already is one"""
+        if os.path.isdir(self._framework(key)):
+            return
+        print("Saving base framework to template cache...")
+        temp_dir = os.path.join(
+            self.cache_dir, "%s.%d.temp" % (key, os.getpid()))
+        try:
+            os.makedirs(temp_dir)
+            self._clone(framework_path,
+                        os.path.join(temp_dir, "Python.framework"))
+            os.rename(temp_dir, os.path.join(self.cache_dir, key))
+        except (IOError, OSError) as err:
+            print("Could not save base framework to template cache: %s"
+                  % err, file=sys.stderr)
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,105 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to remove unwanted architectures from the framework's fat
+Mach-O files, like lipo -thin"""
+
+from __future__ import print_function
+
+import functools
+import os
+import shutil
+import struct
+import sys
+
+from . import macho, parallel, trace
+from .inventory import Inventory
+
+
+def parse_archs(text):
+    """Converts a comma separated list of architecture names like
+    "arm64" into a set of cputypes"""
+    names = [name for name in text.split(",") if name]
+    unknown = [name for name in names if name not in macho.CPU_TYPES]
+    if not names or unknown:
+        raise ValueError(
+            "Architectures must be among %s"
+            % ", ".join(sorted(macho.CPU_TYPES)))
+    return set(macho.CPU_TYPES[name] for name in names)
+
+
+def is_fat(entry):
+    """Returns a boolean to indicate if the inventory entry looks like a
+    fat Mach-O file"""
+    if entry.kind != "file" or entry.size < 8:
+        return False
+    magic, nfat_arch = struct.unpack_from(">2I", entry.head)
+    return (magic in (macho.FAT_MAGIC, macho.FAT_MAGIC_64)
+            and 0 < nfat_arch <= macho.MAX_FAT_ARCHS)
+
+
+def thin_file(cputypes, path):
+    """Rewrites the fat Mach-O file at path with only the architectures in
+    cputypes. Returns (path, size before, size after, err); the sizes are
+    equal if nothing was removed"""
+    with trace.file_work("thin", path):
+        try:
+            with open(path, "rb") as fileobj:
+                data = fileobj.read()
+            trace.count_bytes(read=len(data))
+            thinned = macho.thin(data, cputypes)
+            if thinned is None:
+                return (path, len(data), len(data), None)
+            temp_path = path + ".thin"
+            with open(temp_path, "wb") as fileobj:
+                fileobj.write(thinned)
+            trace.count_bytes(written=len(thinned))
+            shutil.copymode(path, temp_path)
+            os.rename(temp_path, path)
+        except (macho.MachOError, IOError, OSError) as err:
+            return (path, 0, 0, err)
+        return (path, len(data), len(thinned), None)
+
+
+def thin_framework(framework_path, cputypes, inventory=None, jobs=1):
+    """Removes every architecture not in cputypes from the fat Mach-O files
+    in the framework, several files at a time, and reports the size saved
+    per file and in total. Keeps the inventory up to date. Returns False
+    if any file could not be thinned"""
+    framework_path = os.path.abspath(framework_path)
+    if inventory is None:
+        inventory = Inventory(framework_path)
+    candidates = [
+        entry.path for entry in inventory.files(framework_path)
+        if is_fat(entry)
+    ]
+    print("Thinning %d fat files in %s..." % (len(candidates), framework_path))
+    success = True
+    total_before = total_after = 0
+    for path, before, after, err in parallel.ordered_map(
+            functools.partial(thin_file, cputypes), candidates, jobs):
+        if err:
+            print("Could not thin %s: %s" % (path, err), file=sys.stderr)
+            success = False
+        elif after < before:
+            inventory.refresh(path)
+            total_before += before
+            total_after += after
+            print("Thinned %s: %.1f KB -> %.1f KB"
+                  % (path, before / 1024.0, after / 1024.0))
+    print("Thinned fat files from %.1f MB to %.1f MB, saving %.1f MB"
+          % (total_before / 1048576.0, total_after / 1048576.0,
+             (total_before - total_after) / 1048576.0))
+    return success
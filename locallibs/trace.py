@@ -0,0 +1,221 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to record where a build's time goes: wall and CPU time per
+phase and per file, subprocesses by tool, and bytes read and written.
+Everything can be written out as a Chrome/Perfetto trace"""
+
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+
+def _thread_cpu():
+    """Returns the CPU time of the calling thread, or of the process where
+    per-thread CPU time isn't available"""
+    if hasattr(time, "thread_time"):
+        return time.thread_time()
+    return time.process_time()
+
+
+def _process_cpu():
+    """Returns the CPU time of the process and its finished subprocesses"""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class Recorder(object):
+    """Totals for the summary, and the trace events when a trace will be
+    written"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.time()
+        self.tracing = False
+        self.events = []
+        self.local = threading.local()
+        # (enclosing phase names..., name) -> [wall, cpu], in the order
+        # the phases started
+        self.phases = {}
+        self.phase_order = []
+        # category -> [files, wall, cpu]
+        self.files = {}
+        # tool -> [calls, seconds]
+        self.tools = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def event(self, name, category, start, seconds, args=None):
+        """Keeps a complete event for the trace"""
+        if not self.tracing:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int((start - self.origin) * 1e6),
+            "dur": int(seconds * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+
+RECORDER = Recorder()
+
+
+def start_trace():
+    """Keeps an event for every phase, file and subprocess from now on, so
+    write_trace has something to write"""
+    RECORDER.tracing = True
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Times a phase of the build. Phases may nest and run concurrently;
+    the CPU time of a phase includes every thread and finished
+    subprocess of the build while it ran"""
+    stack = getattr(RECORDER.local, "stack", None)
+    if stack is None:
+        stack = RECORDER.local.stack = []
+    stack.append(name)
+    key = tuple(stack)
+    with RECORDER.lock:
+        if key not in RECORDER.phases:
+            RECORDER.phases[key] = [0.0, 0.0]
+            RECORDER.phase_order.append(key)
+    start = time.time()
+    cpu_start = _process_cpu()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        cpu = _process_cpu() - cpu_start
+        stack.pop()
+        with RECORDER.lock:
+            totals = RECORDER.phases[key]
+            totals[0] += seconds
+            totals[1] += cpu
+        RECORDER.event(name, "phase", start, seconds, {"cpu": cpu})
+
+
+@contextlib.contextmanager
+def file_work(category, path):
+    """Times the work of category ("analyze", "rewrite", "sign"...) on
+    the file at path"""
+    start = time.time()
+    cpu_start = _thread_cpu()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        cpu = _thread_cpu() - cpu_start
+        with RECORDER.lock:
+            totals = RECORDER.files.setdefault(category, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += cpu
+        RECORDER.event(os.path.basename(path), category, start, seconds,
+                       {"path": path, "cpu": cpu})
+
+
+def count_bytes(read=0, written=0):
+    """Adds to the bytes read and written"""
+    with RECORDER.lock:
+        RECORDER.bytes_read += read
+        RECORDER.bytes_written += written
+
+
+def tool_name(cmd):
+    """Returns the tool a command runs: the module for python -m, else the
+    executable's name"""
+    if "-m" in cmd[1:-1]:
+        return cmd[cmd.index("-m") + 1]
+    return os.path.basename(cmd[0])
+
+
+@contextlib.contextmanager
+def _subprocess(cmd):
+    """Times a subprocess and counts it against its tool"""
+    tool = tool_name(cmd)
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        with RECORDER.lock:
+            totals = RECORDER.tools.setdefault(tool, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        RECORDER.event(tool, "subprocess", start, seconds,
+                       {"cmd": " ".join(cmd)})
+
+
+def check_call(cmd, **kwargs):
+    """subprocess.check_call, timed and counted"""
+    with _subprocess(cmd):
+        return subprocess.check_call(cmd, **kwargs)
+
+
+def check_output(cmd, **kwargs):
+    """subprocess.check_output, timed and counted"""
+    with _subprocess(cmd):
+        return subprocess.check_output(cmd, **kwargs)
+
+
+def write_trace(path):
+    """Writes the events recorded so far as a Chrome/Perfetto trace"""
+    with RECORDER.lock:
+        events = list(RECORDER.events)
+    with open(path, "w") as fileobj:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fileobj)
+
+
+def summary():
+    """Prints a table of the time spent per phase, per file, per tool and
+    the bytes read and written"""
+    with RECORDER.lock:
+        print()
+        print("%-24s %10s %10s" % ("Phase", "Wall s", "CPU s"))
+        # each phase followed by the phases inside it
+        order = RECORDER.phase_order
+        for key in sorted(order, key=lambda key: [
+                order.index(key[:depth + 1]) for depth in range(len(key))]):
+            seconds, cpu = RECORDER.phases[key]
+            print("%-24s %10.2f %10.2f"
+                  % ("  " * (len(key) - 1) + key[-1], seconds, cpu))
+        if RECORDER.files:
+            print("%-24s %10s %10s %10s"
+                  % ("Per-file work", "Files", "Wall s", "CPU s"))
+            for category in sorted(RECORDER.files):
+                count, seconds, cpu = RECORDER.files[category]
+                print("%-24s %10d %10.2f %10.2f"
+                      % (category, count, seconds, cpu))
+        if RECORDER.tools:
+            print("%-24s %10s %10s" % ("Subprocesses", "Calls", "Wall s"))
+            for tool in sorted(RECORDER.tools):
+                count, seconds = RECORDER.tools[tool]
+                print("%-24s %10d %10.2f" % (tool, count, seconds))
+        print("Read %.1f MB, wrote %.1f MB"
+              % (RECORDER.bytes_read / 1048576.0,
+                 RECORDER.bytes_written / 1048576.0))
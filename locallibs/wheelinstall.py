@@ -0,0 +1,299 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to install wheels into the framework by unpacking them
+directly, without pip"""
+
+from __future__ import print_function
+
+import base64
+import csv
+import hashlib
+import io
+import os
+import re
+import shutil
+import sys
+import zipfile
+
+from . import parallel, trace
+from .fix import RELOCATABLE_SHEBANG
+
+INSTALLER = b"relocatable-python\n"
+SUPPORTED_TAGS_SCRIPT = (
+    "from pip._vendor.packaging import tags; "
+    "print('\\n'.join(str(tag) for tag in tags.sys_tags()))"
+)
+CONSOLE_SCRIPT = """
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit(%(func)s())
+"""
+
+
+class WheelError(Exception):
+    """Raised when a wheel can't be installed directly"""
+
+
+def canonical_name(name):
+    """Returns the normalized form of a distribution name"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def wheel_tags(filename):
+    """Returns the set of tags a wheel filename declares, expanding
+    compressed tag sets like py2.py3"""
+    parts = os.path.basename(filename)[:-len(".whl")].split("-")
+    if len(parts) not in (5, 6):
+        return set()
+    pythons, abis, platforms = parts[-3:]
+    return set(
+        "%s-%s-%s" % (python, abi, platform)
+        for python in pythons.split(".")
+        for abi in abis.split(".")
+        for platform in platforms.split("."))
+
+
+def supported_tags(python_path):
+    """Returns the set of wheel tags the framework's python supports"""
+    output = trace.check_output(
+        [python_path, "-s", "-c", SUPPORTED_TAGS_SCRIPT])
+    return set(output.decode("UTF-8").split())
+
+
+def installed_names(site_packages):
+    """Returns the canonical names of the distributions in
+    site_packages"""
+    names = set()
+    if os.path.isdir(site_packages):
+        for filename in os.listdir(site_packages):
+            if filename.endswith(".dist-info"):
+                names.add(canonical_name(filename[:-10].rsplit("-", 1)[0]))
+    return names
+
+
+class Scheme(object):
+    """Where each part of a wheel goes inside the framework"""
+
+    def __init__(self, framework_path, version):
+        prefix = os.path.abspath(
+            os.path.join(framework_path, "Versions", version))
+        self.prefix = prefix
+        self.python = os.path.join(prefix, "bin", "python" + version)
+        self.site_packages = os.path.join(
+            prefix, "lib", "python" + version, "site-packages")
+        self.paths = {
+            "purelib": self.site_packages,
+            "platlib": self.site_packages,
+            "scripts": os.path.join(prefix, "bin"),
+            "headers": os.path.join(prefix, "include", "python" + version),
+            "data": prefix,
+        }
+
+    def shebang(self, script_dir):
+        """Returns the relocatable shebang for a script in script_dir"""
+        relative_interpreter_path = os.path.relpath(
+            self.python, script_dir).encode("UTF-8")
+        return RELOCATABLE_SHEBANG % (
+            relative_interpreter_path, relative_interpreter_path)
+
+
+def _record_hash(data):
+    """Returns the RECORD hash of data"""
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return "sha256=" + digest.rstrip(b"=").decode("ascii")
+
+
+def _target_path(base, name):
+    """Joins name onto base, refusing anything that would land outside
+    base"""
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        raise WheelError("Refusing to install %s" % name)
+    return os.path.join(base, *parts)
+
+
+def _write(path, data, mode=None):
+    """Writes data to a new file at path"""
+    # wheels unpacked at the same time can share a namespace package
+    # directory, so another one may create it first
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fileobj:
+        fileobj.write(data)
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+def _entry_points(data):
+    """Returns the (name, value) pairs of the console_scripts and
+    gui_scripts sections of an entry_points.txt"""
+    scripts = []
+    section = None
+    for line in data.decode("UTF-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+        if line.startswith("["):
+            section = line.strip("[]").strip()
+        elif section in ("console_scripts", "gui_scripts") and "=" in line:
+            name, value = line.split("=", 1)
+            scripts.append((name.strip(), value.split("[")[0].strip()))
+    return scripts
+
+
+def install_wheel(scheme, wheel_path, written=None):
+    """Unpacks the wheel at wheel_path into the framework described by
+    scheme, writes its INSTALLER and RECORD and generates its console
+    scripts with relocatable shebangs. Each path is appended to written,
+    if given, before the file is written. Returns the distribution name"""
+    installed = []
+    if written is None:
+        written = []
+
+    def place(path, data, mode=None):
+        """Writes one file and remembers it for RECORD"""
+        written.append(path)
+        _write(path, data, mode)
+        installed.append((path, _record_hash(data), len(data)))
+
+    with zipfile.ZipFile(wheel_path) as archive:
+        names = archive.namelist()
+        dist_info = set(
+            name.split("/")[0] for name in names
+            if name.split("/")[0].endswith(".dist-info"))
+        if len(dist_info) != 1:
+            raise WheelError("%s has no single .dist-info" % wheel_path)
+        dist_info = dist_info.pop()
+        data_dir = dist_info[:-len(".dist-info")] + ".data"
+        for info in archive.infolist():
+            name = info.filename
+            if name.endswith("/") or name == dist_info + "/RECORD":
+                continue
+            data = archive.read(info)
+            # like pip, keep only the executable bit from the archive
+            mode = 0o755 if (info.external_attr >> 16) & 0o111 else None
+            if name.startswith(data_dir + "/"):
+                try:
+                    _, key, rest = name.split("/", 2)
+                    base = scheme.paths[key]
+                except (ValueError, KeyError):
+                    raise WheelError(
+                        "Unknown data file %s in %s" % (name, wheel_path))
+                if key == "headers":
+                    base = os.path.join(
+                        base, dist_info.split("-")[0])
+                path = _target_path(base, rest)
+                if key == "scripts":
+                    if data.startswith(b"#!python"):
+                        rest_of_script = data.partition(b"\n")[2]
+                        data = scheme.shebang(
+                            os.path.dirname(path)) + rest_of_script
+                    mode = 0o755
+            else:
+                path = _target_path(scheme.site_packages, name)
+            place(path, data, mode)
+        entry_points = dist_info + "/entry_points.txt"
+        scripts = (_entry_points(archive.read(entry_points))
+                   if entry_points in names else [])
+    script_dir = scheme.paths["scripts"]
+    for name, value in scripts:
+        module, _, attrs = value.partition(":")
+        attrs = attrs.strip() or None
+        if attrs is None:
+            raise WheelError("Bad entry point %s in %s" % (value, wheel_path))
+        script = scheme.shebang(script_dir) + (CONSOLE_SCRIPT % {
+            "module": module.strip(),
+            "import_name": attrs.split(".")[0],
+            "func": attrs,
+        }).encode("UTF-8")
+        place(_target_path(script_dir, name), script, 0o755)
+    dist_info_path = os.path.join(scheme.site_packages, dist_info)
+    place(os.path.join(dist_info_path, "INSTALLER"), INSTALLER)
+    record_path = os.path.join(dist_info_path, "RECORD")
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    for path, digest, size in installed:
+        writer.writerow(
+            (os.path.relpath(path, scheme.site_packages), digest, size))
+    writer.writerow((os.path.relpath(record_path, scheme.site_packages),
+                     "", ""))
+    written.append(record_path)
+    _write(record_path, output.getvalue().encode("UTF-8"))
+    return dist_info[:-len(".dist-info")].rsplit("-", 1)[0]
+
+
+def _remove_files(paths):
+    """Removes the files a failed install wrote, so pip starts from a clean
+    slate. Directories are left, as other wheels may be using them"""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _remove_dist_info(site_packages, wheel_path):
+    """Removes the .dist-info a failed install may have left behind, so pip
+    doesn't mistake the distribution for installed"""
+    with zipfile.ZipFile(wheel_path) as archive:
+        tops = set(name.split("/")[0] for name in archive.namelist())
+    for top in tops:
+        if top.endswith(".dist-info"):
+            shutil.rmtree(
+                os.path.join(site_packages, top), ignore_errors=True)
+
+
+def install_wheels(framework_path, version, wheel_paths, jobs=1):
+    """Installs the wheels in wheel_paths that match the framework's tags
+    and aren't already installed by unpacking them, several at a time.
+    Returns the paths of the wheels left for pip to install"""
+    scheme = Scheme(framework_path, version)
+    tags = supported_tags(scheme.python)
+    already_installed = installed_names(scheme.site_packages)
+    direct = []
+    leftover = []
+    for wheel_path in wheel_paths:
+        name = canonical_name(os.path.basename(wheel_path).split("-")[0])
+        if wheel_tags(wheel_path) & tags and name not in already_installed:
+            direct.append(wheel_path)
+        else:
+            # upgrades and foreign wheels are pip's job
+            leftover.append(wheel_path)
+
+    def install(wheel_path):
+        """Installs one wheel. Returns (wheel_path, error)"""
+        written = []
+        try:
+            install_wheel(scheme, wheel_path, written)
+        except (WheelError, zipfile.BadZipfile, IOError, OSError) as err:
+            _remove_files(written)
+            try:
+                _remove_dist_info(scheme.site_packages, wheel_path)
+            except (zipfile.BadZipfile, IOError, OSError):
+                pass
+            return (wheel_path, err)
+        return (wheel_path, None)
+
+    for wheel_path, err in parallel.ordered_map(install, direct, jobs):
+        if err:
+            print("Could not unpack %s: %s; leaving it to pip"
+                  % (wheel_path, err), file=sys.stderr)
+            leftover.append(wheel_path)
+        else:
+            print("Installed %s" % os.path.basename(wheel_path))
+    return leftover
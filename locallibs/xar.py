@@ -0,0 +1,134 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Object to read members of a xar archive (such as a flat installer pkg)
+without pkgutil"""
+
+from __future__ import print_function
+
+import bz2
+import hashlib
+import struct
+import zlib
+import xml.etree.ElementTree as ElementTree
+
+from . import trace
+
+XAR_MAGIC = b"xar!"
+XAR_HEADER_FORMAT = ">4sHHQQI"
+CHUNK_SIZE = 1024 * 1024
+
+
+class XarError(Exception):
+    """Raised when a xar archive can't be read"""
+
+
+class XarMember(object):
+    """Location and encoding of a file stored in a xar archive"""
+
+    def __init__(self, name, element):
+        self.name = name
+        data = element.find("data")
+        self.offset = int(data.findtext("offset", "0"))
+        self.length = int(data.findtext("length", "0"))
+        self.size = int(data.findtext("size", "0"))
+        encoding = data.find("encoding")
+        self.encoding = (
+            encoding.get("style") if encoding is not None
+            else "application/octet-stream")
+        checksum = data.find("archived-checksum")
+        if checksum is not None:
+            self.checksum_style = checksum.get("style")
+            self.checksum = (checksum.text or "").strip().lower()
+        else:
+            self.checksum_style = self.checksum = None
+
+
+class XarReader(object):
+    """Reads the table of contents of a xar archive and streams individual
+    members out of its heap"""
+
+    def __init__(self, path):
+        self.path = path
+        self.members = {}
+        with open(path, "rb") as fileobj:
+            header = fileobj.read(struct.calcsize(XAR_HEADER_FORMAT))
+            if len(header) < struct.calcsize(XAR_HEADER_FORMAT):
+                raise XarError("%s is too short to be a xar archive" % path)
+            (magic, header_size, _version, toc_length, _toc_size,
+             _cksum_alg) = struct.unpack(XAR_HEADER_FORMAT, header)
+            if magic != XAR_MAGIC:
+                raise XarError("%s is not a xar archive" % path)
+            fileobj.seek(header_size)
+            try:
+                toc = zlib.decompress(fileobj.read(toc_length))
+            except zlib.error as err:
+                raise XarError("Bad table of contents in %s: %s" % (path, err))
+        self.heap_offset = header_size + toc_length
+        root = ElementTree.fromstring(toc).find("toc")
+        if root is None:
+            raise XarError("No table of contents in %s" % path)
+        self._add_members(root, "")
+
+    def _add_members(self, parent, prefix):
+        """Records every file element below parent"""
+        for element in parent.findall("file"):
+            name = prefix + element.findtext("name", "")
+            if element.findtext("type") == "file":
+                self.members[name] = XarMember(name, element)
+            self._add_members(element, name + "/")
+
+    def read_chunks(self, name, chunk_size=CHUNK_SIZE):
+        """Yields the decoded contents of member name in chunks, verifying
+        its archived checksum"""
+        member = self.members.get(name)
+        if member is None:
+            raise XarError("%s has no member %s" % (self.path, name))
+        if member.encoding == "application/x-gzip":
+            decoder = zlib.decompressobj()
+        elif member.encoding == "application/x-bzip2":
+            decoder = bz2.BZ2Decompressor()
+        elif member.encoding == "application/octet-stream":
+            decoder = None
+        else:
+            raise XarError(
+                "Unsupported encoding %s for %s" % (member.encoding, name))
+        digest = None
+        if member.checksum_style in ("sha1", "md5", "sha256", "sha512"):
+            digest = hashlib.new(member.checksum_style)
+        with open(self.path, "rb") as fileobj:
+            fileobj.seek(self.heap_offset + member.offset)
+            remaining = member.length
+            while remaining:
+                chunk = fileobj.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise XarError("%s is truncated" % self.path)
+                remaining -= len(chunk)
+                trace.count_bytes(read=len(chunk))
+                if digest:
+                    digest.update(chunk)
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+        if digest and digest.hexdigest() != member.checksum:
+            raise XarError(
+                "Checksum mismatch for %s in %s" % (name, self.path))
+
+    def extract(self, name, destination):
+        """Streams member name out to the file at destination"""
+        with open(destination, "wb") as fileobj:
+            for chunk in self.read_chunks(name):
+                fileobj.write(chunk)
@@ -0,0 +1,174 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions to pack the pure-Python stdlib into the pythonXY.zip that is
+already on the interpreter's default sys.path"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import struct
+import sys
+import zipfile
+
+from .precompile import precompile
+
+# stdlib entries that must stay real files: they hold extension modules,
+# build data, data files read by path, or scripts copied out at runtime
+EXCLUDED = set([
+    "site-packages", "lib-dynload", "test", "idlelib", "tkinter",
+    "turtledemo", "ensurepip", "lib2to3", "venv", "distutils",
+])
+# the landmark getpath looks for to find the stdlib, so it stays on disk
+LANDMARK = "os.py"
+# pyc header flags for an unchecked hash-based pyc
+UNCHECKED_HASH_FLAGS = 0x1
+
+
+def zip_path(framework_path, version):
+    """Returns the path of pythonXY.zip for the framework"""
+    return os.path.join(
+        framework_path, "Versions", version, "lib",
+        "python%s.zip" % version.replace(".", ""))
+
+
+def is_pure_package(path):
+    """Returns a boolean to indicate if the package directory at path holds
+    nothing but Python source (and its bytecode caches)"""
+    for dirpath, dirs, files in os.walk(path):
+        if "__pycache__" in dirs:
+            dirs.remove("__pycache__")
+        if any(not filename.endswith(".py") for filename in files):
+            return False
+    return True
+
+
+def eligible_modules(lib_dir, wanted=None):
+    """Returns the names of top-level stdlib modules and packages that can
+    be zipped: pure Python, not excluded, and in wanted if given"""
+    names = []
+    for name in sorted(os.listdir(lib_dir)):
+        path = os.path.join(lib_dir, name)
+        if os.path.islink(path) or name.startswith("config-"):
+            continue
+        if os.path.isdir(path):
+            module = name
+            eligible = (os.path.exists(os.path.join(path, "__init__.py"))
+                        and is_pure_package(path))
+        elif name.endswith(".py"):
+            module = name[:-3]
+            eligible = True
+        else:
+            continue
+        if module in EXCLUDED or not eligible:
+            continue
+        if wanted is not None and module not in wanted:
+            continue
+        names.append(name)
+    return names
+
+
+def cache_paths(source, cache_tag):
+    """Returns the paths of the existing pycs for source at every
+    optimization level"""
+    cache_dir = os.path.join(os.path.dirname(source), "__pycache__")
+    prefix = "%s.%s." % (os.path.basename(source)[:-3], cache_tag)
+    try:
+        filenames = os.listdir(cache_dir)
+    except OSError:
+        return []
+    return [os.path.join(cache_dir, filename)
+            for filename in sorted(filenames)
+            if filename.startswith(prefix) and filename.endswith(".pyc")]
+
+
+def cached_pyc(source, cache_tag):
+    """Returns the contents of the unchecked-hash pyc for source, or None
+    if there isn't one"""
+    cache = os.path.join(
+        os.path.dirname(source), "__pycache__",
+        "%s.%s.pyc" % (os.path.basename(source)[:-3], cache_tag))
+    try:
+        with open(cache, "rb") as fileobj:
+            data = fileobj.read()
+    except (IOError, OSError):
+        return None
+    if len(data) < 16 or struct.unpack("<I", data[4:8])[0] != \
+            UNCHECKED_HASH_FLAGS:
+        return None
+    return data
+
+
+def module_sources(lib_dir, name):
+    """Yields the path of every .py file of the top-level module or package
+    name"""
+    path = os.path.join(lib_dir, name)
+    if not os.path.isdir(path):
+        yield path
+        return
+    for dirpath, dirs, files in os.walk(path):
+        dirs[:] = sorted(item for item in dirs if item != "__pycache__")
+        for filename in sorted(files):
+            yield os.path.join(dirpath, filename)
+
+
+def zip_stdlib(framework_path, version, modules=None, precompiled=False):
+    """Packs the pure-Python stdlib, or just the top-level modules listed
+    in modules, into pythonXY.zip with unchecked-hash bytecode beside each
+    source, then removes the packed files from lib/pythonX.Y. Unless
+    precompiled is True, the stdlib is precompiled first. Returns
+    False on failure"""
+    lib_dir = os.path.join(
+        framework_path, "Versions", version, "lib", "python" + version)
+    if not os.path.isdir(lib_dir):
+        print("No stdlib at %s" % lib_dir, file=sys.stderr)
+        return False
+    if not precompiled and not precompile(framework_path, version):
+        return False
+    cache_tag = "cpython-%s" % version.replace(".", "")
+    names = eligible_modules(lib_dir, wanted=modules)
+    destination = zip_path(framework_path, version)
+    print("Packing %d stdlib modules into %s..." % (len(names), destination))
+    temp_path = destination + ".temp"
+    packed = 0
+    try:
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in names:
+                for source in module_sources(lib_dir, name):
+                    arcname = os.path.relpath(source, lib_dir)
+                    archive.write(source, arcname)
+                    pyc = cached_pyc(source, cache_tag)
+                    if pyc is not None:
+                        # zipimport looks for bytecode beside the source
+                        archive.writestr(arcname[:-3] + ".pyc", pyc)
+                    packed += 1
+        os.rename(temp_path, destination)
+    except (IOError, OSError, zipfile.BadZipfile) as err:
+        print("Could not create %s: %s" % (destination, err), file=sys.stderr)
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        return False
+    for name in names:
+        path = os.path.join(lib_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif name != LANDMARK:
+            os.unlink(path)
+            for cache in cache_paths(path, cache_tag):
+                os.unlink(cache)
+    print("Packed %d files into %s (%.1f MB)"
+          % (packed, destination, os.path.getsize(destination) / 1048576.0))
+    return True
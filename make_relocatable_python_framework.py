@@ -19,11 +19,14 @@
 from __future__ import print_function
 
 import optparse
+import sys
 
-from locallibs import get
-from locallibs.fix import fix_broken_signatures, fix_other_things
-from locallibs.install import install_extras
-from locallibs.relocatablizer import relocatablize
+from locallibs import get, trace
+from locallibs.build import Build
+from locallibs.precompile import parse_levels
+from locallibs.prune import PIP_COMPONENTS, PROFILES, components_for
+from locallibs.relocationplan import RelocationPlan
+from locallibs.thin import parse_archs
 
 
 def main():
@@ -40,6 +43,34 @@ def main():
         default=get.DEFAULT_BASEURL,
         help="Override the base URL used to download the framework.",
     )
+    parser.add_option(
+        "--connections",
+        default=get.DEFAULT_CONNECTIONS,
+        type="int",
+        help="Number of HTTP connections to use when downloading the pkg. "
+        "Defaults to %d." % get.DEFAULT_CONNECTIONS,
+    )
+    parser.add_option(
+        "--cache-dir",
+        default=None,
+        help="Directory in which to cache downloaded Python.org pkgs and, "
+        "unless --no-template-cache is given, relocated and signed base "
+        "frameworks to clone. If not provided, nothing is cached.",
+    )
+    parser.add_option(
+        "--cache-size-limit",
+        default=2048,
+        type="int",
+        help="Maximum size in megabytes of the download cache. Least "
+        "recently used pkgs are removed first. Defaults to 2048.",
+    )
+    parser.add_option(
+        "--offline",
+        default=False,
+        action="store_true",
+        help="Never download; fail if the pkg is not in the download cache. "
+        "With --wheelhouse, install only the wheels already there.",
+    )
     parser.add_option(
         "--os-version",
         default=get.DEFAULT_OS_VERSION,
@@ -66,6 +97,13 @@ def main():
         action="store_false",
         help="Do not unsign binaries and libraries after they are relocatablized."
     )
+    parser.add_option(
+        "--native-signing",
+        default=False,
+        action="store_true",
+        help="Generate ad-hoc signatures in-process instead of running "
+        "codesign.",
+    )
     parser.add_option(
         "--upgrade-pip",
         default=False,
@@ -78,30 +116,189 @@ def main():
         action="store_true",
         help="Do not install pip."
     )
-    parser.set_defaults(unsign=True)
+    parser.add_option(
+        "--wheelhouse",
+        default=None,
+        help="Directory in which to cache wheels for the extra Python "
+        "modules, per Python version and platform. Sdists are built into "
+        "wheels there, and modules are installed from it with a single pip "
+        "run that doesn't use the index.",
+    )
+    parser.add_option(
+        "--direct-install",
+        default=False,
+        action="store_true",
+        help="With --wheelhouse, unpack wheels that match the framework "
+        "straight into site-packages, several at a time, instead of "
+        "installing them with pip. Pip still installs anything else.",
+    )
+    parser.add_option(
+        "--precompile",
+        default=False,
+        action="store_true",
+        help="After installing extra modules, compile the stdlib and "
+        "site-packages on every core into unchecked-hash pycs, which stay "
+        "valid wherever the framework is copied.",
+    )
+    parser.add_option(
+        "--precompile-levels",
+        default="0",
+        help="Comma-separated optimization levels (0, 1, 2) to precompile "
+        'for. Defaults to "0".',
+    )
+    parser.add_option(
+        "--zip-stdlib",
+        default=False,
+        action="store_true",
+        help="Pack the pure-Python stdlib, with its bytecode, into the "
+        "pythonXY.zip on the default sys.path so the interpreter starts with "
+        "fewer filesystem operations.",
+    )
+    parser.add_option(
+        "--zip-stdlib-modules",
+        default=None,
+        help="Comma-separated top-level stdlib modules and packages to pack "
+        "with --zip-stdlib. Defaults to all that can be.",
+    )
+    parser.add_option(
+        "--prune-profile",
+        default=None,
+        choices=sorted(PROFILES),
+        help="Remove components the framework doesn't need before it is "
+        "relocatablized and signed: %s. Components pip needs are removed "
+        "after extra modules are installed." % ", ".join(
+            "%s (%s)" % (name, ", ".join(PROFILES[name]))
+            for name in sorted(PROFILES)),
+    )
+    parser.add_option(
+        "--thin-arch",
+        default=None,
+        help="Comma-separated architectures (for example \"arm64\") to keep "
+        "in fat binaries and libraries. Other slices are removed before the "
+        "framework is relocatablized. Defaults to keeping all of them.",
+    )
+    parser.add_option(
+        "--jobs",
+        default=1,
+        type="int",
+        help="Number of files to analyze, rewrite and re-sign, and of wheels "
+        "to build, concurrently. "
+        "Defaults to 1.",
+    )
+    parser.add_option(
+        "--incremental",
+        default=False,
+        action="store_true",
+        help="Keep a manifest of analyzed files next to the framework. If "
+        "the destination already holds a framework built this way, reuse it "
+        "and only analyze, rewrite and re-sign new or changed files.",
+    )
+    parser.add_option(
+        "--no-template-cache",
+        dest="template_cache",
+        action="store_false",
+        help="Do not keep relocated, signed base frameworks in the "
+        "templates subdirectory of --cache-dir. With a cached template, a "
+        "build clones it instead of downloading and relocatablizing.",
+    )
+    parser.add_option(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="If an earlier build with the same options failed, skip the "
+        "steps it completed.",
+    )
+    parser.add_option(
+        "--step-retries",
+        default=0,
+        type="int",
+        help="Number of times to retry a failed download, install or "
+        "script-fixing step. Defaults to 0.",
+    )
+    parser.add_option(
+        "--critical-path",
+        default=False,
+        action="store_true",
+        help="Report when each build step ran and which steps bounded the "
+        "total build time.",
+    )
+    parser.add_option(
+        "--trace",
+        default=None,
+        help="Path of a Chrome/Perfetto trace file to write, with an event "
+        "for every build phase, file worked on and subprocess run.",
+    )
+    parser.add_option(
+        "--write-relocation-plan",
+        default=None,
+        help="Path to write the install name, dependency and rpath edits "
+        "made to the framework to, as a relocation plan for "
+        "--apply-relocation-plan. The framework must be freshly extracted, "
+        "so this can't be used with --incremental or the template cache.",
+    )
+    parser.add_option(
+        "--apply-relocation-plan",
+        default=None,
+        help="Path of a relocation plan written by an earlier build of the "
+        "same framework. Files that match the plan are rewritten without "
+        "being analyzed.",
+    )
+    parser.set_defaults(unsign=True, template_cache=True)
     options, _arguments = parser.parse_args()
-    framework_path = get.FrameworkGetter(
-        python_version=options.python_version,
-        os_version=options.os_version,
-        base_url=options.baseurl,
-    ).download_and_extract(destination=options.destination)
-
-    if framework_path:
-        files_relocatablized = relocatablize(framework_path)
-        if options.unsign:
-            fix_broken_signatures(files_relocatablized)
-        short_version = ".".join(options.python_version.split(".")[0:2])
-        install_extras(
-            framework_path,
-            version=short_version,
-            requirements_file=options.pip_requirements,
-            upgrade_pip=options.upgrade_pip,
-            without_pip=options.without_pip
-        )
-        if fix_other_things(framework_path, short_version):
-            print()
-            print("Done!")
-            print("Customized, relocatable framework is at %s" % framework_path)
+    try:
+        precompile_levels = parse_levels(options.precompile_levels)
+        thin_cputypes = None
+        if options.thin_arch:
+            thin_cputypes = parse_archs(options.thin_arch)
+        relocation_plan = None
+        if options.write_relocation_plan:
+            # the plan has to be made from the framework as extracted
+            if options.incremental:
+                raise ValueError(
+                    "--write-relocation-plan can't be used with "
+                    "--incremental")
+            if options.cache_dir and options.template_cache:
+                raise ValueError(
+                    "--write-relocation-plan can't be used with the "
+                    "template cache; add --no-template-cache")
+        if options.apply_relocation_plan:
+            if options.write_relocation_plan:
+                raise ValueError(
+                    "--write-relocation-plan and --apply-relocation-plan "
+                    "can't be used together")
+            relocation_plan = RelocationPlan.load(
+                options.apply_relocation_plan)
+    except (IOError, OSError, ValueError) as err:
+        parser.error(str(err))
+    early_pruned = late_pruned = []
+    if options.prune_profile:
+        early_pruned = components_for(options.prune_profile)
+        if not options.without_pip:
+            late_pruned = [name for name in early_pruned
+                           if name in PIP_COMPONENTS]
+            early_pruned = [name for name in early_pruned
+                            if name not in PIP_COMPONENTS]
+    if options.trace:
+        trace.start_trace()
+    build = Build(
+        options,
+        precompile_levels=precompile_levels,
+        thin_cputypes=thin_cputypes,
+        early_pruned=early_pruned,
+        late_pruned=late_pruned,
+        relocation_plan=relocation_plan,
+    )
+    success = build.run()
+    trace.summary()
+    if options.trace:
+        trace.write_trace(options.trace)
+        print("Wrote trace to %s" % options.trace)
+    if not success:
+        sys.exit("Build failed")
+    print()
+    print("Done!")
+    print("Customized, relocatable framework is at %s"
+          % build.framework_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for evicting from locallibs.cache"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import cache
+from locallibs.cache import DownloadCache
+
+SIZE = 100
+
+
+class TestEviction(unittest.TestCase):
+    """Least recently used eviction at the size limit"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache = DownloadCache(os.path.join(self.temp_dir, "cache"),
+                                   size_limit=2 * SIZE + SIZE // 2)
+        # every lookup and store happens a second after the one before
+        patcher = mock.patch.object(cache, "time")
+        patcher.start().time.side_effect = itertools.count(1000)
+        self.addCleanup(patcher.stop)
+
+    def store(self, name, size=SIZE):
+        """Downloads size bytes for name into the cache"""
+        path = self.cache.download_path(name)
+        with open(path, "wb") as fileobj:
+            fileobj.write(name.encode("utf-8") * (size // len(name)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.cache.store(name, path, "https://example.com/" + name)
+
+    def partial(self, name, size, mtime):
+        """Leaves an unfinished download for name, last written at mtime"""
+        path = self.cache.download_path(name)
+        for suffix, data in ((".partial", b"x" * size),
+                             (".partial.state", b"{}")):
+            with open(path + suffix, "wb") as fileobj:
+                fileobj.write(data)
+            os.utime(path + suffix, (mtime, mtime))
+
+    def cached(self):
+        """Returns the names of the pkgs in the cache"""
+        return sorted(os.path.splitext(name)[0]
+                      for name in os.listdir(self.cache.cache_dir)
+                      if name.endswith(".pkg"))
+
+    def test_least_recently_used_evicted(self):
+        self.store("aa")
+        self.store("bb")
+        self.assertTrue(self.cache.lookup("aa"))
+        self.store("cc")
+        self.assertEqual(self.cached(), ["aa", "cc"])
+        self.assertIsNone(self.cache.lookup("bb"))
+
+    def test_new_entry_kept_over_limit(self):
+        self.store("aa")
+        self.store("bb", 4 * SIZE)
+        self.assertEqual(self.cached(), ["bb"])
+
+    def test_within_limit_nothing_evicted(self):
+        self.store("aa")
+        self.store("bb")
+        self.assertEqual(self.cached(), ["aa", "bb"])
+
+    def test_stale_partial_download_evicted(self):
+        self.partial("old", SIZE, mtime=10)
+        self.store("aa")
+        self.assertEqual(
+            sorted((size, key, partial) for (_last_used, size, key, partial)
+                   in self.cache.entries()),
+            [(SIZE, "aa", False), (SIZE + 2, "old", True)])
+        self.store("bb")
+        self.assertEqual(self.cached(), ["aa", "bb"])
+        self.assertEqual(
+            [name for name in os.listdir(self.cache.cache_dir)
+             if name.startswith("old")], [])
+
+    def test_partial_download_counts_towards_limit(self):
+        self.store("aa")
+        # newer than every entry, so the entries go first
+        self.partial("new", SIZE, mtime=2000)
+        self.store("bb")
+        self.assertEqual(self.cached(), ["bb"])
+        self.assertTrue(os.path.exists(
+            self.cache.download_path("new") + ".partial"))
+
+
+if __name__ == "__main__":
+    unittest.main()
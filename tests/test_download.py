@@ -0,0 +1,294 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.download against a local threaded HTTP server that
+can throttle and drop connections"""
+
+from __future__ import print_function
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from locallibs import get
+from locallibs.download import DownloadFailed, Downloader
+
+MB = 1024 * 1024
+CHUNK = 16 * 1024
+# 3 MB that never repeats, so a misplaced range shows up
+CONTENT = b"".join(hashlib.sha256(b"%d" % index).digest()
+                   for index in range(3 * MB // 32))
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the server's content, honoring Range unless told not to"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        content = server.content
+        ranged = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(ranged)
+        match = re.match(r"bytes=(\d+)-(\d+)$", ranged or "")
+        if match and not server.ignore_range:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(content) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d"
+                             % (start, end, len(content)))
+        else:
+            start, end = 0, len(content) - 1
+            self.send_response(200)
+        body = content[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        drop_after = None
+        # the probe for the size is never dropped
+        if ranged != "bytes=0-0":
+            with server.lock:
+                if server.drops:
+                    server.drops -= 1
+                    drop_after = server.drop_after
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            sent = 0
+            while sent < len(body):
+                if drop_after is not None and sent >= drop_after:
+                    # hang up mid-response, like a flaky mirror
+                    self.close_connection = True
+                    return
+                self.wfile.write(body[sent:sent + CHUNK])
+                sent += CHUNK
+                if server.throttle:
+                    time.sleep(server.throttle)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+class FlakyServer(ThreadingHTTPServer):
+    """A server whose behavior tests can change"""
+
+    daemon_threads = True
+
+    def __init__(self, content):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.content = content
+        self.lock = threading.Lock()
+        self.requests = []
+        self.ignore_range = False
+        # how many responses to drop, and after how many bytes
+        self.drops = 0
+        self.drop_after = 0
+        # seconds to wait after each chunk
+        self.throttle = 0
+        self.active = 0
+        self.max_active = 0
+
+    def url(self, path="/python.pkg"):
+        """Returns the URL of path on this server"""
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+
+class DownloadTestCase(unittest.TestCase):
+    """Starts a server with 3 MB of content"""
+
+    def setUp(self):
+        self.content = CONTENT
+        self.server = FlakyServer(self.content)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.destination = os.path.join(self.temp_dir, "python.pkg")
+
+    def download(self, **kwargs):
+        """Runs a Downloader quietly and returns it"""
+        kwargs.setdefault("backoff", 0)
+        kwargs.setdefault("timeout", 10)
+        downloader = Downloader(self.server.url(), self.destination,
+                                **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            downloader.download()
+        return downloader
+
+    def downloaded(self):
+        """Returns the content of the downloaded file"""
+        with open(self.destination, "rb") as fileobj:
+            return fileobj.read()
+
+
+class TestDownloader(DownloadTestCase):
+    """Ranges, resuming and retries"""
+
+    def test_parallel_ranges(self):
+        self.server.throttle = 0.001
+        self.download(connections=4)
+        self.assertEqual(self.downloaded(), self.content)
+        ranges = [request for request in self.server.requests
+                  if request != "bytes=0-0"]
+        self.assertEqual(len(ranges), 3)
+        self.assertGreater(self.server.max_active, 1)
+        self.assertFalse(os.path.exists(self.destination + ".partial"))
+        self.assertFalse(os.path.exists(
+            self.destination + ".partial.state"))
+
+    def test_resume_after_drop(self):
+        self.server.drops = 2
+        self.server.drop_after = 256 * 1024
+        self.download(connections=1)
+        self.assertEqual(self.downloaded(), self.content)
+        # each retry asks only for what is still missing
+        self.assertEqual(self.server.requests[1:], [
+            "bytes=0-%d" % (3 * MB - 1),
+            "bytes=%d-%d" % (256 * 1024, 3 * MB - 1),
+            "bytes=%d-%d" % (512 * 1024, 3 * MB - 1),
+        ])
+
+    def test_resume_interrupted_download(self):
+        self.server.drops = 1
+        self.server.drop_after = MB
+        with self.assertRaises(DownloadFailed):
+            self.download(connections=1, retries=0)
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertTrue(os.path.exists(self.destination + ".partial.state"))
+
+        downloader = self.download(connections=1)
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertEqual(downloader.bytes_downloaded, 2 * MB)
+        self.assertEqual(self.server.requests[-1],
+                         "bytes=%d-%d" % (MB, 3 * MB - 1))
+
+    def test_state_has_only_flushed_progress(self):
+        downloader = Downloader(self.server.url(), self.destination)
+        downloader.size = 3 * MB
+        downloader.parts = [[0, MB - 1, 0], [MB, 3 * MB - 1, 0]]
+        downloader.flushed = [0, 0]
+        # both parts have written data, only the first has flushed it
+        downloader.parts[0][2] = 1000
+        downloader.parts[1][2] = 2000
+        downloader._save_state(0)
+        with open(self.destination + ".partial.state") as fileobj:
+            self.assertEqual(json.load(fileobj)["parts"],
+                             [[0, MB - 1, 1000], [MB, 3 * MB - 1, 0]])
+
+    def test_retry_limit(self):
+        self.server.drops = 100
+        with self.assertRaises(DownloadFailed) as context:
+            self.download(connections=1, retries=2)
+        self.assertIn("after 3 attempts", str(context.exception))
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertFalse(os.path.exists(self.destination))
+
+    def test_server_ignoring_range(self):
+        self.server.ignore_range = True
+        self.server.drops = 1
+        self.server.drop_after = MB
+        downloader = self.download(connections=4)
+        self.assertEqual(self.downloaded(), self.content)
+        # a server that can't resume means starting over after a drop
+        self.assertEqual(self.server.requests[1:], [None, None])
+        self.assertEqual(downloader.bytes_downloaded, 4 * MB)
+
+    def test_checksum(self):
+        self.download(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.downloaded(), self.content)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(DownloadFailed) as context:
+            self.download(sha256=hashlib.sha256(b"other").hexdigest())
+        self.assertIn("Checksum", str(context.exception))
+        for suffix in ("", ".partial", ".partial.state"):
+            self.assertFalse(os.path.exists(self.destination + suffix))
+
+
+class TestCachedDownload(DownloadTestCase):
+    """FrameworkGetter's download cache"""
+
+    def getter(self, offline=False):
+        """Returns a FrameworkGetter that downloads from the server"""
+        return get.FrameworkGetter(
+            python_version="3.11.7", os_version="11",
+            base_url=self.server.url("/%s/python-%s-macos%s.pkg"),
+            cache_dir=os.path.join(self.temp_dir, "cache"), offline=offline)
+
+    def fetch(self, offline=False):
+        """Downloads quietly and returns the content"""
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            path = self.getter(offline).download()
+        with open(path, "rb") as fileobj:
+            return (path, fileobj.read())
+
+    def test_cached_download_is_reused(self):
+        self.fetch()
+        count = len(self.server.requests)
+        _path, content = self.fetch()
+        self.assertEqual(content, self.content)
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_damaged_download_is_fetched_again(self):
+        path, _content = self.fetch()
+        with open(path, "r+b") as fileobj:
+            fileobj.write(b"damaged")
+        count = len(self.server.requests)
+        _path, content = self.fetch()
+        self.assertEqual(content, self.content)
+        self.assertGreater(len(self.server.requests), count)
+
+    def test_offline_uses_cache(self):
+        self.fetch()
+        count = len(self.server.requests)
+        _path, content = self.fetch(offline=True)
+        self.assertEqual(content, self.content)
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_offline_fails_fast(self):
+        with self.assertRaises(get.DownloadError):
+            self.fetch(offline=True)
+        self.assertEqual(self.server.requests, [])
+        destination = os.path.join(self.temp_dir, "Python.framework")
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertIsNone(self.getter(offline=True).download_and_extract(
+                destination))
+        self.assertIn("offline mode is on", stderr.getvalue())
+        self.assertEqual(self.server.requests, [])
+        self.assertFalse(os.path.exists(destination))
+
+
+if __name__ == "__main__":
+    unittest.main()
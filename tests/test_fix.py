@@ -0,0 +1,190 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.fix"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from locallibs import fix
+
+SHEBANG = (b"#!/Library/Frameworks/Python.framework/Versions/3.11/bin/"
+           b"python3.11")
+
+# stands in for codesign: logs its files, notes how many copies run at
+# once, and fails when asked to sign a file with "fail" in its name
+FAKE_CODESIGN = """#!%(python)s
+import os, sys, time
+log_dir = %(log_dir)r
+files = [arg for arg in sys.argv[1:] if not arg.startswith("-")
+         and arg != "-"]
+marker = os.path.join(log_dir, "running-%%d" %% os.getpid())
+open(marker, "w").close()
+time.sleep(0.2)
+running = len([name for name in os.listdir(log_dir)
+               if name.startswith("running-")])
+os.unlink(marker)
+with open(os.path.join(log_dir, "log"), "a") as fileobj:
+    fileobj.write("%%d %%s\\n" %% (running, " ".join(files)))
+sys.exit(1 if any("fail" in name for name in files) else 0)
+"""
+
+
+class TestSigningBatches(unittest.TestCase):
+    """fix_broken_signatures with a fake codesign binary"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.log_dir = os.path.join(self.temp_dir, "log")
+        os.makedirs(self.log_dir)
+        self.codesign = os.path.join(self.temp_dir, "codesign")
+        with open(self.codesign, "w") as fileobj:
+            fileobj.write(FAKE_CODESIGN % {
+                "python": sys.executable, "log_dir": self.log_dir})
+        os.chmod(self.codesign, 0o755)
+
+    def sign(self, files, **kwargs):
+        """Signs files with the fake codesign. Returns the timings and the
+        output"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            timings = fix.fix_broken_signatures(
+                files, codesign=self.codesign, **kwargs)
+        return timings, output.getvalue()
+
+    def invocations(self):
+        """Returns (copies running, files) for each codesign run"""
+        with open(os.path.join(self.log_dir, "log")) as fileobj:
+            return [(int(line.split()[0]), line.split()[1:])
+                    for line in fileobj]
+
+    def test_batches(self):
+        files = ["/f/lib%d.dylib" % index for index in range(7)]
+        timings, output = self.sign(files, batch_size=3)
+        self.assertEqual(
+            sorted(batch for _running, batch in self.invocations()),
+            [files[0:3], files[3:6], files[6:7]])
+        self.assertEqual(sorted(timings), files)
+        self.assertIn("Re-signed a batch of 3 files", output)
+        self.assertIn("Re-signed /f/lib6.dylib with ad-hoc signature in ",
+                      output)
+
+    def test_batches_in_parallel(self):
+        files = ["/f/lib%d.dylib" % index for index in range(8)]
+        self.sign(files, batch_size=2, jobs=4)
+        invocations = self.invocations()
+        self.assertEqual(len(invocations), 4)
+        self.assertGreater(max(running for running, _batch in invocations),
+                           1)
+        self.assertEqual(
+            sorted(name for _running, batch in invocations
+                   for name in batch), sorted(files))
+
+    def test_one_at_a_time(self):
+        files = ["/f/lib%d.dylib" % index for index in range(3)]
+        self.sign(files, batch_size=3, jobs=1)
+        self.assertEqual(self.invocations(), [(1, files)])
+
+    def test_failing_batch(self):
+        files = ["/f/lib0.dylib", "/f/fail.dylib", "/f/lib2.dylib"]
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.sign(files, batch_size=1, jobs=2)
+
+
+class TestShebangs(unittest.TestCase):
+    """fix_script_shebangs on scripts in bin and elsewhere"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.framework_path = os.path.join(self.temp_dir, "Python.framework")
+        self.version_dir = os.path.join(
+            self.framework_path, "Versions", "3.11")
+        os.makedirs(os.path.join(self.version_dir, "bin"))
+
+    def write(self, relative_path, data, mode=0o755):
+        """Writes a file inside Versions/3.11 and returns its path"""
+        path = os.path.join(self.version_dir, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fileobj:
+            fileobj.write(data)
+        os.chmod(path, mode)
+        return path
+
+    def fix(self):
+        """Fixes the shebangs quietly"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(
+                fix.fix_script_shebangs(self.framework_path, "3.11"))
+
+    def read(self, path):
+        """Returns the contents of path"""
+        with open(path, "rb") as fileobj:
+            return fileobj.read()
+
+    def relocatable(self, body):
+        """Returns what a bin script with body should become"""
+        return fix.RELOCATABLE_SHEBANG % (b"python3.11", b"python3.11") + body
+
+    def test_script(self):
+        path = self.write("bin/pip3", SHEBANG + b"\nimport pip\n")
+        self.fix()
+        self.assertEqual(self.read(path), self.relocatable(b"import pip\n"))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o755)
+
+    def test_crlf(self):
+        path = self.write("bin/tool", SHEBANG + b"\r\nimport sys\r\n")
+        self.fix()
+        self.assertEqual(self.read(path), self.relocatable(b"import sys\r\n"))
+
+    def test_missing_newline(self):
+        path = self.write("bin/tool", SHEBANG)
+        self.fix()
+        self.assertEqual(self.read(path), self.relocatable(b""))
+
+    def test_non_executable_script_in_bin(self):
+        path = self.write("bin/tool", SHEBANG + b"\nimport sys\n", 0o644)
+        self.fix()
+        self.assertEqual(self.read(path), self.relocatable(b"import sys\n"))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+    def test_scripts_outside_bin(self):
+        executable = self.write("lib/python3.11/tool.py",
+                                SHEBANG + b"\nimport sys\n")
+        plain = self.write("lib/python3.11/module.py",
+                           SHEBANG + b"\nimport sys\n", 0o644)
+        self.fix()
+        self.assertTrue(self.read(executable).startswith(b"#!/bin/sh\n"))
+        self.assertIn(b"../../bin/python3.11", self.read(executable))
+        self.assertEqual(self.read(plain), SHEBANG + b"\nimport sys\n")
+
+    def test_other_shebang_untouched(self):
+        path = self.write("bin/tool", b"#!/bin/sh\necho hi\n")
+        self.fix()
+        self.assertEqual(self.read(path), b"#!/bin/sh\necho hi\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,213 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the wheelhouse in locallibs.install, with a directory of
+wheels standing in for the package index"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from unittest import mock
+
+from locallibs import install
+
+VERSION = "%d.%d" % sys.version_info[:2]
+
+
+def make_wheel(directory, name, version, files=None):
+    """Writes a pure-Python wheel for name and version into directory and
+    returns its filename. files maps the names of the members outside the
+    .dist-info to their contents, and defaults to a name/__init__.py"""
+    filename = "%s-%s-py3-none-any.whl" % (name, version)
+    dist_info = "%s-%s.dist-info" % (name, version)
+    if files is None:
+        files = {"%s/__init__.py" % name: "VERSION = %r\n" % version}
+    with zipfile.ZipFile(os.path.join(directory, filename), "w") as archive:
+        for member in sorted(files):
+            archive.writestr(member, files[member])
+        archive.writestr(dist_info + "/METADATA",
+                         "Metadata-Version: 2.1\nName: %s\nVersion: %s\n"
+                         % (name, version))
+        archive.writestr(dist_info + "/WHEEL",
+                         "Wheel-Version: 1.0\nGenerator: tests\n"
+                         "Root-Is-Purelib: true\nTag: py3-none-any\n")
+        archive.writestr(dist_info + "/RECORD", "")
+    return filename
+
+
+class TestWheelhouse(unittest.TestCase):
+    """Filling the wheelhouse, its stamp, and installing from it"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        # pip finds everything in index and nothing on the network
+        self.index = os.path.join(self.temp_dir, "index")
+        os.makedirs(self.index)
+        make_wheel(self.index, "wheel", "0.99")
+        make_wheel(self.index, "tinypkg", "1.0")
+        make_wheel(self.index, "tinypkg", "2.0")
+        patcher = mock.patch.dict(os.environ, {
+            "PIP_NO_INDEX": "1",
+            "PIP_FIND_LINKS": self.index,
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+            "PIP_QUIET": "1",
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wheelhouse = os.path.join(self.temp_dir, "wheelhouse")
+        self.requirements = os.path.join(self.temp_dir, "requirements.txt")
+        self.set_requirements("tinypkg==1.0\n")
+
+    def set_requirements(self, text):
+        """Rewrites the requirements file"""
+        with open(self.requirements, "w") as fileobj:
+            fileobj.write(text)
+
+    def framework(self, name):
+        """Returns a new framework whose python is the one running the
+        tests"""
+        framework_path = os.path.join(self.temp_dir, name)
+        bin_dir = os.path.join(framework_path, "Versions", VERSION, "bin")
+        os.makedirs(bin_dir)
+        os.symlink(sys.executable, os.path.join(bin_dir, "python" + VERSION))
+        return framework_path
+
+    def install(self, framework_path, **kwargs):
+        """Installs the requirements directly (so pip never touches the
+        python running the tests) and returns how often the wheelhouse
+        was filled"""
+        with mock.patch.object(install, "fill_wheelhouse",
+                               wraps=install.fill_wheelhouse) as fill, \
+                contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            install.install_with_wheelhouse(
+                framework_path, VERSION, self.wheelhouse,
+                requirements_file=self.requirements, direct=True, **kwargs)
+        return fill.call_count
+
+    def house(self, framework_path):
+        """Returns the wheelhouse subdirectory for the framework"""
+        python_path = install.framework_python(framework_path, VERSION)
+        return install.wheelhouse_dir(self.wheelhouse, python_path, VERSION)
+
+    def installed_version(self, framework_path):
+        """Returns the VERSION of the tinypkg installed in the framework"""
+        path = os.path.join(
+            framework_path, "Versions", VERSION, "lib", "python" + VERSION,
+            "site-packages", "tinypkg", "__init__.py")
+        with open(path) as fileobj:
+            return fileobj.read()
+
+    def test_fill_from_index(self):
+        framework_path = self.framework("First.framework")
+        self.assertEqual(self.install(framework_path), 1)
+        house = self.house(framework_path)
+        self.assertEqual(
+            sorted(name for name in os.listdir(house)
+                   if name.endswith(".whl")),
+            ["tinypkg-1.0-py3-none-any.whl", "wheel-0.99-py3-none-any.whl"])
+        self.assertEqual(os.listdir(os.path.join(house, "downloads")), [])
+        stamp = install.wheelhouse_stamp(house, self.requirements, False)
+        self.assertEqual(
+            sorted(install.read_stamp(stamp)),
+            ["tinypkg-1.0-py3-none-any.whl", "wheel-0.99-py3-none-any.whl"])
+        self.assertEqual(self.installed_version(framework_path),
+                         "VERSION = '1.0'\n")
+
+    def test_stamped_wheelhouse_is_reused(self):
+        self.assertEqual(self.install(self.framework("First.framework")), 1)
+        # the index is gone, so only the wheelhouse can satisfy this
+        shutil.rmtree(self.index)
+        framework_path = self.framework("Second.framework")
+        self.assertEqual(self.install(framework_path), 0)
+        self.assertEqual(self.installed_version(framework_path),
+                         "VERSION = '1.0'\n")
+
+    def test_stamp_mismatch_invalidates_wheelhouse(self):
+        first = self.framework("First.framework")
+        self.assertEqual(self.install(first), 1)
+        house = self.house(first)
+        old_stamp = install.wheelhouse_stamp(house, self.requirements, False)
+
+        self.set_requirements("tinypkg==2.0\n")
+        new_stamp = install.wheelhouse_stamp(house, self.requirements, False)
+        self.assertNotEqual(old_stamp, new_stamp)
+        self.assertIsNone(install.read_stamp(new_stamp))
+        second = self.framework("Second.framework")
+        self.assertEqual(self.install(second), 1)
+        self.assertEqual(
+            sorted(install.read_stamp(new_stamp)),
+            ["tinypkg-2.0-py3-none-any.whl", "wheel-0.99-py3-none-any.whl"])
+        self.assertEqual(self.installed_version(second),
+                         "VERSION = '2.0'\n")
+
+    def test_stamp_depends_on_pip_upgrade(self):
+        house = os.path.join(self.temp_dir, "house")
+        self.assertNotEqual(
+            install.wheelhouse_stamp(house, self.requirements, False),
+            install.wheelhouse_stamp(house, self.requirements, True))
+        self.assertEqual(
+            install.wheelhouse_stamp(house, self.requirements, False),
+            install.wheelhouse_stamp(house, self.requirements, False))
+
+    def test_rebuilt_wheel_is_found(self):
+        framework_path = self.framework("First.framework")
+        house = os.path.join(self.temp_dir, "house")
+        os.makedirs(house)
+        # left by an earlier fill, under the name the rebuild will have
+        wheel = make_wheel(house, "tinypkg", "1.0")
+        os.utime(os.path.join(house, wheel), (1000000000, 1000000000))
+
+        def download(cmd, **_kwargs):
+            """Downloads an sdist, as pip would for a package without
+            wheels"""
+            downloads = cmd[cmd.index("--dest") + 1]
+            open(os.path.join(downloads, "tinypkg-1.0.tar.gz"), "w").close()
+
+        def build_wheel(_python_path, house, sdist, _env):
+            """Builds the sdist into a wheel, replacing the old one"""
+            make_wheel(house, "tinypkg", "1.0")
+            return (sdist, None)
+
+        with mock.patch.object(install.trace, "check_call", download), \
+                mock.patch.object(install, "build_wheel", build_wheel), \
+                contextlib.redirect_stdout(io.StringIO()):
+            wheels = install.fill_wheelhouse(framework_path, VERSION, house)
+        self.assertEqual(wheels, [wheel])
+        self.assertEqual(os.listdir(os.path.join(house, "downloads")), [])
+
+    def test_offline_does_not_fill(self):
+        framework_path = self.framework("First.framework")
+        self.assertEqual(self.install(framework_path), 1)
+        self.set_requirements("tinypkg==2.0\n")
+        with mock.patch.object(install, "install_from_wheelhouse") as pip:
+            self.assertEqual(self.install(framework_path, offline=True), 0)
+        # without a stamp the wheels are unknown, so pip resolves them
+        pip.assert_called_once_with(
+            framework_path, VERSION, self.house(framework_path),
+            requirements_file=self.requirements, upgrade_pip=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,429 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.macho and locallibs.thin on generated and
+checked-in Mach-O files"""
+
+from __future__ import print_function
+
+import contextlib
+import errno
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import macho, synthetic, thin
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+ARM64 = macho.CPU_TYPES["arm64"]
+X86_64 = macho.CPU_TYPES["x86_64"]
+PPC = macho.CPU_TYPES["ppc"]
+LIBSYSTEM = synthetic.LIBSYSTEM
+
+
+def image32_big_endian(install_name, dependencies=(), rpaths=()):
+    """Returns a 32-bit big-endian (ppc) dylib with a __TEXT segment and
+    the given dylib and rpath load commands"""
+    def lc_str(cmd, fixed, string):
+        raw = string.encode("UTF-8") + b"\0"
+        size = (12 + len(fixed) + len(raw) + 3) // 4 * 4
+        return (struct.pack(">3I", cmd, size, 12 + len(fixed)) + fixed
+                + raw.ljust(size - 12 - len(fixed), b"\0"))
+    dylib = struct.pack(">3I", 2, 0x10000, 0x10000)
+    commands = [
+        struct.pack(">2I16s8I", macho.LC_SEGMENT, 56 + 68, b"__TEXT",
+                    0, 0x2000, 0, 0x2000, 5, 5, 1, 0)
+        + struct.pack(">16s16s9I", b"__text", b"__TEXT", 0x1000, 0x1000,
+                      0x1000, 2, 0, 0, 0x80000400, 0, 0),
+        lc_str(macho.LC_ID_DYLIB, dylib, install_name),
+    ]
+    commands += [lc_str(macho.LC_LOAD_DYLIB, dylib, name)
+                 for name in dependencies]
+    commands += [lc_str(macho.LC_RPATH, b"", rpath) for rpath in rpaths]
+    load_commands = b"".join(commands)
+    header = struct.pack(">7I", macho.MH_MAGIC, PPC, 0, macho.MH_DYLIB,
+                         len(commands), len(load_commands), 0)
+    return (header + load_commands).ljust(0x2000, b"\0")
+
+
+def fat64_image(slices):
+    """Returns a FAT_MAGIC_64 image holding the (cputype, image) pairs"""
+    output = bytearray(struct.pack(">2I", macho.FAT_MAGIC_64, len(slices)))
+    output += b"\0" * (32 * len(slices))
+    for index, (cputype, image) in enumerate(slices):
+        offset = (len(output) + 0x3FFF) // 0x4000 * 0x4000
+        output += b"\0" * (offset - len(output)) + image
+        struct.pack_into(">2i2QI4x", output, 8 + index * 32, cputype, 0,
+                         offset, len(image), 14)
+    return bytes(output)
+
+
+class TestParse(unittest.TestCase):
+    """Load commands, fat headers and both byte orders"""
+
+    def test_dylib_load_commands(self):
+        data = synthetic.thin_image(
+            ARM64, macho.MH_DYLIB, "/Library/Frameworks/libfoo.dylib",
+            [LIBSYSTEM, "/Library/Frameworks/libbar.dylib"],
+            ["@loader_path/../lib"])
+        parsed = macho.parse(data)
+        self.assertFalse(parsed.is_fat)
+        self.assertEqual(parsed.install_name,
+                         "/Library/Frameworks/libfoo.dylib")
+        self.assertEqual(parsed.dependencies,
+                         [LIBSYSTEM, "/Library/Frameworks/libbar.dylib"])
+        self.assertEqual(parsed.rpaths, ["@loader_path/../lib"])
+        item = parsed.slices[0]
+        self.assertEqual((item.cputype, item.filetype, item.is_64,
+                          item.byteorder),
+                         (ARM64, macho.MH_DYLIB, True, "<"))
+        self.assertEqual([segment.name for segment in item.segments],
+                         ["__TEXT", "__LINKEDIT"])
+        self.assertEqual(item.first_section_offset, synthetic.HEADER_PAD)
+        self.assertEqual(item.padding,
+                         synthetic.HEADER_PAD - item.load_commands_end)
+        self.assertIsNone(item.code_signature)
+
+    def test_other_dylib_load_commands(self):
+        names = ["/usr/lib/lib%d.dylib" % index for index in range(5)]
+        data = bytearray(synthetic.thin_image(
+            ARM64, macho.MH_EXECUTE, dependencies=names))
+        loads = [offset for (cmd, offset, _size)
+                 in macho.parse(data).slices[0].commands
+                 if cmd == macho.LC_LOAD_DYLIB]
+        for offset, cmd in zip(loads, macho.DYLIB_LOAD_COMMANDS):
+            struct.pack_into("<I", data, offset, cmd)
+        self.assertEqual(macho.parse(data).dependencies, names)
+
+    def test_32_bit_big_endian(self):
+        data = image32_big_endian("/Library/Frameworks/libppc.dylib",
+                                  [LIBSYSTEM], ["/opt/lib"])
+        parsed = macho.parse(data)
+        item = parsed.slices[0]
+        self.assertEqual((item.cputype, item.is_64, item.byteorder),
+                         (PPC, False, ">"))
+        self.assertEqual(parsed.install_name,
+                         "/Library/Frameworks/libppc.dylib")
+        self.assertEqual(parsed.dependencies, [LIBSYSTEM])
+        self.assertEqual(parsed.rpaths, ["/opt/lib"])
+        self.assertEqual(item.first_section_offset, 0x1000)
+        self.assertEqual(macho.file_type("", data[:48]), macho.MH_DYLIB)
+
+    def test_fat(self):
+        data = synthetic.fat_image([
+            (ARM64, synthetic.thin_image(
+                ARM64, macho.MH_BUNDLE, dependencies=[LIBSYSTEM, "/a"])),
+            (X86_64, synthetic.thin_image(
+                X86_64, macho.MH_BUNDLE, dependencies=[LIBSYSTEM, "/b"],
+                rpaths=["/r"])),
+        ])
+        parsed = macho.parse(data)
+        self.assertTrue(parsed.is_fat)
+        self.assertEqual([item.cputype for item in parsed.slices],
+                         [ARM64, X86_64])
+        for item in parsed.slices:
+            self.assertEqual(item.offset % (1 << synthetic.SLICE_ALIGN), 0)
+            self.assertEqual(item.align, synthetic.SLICE_ALIGN)
+        # like otool -L, every slice's dependencies once each
+        self.assertEqual(parsed.dependencies, [LIBSYSTEM, "/a", "/b"])
+        self.assertEqual(parsed.rpaths, ["/r"])
+
+    def test_fat64(self):
+        data = fat64_image([
+            (ARM64, synthetic.thin_image(ARM64, macho.MH_DYLIB, "/x")),
+            (PPC, image32_big_endian("/x")),
+        ])
+        parsed = macho.parse(data)
+        self.assertTrue(parsed.is_fat)
+        self.assertEqual([item.cputype for item in parsed.slices],
+                         [ARM64, PPC])
+        self.assertEqual(parsed.install_name, "/x")
+
+    def test_fixtures(self):
+        for arch, cputype, rpaths in (("arm64", ARM64,
+                                       ["/opt/arm64-builds/lib"]),
+                                      ("x86_64", X86_64, [])):
+            parsed = macho.read(os.path.join(
+                FIXTURES, "libXau.6.0.0-%s.dylib" % arch))
+            item = parsed.slices[0]
+            self.assertEqual(item.cputype, cputype)
+            self.assertEqual(parsed.install_name,
+                             "/DLC/PIL/.dylibs/libXau.6.0.0.dylib")
+            self.assertEqual(parsed.dependencies, [LIBSYSTEM])
+            self.assertEqual(parsed.rpaths, rpaths)
+            self.assertEqual(item.segments[-1].name, "__LINKEDIT")
+            self.assertIsNotNone(item.code_signature)
+
+
+class TestCorrupt(unittest.TestCase):
+    """Input that isn't, or is no longer, a valid Mach-O file"""
+
+    def setUp(self):
+        self.data = synthetic.thin_image(
+            ARM64, macho.MH_DYLIB, "/Library/Frameworks/libfoo.dylib",
+            [LIBSYSTEM])
+
+    def assert_bad(self, data):
+        """Checks that data is rejected with MachOError"""
+        with self.assertRaises(macho.MachOError):
+            macho.parse(data)
+
+    def first_command(self, cmd):
+        """Returns the offset of the first load command of type cmd"""
+        for (command, offset, _size) in macho.parse(
+                self.data).slices[0].commands:
+            if command == cmd:
+                return offset
+        raise AssertionError("No load command 0x%x" % cmd)
+
+    def test_not_mach_o(self):
+        self.assert_bad(b"")
+        self.assert_bad(b"#!/usr/bin/python3\n" * 4)
+        self.assert_bad(self.data[:20])
+        self.assertEqual(macho.file_type("", b"#!/usr/bin/python3\n"), 0)
+
+    def test_java_class_file(self):
+        # 0xCAFEBABE followed by a class file version, not a fat header
+        data = struct.pack(">2I", macho.FAT_MAGIC, 0x34) + b"\0" * 64
+        self.assertIsNone(macho.parse_fat_header(data))
+        self.assert_bad(data)
+        self.assertEqual(macho.file_type("", data), 0)
+
+    def test_truncated_load_commands(self):
+        end = macho.parse(self.data).slices[0].load_commands_end
+        self.assert_bad(self.data[:end - 1])
+
+    def test_too_many_commands(self):
+        data = bytearray(self.data)
+        struct.pack_into("<I", data, 16, 1000)
+        self.assert_bad(data)
+
+    def test_bad_command_size(self):
+        offset = self.first_command(macho.LC_ID_DYLIB)
+        for cmdsize in (0, 4, 0x100000):
+            data = bytearray(self.data)
+            struct.pack_into("<I", data, offset + 4, cmdsize)
+            self.assert_bad(data)
+
+    def test_bad_string_offset(self):
+        offset = self.first_command(macho.LC_LOAD_DYLIB)
+        data = bytearray(self.data)
+        struct.pack_into("<I", data, offset + 8, 0x1000)
+        self.assert_bad(data)
+
+    def test_truncated_fat_header(self):
+        data = synthetic.fat_image([(ARM64, self.data),
+                                    (X86_64, self.data)])
+        self.assert_bad(data[:30])
+        self.assert_bad(data[:-1])
+
+    def test_read_empty_file(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, "empty.so")
+        open(path, "wb").close()
+        with self.assertRaises(macho.MachOError):
+            macho.read(path)
+
+
+class TestFileType(unittest.TestCase):
+    """file_type on Mach-O files of every kind and on other files"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def file_type(self, data):
+        """Writes data to a file and returns its file_type, checking that
+        passing the first bytes as header gives the same answer"""
+        path = os.path.join(self.temp_dir, "file")
+        with open(path, "wb") as fileobj:
+            fileobj.write(data)
+        filetype = macho.file_type(path)
+        self.assertEqual(macho.file_type(path, data[:64]), filetype)
+        return filetype
+
+    def test_thin(self):
+        for filetype in (macho.MH_EXECUTE, macho.MH_DYLIB, macho.MH_BUNDLE):
+            self.assertEqual(
+                self.file_type(synthetic.thin_image(ARM64, filetype)),
+                filetype)
+
+    def test_universal2(self):
+        data = synthetic.mach_o(True, macho.MH_BUNDLE, text_size=1024)
+        self.assertEqual(self.file_type(data), macho.MH_BUNDLE)
+        data = fat64_image([
+            (ARM64, synthetic.thin_image(ARM64, macho.MH_DYLIB, "/x")),
+            (PPC, image32_big_endian("/x")),
+        ])
+        self.assertEqual(self.file_type(data), macho.MH_DYLIB)
+
+    def test_32_bit(self):
+        self.assertEqual(self.file_type(image32_big_endian("/x")),
+                         macho.MH_DYLIB)
+        little_endian = struct.pack(
+            "<7I", macho.MH_MAGIC, macho.CPU_TYPES["i386"], 0,
+            macho.MH_EXECUTE, 0, 0, 0)
+        self.assertEqual(self.file_type(little_endian), macho.MH_EXECUTE)
+
+    def test_truncated(self):
+        thin = synthetic.thin_image(ARM64, macho.MH_DYLIB)
+        fat = synthetic.fat_image([(ARM64, thin), (X86_64, thin)])
+        for data in (b"", thin[:7], thin[:15], fat[:7]):
+            self.assertEqual(self.file_type(data), 0)
+        # the fat header is whole but the first slice is missing
+        self.assertEqual(self.file_type(fat[:48]), 0)
+        no_archs = struct.pack(">2I", macho.FAT_MAGIC, 0) + b"\0" * 40
+        self.assertEqual(self.file_type(no_archs), 0)
+
+    def test_text_files(self):
+        for data in (b"#!/usr/bin/python3\nprint('hello')\n",
+                     b"value = 1\n" * 100,
+                     "caf\u00e9\n".encode("UTF-8"),
+                     # a Java class file starts with the fat magic
+                     struct.pack(">2I", macho.FAT_MAGIC, 0x34) + b"\0" * 64):
+            self.assertEqual(self.file_type(data), 0)
+
+
+class TestRewrite(unittest.TestCase):
+    """In-process install_name_tool edits"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, "libfoo.dylib")
+
+    def test_edits_every_slice(self):
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(synthetic.mach_o(
+                True, macho.MH_DYLIB, "/Library/Frameworks/libfoo.dylib",
+                [LIBSYSTEM, "/Library/Frameworks/libbar.dylib"]))
+        plan = macho.RewritePlan()
+        plan.set_install_name("@rpath/libfoo.dylib")
+        plan.change("/Library/Frameworks/libbar.dylib",
+                    "@rpath/libbar.dylib")
+        plan.add_rpath("@loader_path/")
+        self.assertTrue(macho.rewrite(self.path, plan))
+        parsed = macho.read(self.path)
+        for item in parsed.slices:
+            self.assertEqual(item.install_name, "@rpath/libfoo.dylib")
+            self.assertEqual(item.dependencies,
+                             [LIBSYSTEM, "@rpath/libbar.dylib"])
+            self.assertEqual(item.rpaths, ["@loader_path/"])
+        self.assertFalse(macho.rewrite(self.path, plan))
+        self.assertEqual(macho.RewritePlan.from_dict(plan.as_dict())
+                         .describe(), plan.describe())
+
+    def test_hash_mismatch_leaves_file(self):
+        data = synthetic.thin_image(ARM64, macho.MH_DYLIB, "/libfoo.dylib")
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(data)
+        plan = macho.RewritePlan()
+        plan.set_install_name("@rpath/libfoo.dylib")
+        self.assertIsNone(macho.rewrite(self.path, plan, "0" * 64))
+        with open(self.path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), data)
+
+    def test_failed_write_is_cleaned_up(self):
+        data = synthetic.thin_image(ARM64, macho.MH_DYLIB, "/libfoo.dylib")
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(data)
+        plan = macho.RewritePlan()
+        plan.set_install_name("@rpath/libfoo.dylib")
+        with mock.patch.object(macho.os, "rename",
+                               side_effect=OSError(errno.EACCES, "denied")):
+            with self.assertRaises(OSError):
+                macho.rewrite(self.path, plan)
+        self.assertEqual(os.listdir(self.temp_dir), ["libfoo.dylib"])
+        with open(self.path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), data)
+
+
+class TestThin(unittest.TestCase):
+    """Removing architectures from fat files"""
+
+    def setUp(self):
+        self.slices = [
+            (cputype, synthetic.thin_image(cputype, macho.MH_DYLIB, "/x",
+                                           text_size=4096 * (index + 1)))
+            for index, cputype in enumerate((ARM64, X86_64, PPC))]
+        self.data = synthetic.fat_image(self.slices)
+
+    def test_keep_one(self):
+        self.assertEqual(macho.thin(self.data, set([X86_64])),
+                         self.slices[1][1])
+
+    def test_keep_two(self):
+        thinned = macho.thin(self.data, set([ARM64, PPC]))
+        parsed = macho.parse(thinned)
+        self.assertEqual([item.cputype for item in parsed.slices],
+                         [ARM64, PPC])
+        for item, (_cputype, image) in zip(parsed.slices,
+                                           [self.slices[0], self.slices[2]]):
+            self.assertEqual(item.offset % (1 << synthetic.SLICE_ALIGN), 0)
+            self.assertEqual(thinned[item.offset:item.offset + item.size],
+                             image)
+
+    def test_nothing_to_remove(self):
+        self.assertIsNone(macho.thin(self.data, set([ARM64, X86_64, PPC])))
+        self.assertIsNone(macho.thin(self.slices[0][1], set([X86_64])))
+
+    def test_nothing_left(self):
+        with self.assertRaises(macho.MachOError):
+            macho.thin(self.data, set([macho.CPU_TYPES["i386"]]))
+
+    def test_parse_archs(self):
+        self.assertEqual(thin.parse_archs("arm64,x86_64"),
+                         set([ARM64, X86_64]))
+        for text in ("", "arm64,sparc"):
+            with self.assertRaises(ValueError):
+                thin.parse_archs(text)
+
+    def test_thin_framework(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        framework = synthetic.generate(temp_dir, dylibs=3, so_files=5,
+                                       fat=True, stdlib_files=5,
+                                       text_size=4096)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(thin.thin_framework(framework, set([ARM64]),
+                                                jobs=2))
+        for root, _dirs, files in os.walk(framework):
+            for name in files:
+                path = os.path.join(root, name)
+                if macho.file_type(path):
+                    parsed = macho.read(path)
+                    self.assertFalse(parsed.is_fat, path)
+                    self.assertEqual(parsed.slices[0].cputype, ARM64)
+
+    def test_thin_framework_missing_arch(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        framework = synthetic.generate(temp_dir, dylibs=1, so_files=1,
+                                       fat=True, stdlib_files=1,
+                                       text_size=4096)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            self.assertFalse(thin.thin_framework(framework, set([PPC])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.manifest, and for incremental relocatablizing"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import relocatablizer, synthetic
+from locallibs.manifest import Manifest, manifest_path
+
+RESULT = {"category": "dylibs", "install_name": "/lib/libfoo.dylib",
+          "dependencies": [], "rpaths": []}
+
+
+class TestManifest(unittest.TestCase):
+    """Recording, looking up, pruning and retargeting entries"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.framework_path = os.path.join(self.temp_dir, "Python.framework")
+        os.makedirs(self.framework_path)
+
+    def write(self, name, data):
+        """Writes a file in the framework and returns its path"""
+        path = os.path.join(self.framework_path, name)
+        with open(path, "wb") as fileobj:
+            fileobj.write(data)
+        return path
+
+    def touch(self, path):
+        """Moves the mtime of path without changing its contents"""
+        stat_result = os.stat(path)
+        os.utime(path, (stat_result.st_atime, stat_result.st_mtime + 10))
+
+    def test_lookup(self):
+        manifest = Manifest(self.framework_path)
+        path = self.write("libfoo.dylib", b"library")
+        self.assertEqual(manifest.lookup(path), (False, None))
+        manifest.record(path, RESULT)
+        self.assertEqual(manifest.lookup(path), (True, RESULT))
+        # same bytes, newer mtime: the hash says it is unchanged
+        self.touch(path)
+        self.assertEqual(manifest.lookup(path), (True, RESULT))
+        self.write("libfoo.dylib", b"LIBRARY")
+        self.assertEqual(manifest.lookup(path), (False, None))
+
+    def test_lookup_without_hash(self):
+        manifest = Manifest(self.framework_path)
+        path = self.write("README", b"text")
+        manifest.record(path, None)
+        self.assertEqual(manifest.lookup(path), (True, None))
+        # only Mach-O files are hashed, so any stat change is a change
+        self.touch(path)
+        self.assertEqual(manifest.lookup(path), (False, None))
+
+    def test_record_keeps_flags_of_same_bytes(self):
+        manifest = Manifest(self.framework_path)
+        path = self.write("libfoo.dylib", b"library")
+        manifest.mark([path], lambda _path: RESULT, rewritten=True)
+        self.assertEqual(manifest.unsigned(), [path])
+        manifest.mark([path], lambda _path: RESULT, signed=True)
+        self.assertEqual(manifest.unsigned(), [])
+        manifest.record(path, RESULT)
+        self.assertTrue(manifest.entries["libfoo.dylib"]["signed"])
+        self.write("libfoo.dylib", b"LIBRARY")
+        manifest.record(path, RESULT)
+        self.assertFalse(manifest.entries["libfoo.dylib"]["signed"])
+
+    def test_prune(self):
+        manifest = Manifest(self.framework_path)
+        kept = self.write("kept", b"kept")
+        gone = self.write("gone", b"gone")
+        manifest.record(kept, None)
+        manifest.record(gone, None)
+        manifest.prune([kept])
+        self.assertEqual(list(manifest.entries), ["kept"])
+
+    def test_save_and_load(self):
+        manifest = Manifest(self.framework_path)
+        path = self.write("libfoo.dylib", b"library")
+        manifest.record(path, RESULT)
+        manifest.prefix = "/Library/Frameworks/Python.framework"
+        manifest.renames = {"/lib/libfoo.dylib": "@rpath/libfoo.dylib"}
+        manifest.save()
+        self.assertTrue(os.path.exists(manifest_path(self.framework_path)))
+        loaded = Manifest(self.framework_path)
+        self.assertEqual(loaded.entries, manifest.entries)
+        self.assertEqual(loaded.prefix, manifest.prefix)
+        self.assertEqual(loaded.renames, manifest.renames)
+        self.assertFalse(Manifest(self.framework_path, load=False))
+
+    def test_retarget(self):
+        manifest = Manifest(self.framework_path)
+        kept = self.write("libfoo.dylib", b"library")
+        gone = self.write("README", b"text")
+        manifest.record(kept, RESULT)
+        manifest.record(gone, None)
+        copy_path = os.path.join(self.temp_dir, "Copy.framework")
+        shutil.copytree(self.framework_path, copy_path)
+        os.unlink(os.path.join(copy_path, "README"))
+        manifest.retarget(copy_path)
+        self.assertEqual(manifest.path, manifest_path(copy_path))
+        self.assertEqual(list(manifest.entries), ["libfoo.dylib"])
+        copied = os.path.join(copy_path, "libfoo.dylib")
+        self.assertEqual(manifest.entries["libfoo.dylib"]["stat"],
+                         Manifest._identity(os.stat(copied)))
+        self.assertEqual(manifest.lookup(copied), (True, RESULT))
+
+
+class TestIncremental(unittest.TestCase):
+    """relocatablize with a manifest from an earlier run"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.pristine = synthetic.generate(
+            os.path.join(self.temp_dir, "pristine"), dylibs=3, so_files=5,
+            stdlib_files=0, scripts=0, text_size=1024)
+        self.framework_path = os.path.join(
+            self.temp_dir, "build", "Python.framework")
+        shutil.copytree(self.pristine, self.framework_path, symlinks=True)
+
+    def relocatablize(self):
+        """Relocatablizes with the saved manifest and marks the files
+        signed, as a build does. Returns the files changed and the paths
+        analyzed"""
+        manifest = Manifest(self.framework_path)
+        inspect_entry = relocatablizer.inspect_entry
+        with mock.patch.object(relocatablizer, "inspect_entry",
+                               wraps=inspect_entry) as inspect, \
+                contextlib.redirect_stdout(io.StringIO()):
+            files_changed = relocatablizer.relocatablize(
+                self.framework_path, manifest=manifest)
+        manifest.mark(files_changed, relocatablizer.manifest_record,
+                      signed=True)
+        manifest.save()
+        return (files_changed,
+                [call[0][0].path for call in inspect.call_args_list])
+
+    def test_unchanged_files_skipped(self):
+        files_changed, analyzed = self.relocatablize()
+        self.assertTrue(files_changed)
+        self.assertIn(files_changed[0], analyzed)
+        self.assertEqual(self.relocatablize(), ([], []))
+
+    def test_replaced_file_redone(self):
+        self.relocatablize()
+        relative_path = os.path.join(
+            "Versions", "3.11", "lib", "python3.11", "lib-dynload",
+            "_synthetic0.cpython-311-darwin.so")
+        path = os.path.join(self.framework_path, relative_path)
+        os.unlink(path)
+        shutil.copy2(os.path.join(self.pristine, relative_path), path)
+        self.assertEqual(self.relocatablize(), ([path], [path]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for extracting cpio Payloads with locallibs.payload"""
+
+from __future__ import print_function
+
+import gzip
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from locallibs.payload import PayloadError, extract_payload
+
+MTIME = 1700000000
+
+
+def newc(entries):
+    """Returns a newc cpio archive of entries, each a (name, mode, data)
+    tuple"""
+    archive = []
+    for ino, (name, mode, data) in enumerate(
+            list(entries) + [("TRAILER!!!", 0, b"")], 1):
+        name = name.encode("UTF-8") + b"\0"
+        header = b"070701" + b"".join(
+            b"%08X" % value for value in (
+                ino, mode, 0, 0, 1, MTIME, len(data), 0, 0, 0, 0, len(name),
+                0))
+        archive.append(header + name + b"\0" * (-(110 + len(name)) % 4))
+        archive.append(data + b"\0" * (-len(data) % 4))
+    return b"".join(archive)
+
+
+def directory(name):
+    """Returns a directory entry"""
+    return (name, stat.S_IFDIR | 0o755, b"")
+
+
+def regular(name, data=b"data"):
+    """Returns a regular file entry"""
+    return (name, stat.S_IFREG | 0o644, data)
+
+
+def symlink(name, target):
+    """Returns a symlink entry"""
+    return (name, stat.S_IFLNK | 0o755, target.encode("UTF-8"))
+
+
+class TestExtract(unittest.TestCase):
+    """extract_payload, and what it refuses to write"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.destination = os.path.join(self.temp_dir, "Python.framework")
+        self.outside = os.path.join(self.temp_dir, "outside")
+        os.makedirs(self.outside)
+
+    def extract(self, entries):
+        """Extracts a gzipped Payload of entries into the destination"""
+        return extract_payload([gzip.compress(newc(entries))],
+                               self.destination)
+
+    def assert_outside_untouched(self):
+        """Checks nothing was written to the outside directory"""
+        self.assertEqual(os.listdir(self.outside), [])
+
+    def test_framework_layout(self):
+        count = self.extract([
+            directory("."),
+            directory("./Versions"),
+            directory("./Versions/3.11"),
+            regular("./Versions/3.11/Python", b"library"),
+            directory("./Versions/3.11/lib"),
+            symlink("./Versions/3.11/lib/libpython3.11.dylib", "../Python"),
+            symlink("./Versions/Current", "3.11"),
+            symlink("./Python", "Versions/Current/Python"),
+        ])
+        self.assertEqual(count, 8)
+        path = os.path.join(self.destination, "Python")
+        self.assertTrue(os.path.islink(path))
+        with open(path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"library")
+        with open(os.path.join(self.destination, "Versions", "3.11", "lib",
+                               "libpython3.11.dylib"), "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"library")
+        self.assertEqual(os.path.getmtime(path), MTIME)
+
+    def test_dot_dot_member(self):
+        with self.assertRaises(PayloadError):
+            self.extract([regular("./lib/../../outside/file")])
+        self.assert_outside_untouched()
+
+    def test_absolute_symlink(self):
+        with self.assertRaises(PayloadError):
+            self.extract([symlink("./escape", self.outside)])
+        self.assertFalse(os.path.lexists(
+            os.path.join(self.destination, "escape")))
+
+    def test_symlink_climbing_out(self):
+        for target in ("../../outside", "../lib/../../outside", "a/../b",
+                       "./../../outside"):
+            with self.assertRaises(PayloadError):
+                self.extract([directory("./lib"),
+                              symlink("./lib/escape", target)])
+        self.extract([directory("./lib"),
+                      symlink("./lib/sibling", "../Resources")])
+
+    def test_member_through_symlink_in_payload(self):
+        # a symlink that stays inside is fine, writing through it is not
+        with self.assertRaises(PayloadError) as context:
+            self.extract([
+                directory("./Versions/3.11"),
+                symlink("./Versions/Current", "3.11"),
+                regular("./Versions/Current/Python"),
+            ])
+        self.assertIn("through the symlink", str(context.exception))
+        self.assertEqual(
+            os.listdir(os.path.join(self.destination, "Versions", "3.11")),
+            [])
+
+    def test_member_through_existing_symlink(self):
+        # left behind in the destination by something else
+        os.makedirs(self.destination)
+        os.symlink(self.outside, os.path.join(self.destination, "lib"))
+        for entries in ([regular("./lib/file")],
+                        [regular("./lib/deeper/file")],
+                        [directory("./lib/deeper")],
+                        [symlink("./lib/link", "file")]):
+            with self.assertRaises(PayloadError):
+                self.extract(entries)
+            self.assert_outside_untouched()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.pipeline and how a failing fetch is retried"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from locallibs import get
+from locallibs.download import DownloadFailed
+from locallibs.payload import PayloadError
+from locallibs.pipeline import Pipeline
+
+
+class FlakyGetter(get.FrameworkGetter):
+    """A FrameworkGetter whose first downloads or extractions fail"""
+
+    def __init__(self, download_failures=0, extract_failures=0):
+        get.FrameworkGetter.__init__(self)
+        self.download_failures = download_failures
+        self.extract_failures = extract_failures
+        self.downloads = 0
+
+    def download(self):
+        self.downloads += 1
+        if self.download_failures:
+            self.download_failures -= 1
+            raise DownloadFailed("Connection dropped by the mirror")
+
+    def extract_framework(self):
+        os.makedirs(os.path.join(self.destination, "Versions"))
+        if self.extract_failures:
+            self.extract_failures -= 1
+            raise PayloadError("Truncated payload")
+
+
+class TestFetch(unittest.TestCase):
+    """A failing download or extraction fails the fetch step instead of
+    exiting, so the pipeline can retry it"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.destination = os.path.join(self.temp_dir, "Python.framework")
+
+    def fetch_pipeline(self, getter, retries):
+        """Returns a pipeline with a fetch step like Build.fetch"""
+        pipeline = Pipeline(os.path.join(self.temp_dir, "state.json"))
+
+        def fetch():
+            """Downloads and extracts the framework"""
+            framework_path = getter.download_and_extract(self.destination)
+            if not framework_path:
+                return False
+            pipeline.state["framework_path"] = framework_path
+            return True
+
+        pipeline.add("fetch", fetch, retries=retries)
+        pipeline.add("relocate", lambda: None, ["fetch"])
+        return pipeline
+
+    def test_failure_returns_none(self):
+        getter = FlakyGetter(download_failures=1)
+        self.assertIsNone(getter.download_and_extract(self.destination))
+
+    def test_failed_download_is_retried(self):
+        getter = FlakyGetter(download_failures=2)
+        pipeline = self.fetch_pipeline(getter, retries=2)
+        self.assertTrue(pipeline.run())
+        self.assertEqual(getter.downloads, 3)
+        self.assertEqual(pipeline.state["framework_path"], self.destination)
+
+    def test_partial_extraction_is_removed_before_retry(self):
+        getter = FlakyGetter(extract_failures=1)
+        pipeline = self.fetch_pipeline(getter, retries=1)
+        self.assertTrue(pipeline.run())
+        self.assertEqual(getter.downloads, 2)
+
+    def test_gives_up_after_retries(self):
+        getter = FlakyGetter(download_failures=3)
+        pipeline = self.fetch_pipeline(getter, retries=2)
+        self.assertFalse(pipeline.run())
+        self.assertEqual(getter.downloads, 3)
+        self.assertFalse(os.path.exists(self.destination))
+
+
+class TestPipeline(unittest.TestCase):
+    """Scheduling, retries and resuming"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, "state.json")
+
+    def test_requirements_run_first(self):
+        order = []
+        pipeline = Pipeline()
+        pipeline.add("b", lambda: order.append("b"), ["a"])
+        pipeline.add("a", lambda: order.append("a"))
+        pipeline.add("c", lambda: order.append("c"), ["b", "missing"])
+        self.assertTrue(pipeline.run())
+        self.assertEqual(order, ["a", "b", "c"])
+
+    def test_false_fails_and_stops_later_steps(self):
+        ran = []
+        pipeline = Pipeline()
+        pipeline.add("a", lambda: False)
+        pipeline.add("b", lambda: ran.append("b"), ["a"])
+        self.assertFalse(pipeline.run())
+        self.assertEqual(ran, [])
+
+    def test_resume_skips_completed_steps(self):
+        ran = []
+        pipeline = Pipeline(self.path, key="k")
+        pipeline.add("a", lambda: ran.append("a"))
+        pipeline.add("b", lambda: False, ["a"])
+        self.assertFalse(pipeline.run())
+
+        pipeline = Pipeline(self.path, key="k")
+        pipeline.add("a", lambda: ran.append("a"))
+        pipeline.add("b", lambda: ran.append("b"), ["a"])
+        self.assertEqual(pipeline.resume(), ["a"])
+        self.assertTrue(pipeline.run())
+        self.assertEqual(ran, ["a", "b"])
+
+    def test_resume_ignores_other_keys(self):
+        pipeline = Pipeline(self.path, key="k")
+        pipeline.add("a", lambda: None)
+        pipeline.add("b", lambda: False, ["a"])
+        pipeline.run()
+        pipeline = Pipeline(self.path, key="other")
+        pipeline.add("a", lambda: None)
+        self.assertEqual(pipeline.resume(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.precompile"""
+
+from __future__ import print_function
+
+import contextlib
+import importlib.util
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+from locallibs import precompile
+from tests.test_install import VERSION
+
+# pyc flags: hash-based, source not checked
+UNCHECKED_HASH = 0b01
+
+
+class TestPrecompile(unittest.TestCase):
+    """precompile with the python running the tests"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.framework_path = os.path.join(self.temp_dir, "Python.framework")
+        version_dir = os.path.join(self.framework_path, "Versions", VERSION)
+        os.makedirs(os.path.join(version_dir, "bin"))
+        os.symlink(sys.executable,
+                   os.path.join(version_dir, "bin", "python" + VERSION))
+        self.lib_dir = os.path.join(version_dir, "lib", "python" + VERSION)
+        self.sources = [
+            os.path.join(self.lib_dir, "stdmodule.py"),
+            os.path.join(self.lib_dir, "site-packages", "pkg", "__init__.py"),
+        ]
+        for path in self.sources:
+            os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fileobj:
+                fileobj.write("VALUE = 1\n")
+
+    def test_unchecked_hash_pycs(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(precompile.precompile(
+                self.framework_path, VERSION, levels=(0, 2)))
+        for path in self.sources:
+            for optimization in ("", 2):
+                pyc = importlib.util.cache_from_source(
+                    path, optimization=optimization)
+                with open(pyc, "rb") as fileobj:
+                    header = fileobj.read(16)
+                self.assertEqual(header[:4], importlib.util.MAGIC_NUMBER)
+                self.assertEqual(struct.unpack("<I", header[4:8])[0],
+                                 UNCHECKED_HASH, pyc)
+
+    def test_parse_levels(self):
+        self.assertEqual(precompile.parse_levels("2,0,2"), [0, 2])
+        for text in ("", "3", "0,x"):
+            with self.assertRaises(ValueError):
+                precompile.parse_levels(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
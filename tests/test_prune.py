@@ -0,0 +1,114 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.prune"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from locallibs import prune
+from locallibs.inventory import Inventory
+
+# files below Versions/3.11, each with the component that removes it
+FILES = {
+    "lib/python3.11/test/test_os.py": "tests",
+    "lib/python3.11/json/tests/test_json.py": "tests",
+    "lib/python3.11/idlelib/idle_test/test_idle.py": "tests",
+    "bin/idle3.11": "idle",
+    "lib/python3.11/idlelib/__init__.py": "idle",
+    "lib/python3.11/tkinter/__init__.py": "tkinter",
+    "lib/python3.11/turtle.py": "tkinter",
+    "lib/python3.11/lib-dynload/_tkinter.cpython-311-darwin.so": "tkinter",
+    "lib/libtcl8.6.dylib": "tkinter",
+    "lib/tk8.6/tk.tcl": "tkinter",
+    "lib/python3.11/ensurepip/__init__.py": "ensurepip",
+    "lib/libpython3.11.a": "static-libs",
+    "lib/python3.11/config-3.11-darwin/libpython3.11.a": "static-libs",
+    "lib/python3.11/__pycache__/os.cpython-311.opt-1.pyc": "optimized-pycs",
+    "lib/python3.11/__pycache__/os.cpython-311.opt-2.pyc": "optimized-pycs",
+    "bin/python3.11": None,
+    "lib/python3.11/os.py": None,
+    "lib/python3.11/json/__init__.py": None,
+    "lib/python3.11/turtledemo.txt": None,
+    "lib/python3.11/__pycache__/os.cpython-311.pyc": None,
+    "lib/python3.11/lib-dynload/_json.cpython-311-darwin.so": None,
+    "lib/python3.11/config-3.11-darwin/Makefile": None,
+}
+
+
+class TestPrune(unittest.TestCase):
+    """Each profile removes exactly its components"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def framework(self, name):
+        """Writes every file in FILES into a new framework and returns its
+        path"""
+        framework_path = os.path.join(self.temp_dir, name, "Python.framework")
+        for relative_path in FILES:
+            path = os.path.join(framework_path, "Versions", "3.11",
+                                relative_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as fileobj:
+                fileobj.write(relative_path)
+        return framework_path
+
+    def remaining(self, framework_path):
+        """Returns the files left below Versions/3.11"""
+        version_dir = os.path.join(framework_path, "Versions", "3.11")
+        found = set()
+        for dirpath, _dirs, files in os.walk(version_dir):
+            found.update(os.path.relpath(os.path.join(dirpath, filename),
+                                         version_dir)
+                         for filename in files)
+        return found
+
+    def test_profiles(self):
+        for profile in sorted(prune.PROFILES):
+            framework_path = self.framework(profile)
+            inventory = Inventory(framework_path)
+            components = prune.components_for(profile)
+            with contextlib.redirect_stdout(io.StringIO()):
+                prune.prune(framework_path, "3.11", components, inventory)
+            self.assertEqual(
+                self.remaining(framework_path),
+                set(relative_path for relative_path, component
+                    in FILES.items() if component not in components),
+                profile)
+            # the inventory was kept up to date
+            self.assertEqual(
+                sorted(entry.path for entry in inventory.files(
+                    framework_path)),
+                sorted(entry.path for entry in Inventory(
+                    framework_path).files(framework_path)))
+
+    def test_every_component_covered(self):
+        self.assertEqual(set(FILES.values()) - set([None]),
+                         set(prune.COMPONENTS))
+        self.assertEqual(set(prune.PROFILES["minimal"]),
+                         set(prune.COMPONENTS))
+
+
+if __name__ == "__main__":
+    unittest.main()
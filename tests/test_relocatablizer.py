@@ -0,0 +1,113 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.relocatablizer, on generated frameworks"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark_relocatable_python import scan_plan_edits
+from locallibs import relocatablizer, synthetic
+from locallibs.relocationplan import RelocationPlan
+
+
+def read_tree(directory):
+    """Returns the contents of every file below directory, by relative
+    path"""
+    contents = {}
+    for dirpath, _dirs, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as fileobj:
+                contents[os.path.relpath(path, directory)] = fileobj.read()
+    return contents
+
+
+def as_dicts(plans):
+    """Returns plans, a RewritePlan per path, as plain dicts"""
+    return dict((path, plan.as_dict()) for path, plan in plans.items())
+
+
+class TestPlanEdits(unittest.TestCase):
+    """plan_edits against the scan of every file it replaced"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def analyze(self, name, **kwargs):
+        """Generates a framework in the name directory and returns what
+        analyze() finds in it"""
+        framework_path = synthetic.generate(
+            os.path.join(self.temp_dir, name), stdlib_files=0, scripts=0,
+            text_size=1024, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return relocatablizer.analyze(framework_path)
+
+    def test_index_matches_scan(self):
+        for links_per_file in (0, 2, 12):
+            framework_data = self.analyze(
+                str(links_per_file), dylibs=40, so_files=60,
+                links_per_file=links_per_file, seed=links_per_file)
+            plans, renames = relocatablizer.plan_edits(framework_data)
+            self.assertEqual(as_dicts(plans),
+                             as_dicts(scan_plan_edits(framework_data)))
+            # the Python library and every dylib are renamed
+            self.assertEqual(len(renames), 41)
+
+
+class TestRelocationPlan(unittest.TestCase):
+    """Writing a relocation plan and applying it to another copy"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.pristine = synthetic.generate(
+            os.path.join(self.temp_dir, "pristine"), dylibs=5, so_files=20,
+            stdlib_files=0, scripts=0, text_size=1024)
+
+    def copy(self, name):
+        """Returns a fresh copy of the generated framework"""
+        framework_path = os.path.join(self.temp_dir, name, "Python.framework")
+        shutil.copytree(self.pristine, framework_path, symlinks=True)
+        return framework_path
+
+    def test_round_trip(self):
+        plan_path = os.path.join(self.temp_dir, "plan.json")
+        planned = self.copy("planned")
+        applied = self.copy("applied")
+        with contextlib.redirect_stdout(io.StringIO()):
+            relocatablized = relocatablizer.relocatablize(
+                planned, plan_path=plan_path)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            rewritten = relocatablizer.apply_relocation(
+                applied, RelocationPlan.load(plan_path))
+        self.assertIn("0 other Mach-O files were analyzed", output.getvalue())
+        self.assertEqual(
+            sorted(os.path.relpath(path, applied) for path in rewritten),
+            sorted(os.path.relpath(path, planned) for path in relocatablized))
+        self.assertEqual(read_tree(applied), read_tree(planned))
+        self.assertNotEqual(read_tree(applied), read_tree(self.pristine))
+
+
+if __name__ == "__main__":
+    unittest.main()
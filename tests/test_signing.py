@@ -0,0 +1,194 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.signing against signatures made by codesign"""
+
+from __future__ import print_function
+
+import errno
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import macho, signing, synthetic
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+ARCHS = ("arm64", "x86_64")
+
+
+def fixture(name):
+    """Returns the contents of a fixture"""
+    with open(os.path.join(FIXTURES, name), "rb") as fileobj:
+        return fileobj.read()
+
+
+def blobs(superblob):
+    """Returns the blobs of a SuperBlob by slot"""
+    _magic, _length, count = struct.unpack_from(">3I", superblob)
+    found = {}
+    for index in range(count):
+        slot, offset = struct.unpack_from(">2I", superblob, 12 + index * 8)
+        length = struct.unpack_from(">I", superblob, offset + 4)[0]
+        found[slot] = superblob[offset:offset + length]
+    return found
+
+
+def embedded_signatures(data):
+    """Returns the signature SuperBlob of each slice of a Mach-O image"""
+    signatures = []
+    for slice_info in macho.parse(data).slices:
+        _cmd_offset, dataoff, datasize = slice_info.code_signature
+        start = slice_info.offset + dataoff
+        length = struct.unpack_from(">I", data, start + 4)[0]
+        signatures.append(data[start:start + min(length, datasize)])
+    return signatures
+
+
+class TestSigning(unittest.TestCase):
+    """sign() against the codesign signatures of the fixtures"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def write(self, name, data):
+        """Writes data to a file in the temp dir and returns its path"""
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "wb") as fileobj:
+            fileobj.write(data)
+        return path
+
+    def signed(self, name, data):
+        """Returns data after sign() has signed it"""
+        path = self.write(name, data)
+        signing.sign(path)
+        with open(path, "rb") as fileobj:
+            return fileobj.read()
+
+    def assert_page_hashes_match(self, data):
+        """Checks each slice's code hashes against its pages"""
+        for slice_info, signature in zip(macho.parse(data).slices,
+                                         embedded_signatures(data)):
+            code_directory = blobs(signature)[signing.CSSLOT_CODEDIRECTORY]
+            (hash_offset, _ident_offset, _n_special, n_code_slots,
+             code_limit) = struct.unpack_from(">5I", code_directory, 16)
+            self.assertEqual(n_code_slots,
+                             -(-code_limit // signing.PAGE_SIZE))
+            for index in range(n_code_slots):
+                start = slice_info.offset + index * signing.PAGE_SIZE
+                end = min(start + signing.PAGE_SIZE,
+                          slice_info.offset + code_limit)
+                offset = hash_offset + index * signing.HASH_SIZE
+                self.assertEqual(
+                    code_directory[offset:offset + signing.HASH_SIZE],
+                    hashlib.sha256(data[start:end]).digest())
+
+    def test_code_directory_matches_codesign(self):
+        for arch in ARCHS:
+            name = "libXau.6.0.0-%s" % arch
+            expected = blobs(fixture(name + ".codesign"))
+            data = self.signed(name + ".dylib", fixture(name + ".dylib"))
+            found = blobs(embedded_signatures(data)[0])
+            self.assertEqual(
+                found[signing.CSSLOT_CODEDIRECTORY],
+                expected[signing.CSSLOT_CODEDIRECTORY], arch)
+
+    def test_signature_matches_codesign(self):
+        for arch in ARCHS:
+            name = "libXau.6.0.0-%s" % arch
+            data = self.signed(name + ".dylib", fixture(name + ".dylib"))
+            self.assertEqual(embedded_signatures(data)[0],
+                             fixture(name + ".codesign"), arch)
+            # nothing else in the file changed either
+            self.assertEqual(data, fixture(name + ".dylib"), arch)
+
+    def test_signing_twice_gives_same_result(self):
+        data = synthetic.mach_o(True, macho.MH_DYLIB, "/tmp/libtwice.dylib",
+                                [synthetic.LIBSYSTEM])
+        once = self.signed("libtwice.dylib", data)
+        twice = self.signed("libtwice.dylib", once)
+        self.assertEqual(once, twice)
+
+    def test_fat_slices_match_codesign(self):
+        data = synthetic.fat_image([
+            (macho.CPU_TYPES[arch], fixture("libXau.6.0.0-%s.dylib" % arch))
+            for arch in ARCHS])
+        signed = self.signed("libXau.6.0.0.dylib", data)
+        for arch, signature in zip(ARCHS, embedded_signatures(signed)):
+            self.assertEqual(
+                blobs(signature)[signing.CSSLOT_CODEDIRECTORY],
+                blobs(fixture("libXau.6.0.0-%s.codesign" % arch))[
+                    signing.CSSLOT_CODEDIRECTORY], arch)
+
+    def test_unsigned_file_is_signed(self):
+        data = synthetic.mach_o(True, macho.MH_EXECUTE,
+                                dependencies=[synthetic.LIBSYSTEM])
+        signed = self.signed("tool", data)
+        self.assert_page_hashes_match(signed)
+        for slice_info, signature in zip(macho.parse(signed).slices,
+                                         embedded_signatures(signed)):
+            self.assertEqual(
+                signing.existing_identity(signed, slice_info),
+                ("tool", signing.CS_ADHOC))
+            self.assertEqual(blobs(signature)[signing.CSSLOT_REQUIREMENTS],
+                             signing.EMPTY_REQUIREMENTS)
+            linkedit = [segment for segment in slice_info.segments
+                        if segment.name == "__LINKEDIT"][0]
+            _cmd_offset, dataoff, datasize = slice_info.code_signature
+            self.assertEqual(linkedit.fileoff + linkedit.filesize,
+                             dataoff + datasize)
+
+    def test_rewritten_file_is_signed_again(self):
+        path = self.write("libXau.6.0.0.dylib",
+                          fixture("libXau.6.0.0-arm64.dylib"))
+        plan = macho.RewritePlan()
+        plan.set_install_name("@rpath/lib/libXau.6.dylib")
+        self.assertTrue(macho.rewrite(path, plan))
+        signing.sign(path)
+        with open(path, "rb") as fileobj:
+            data = fileobj.read()
+        self.assert_page_hashes_match(data)
+        self.assertEqual(macho.parse(data).slices[0].install_name,
+                         "@rpath/lib/libXau.6.dylib")
+        self.assertEqual(
+            signing.existing_identity(data, macho.parse(data).slices[0]),
+            ("libXau.6", signing.CS_ADHOC))
+
+    def test_failed_write_is_cleaned_up(self):
+        data = synthetic.mach_o(False, macho.MH_EXECUTE,
+                                dependencies=[synthetic.LIBSYSTEM])
+        path = self.write("tool", data)
+
+        def write_some(fileobj, _data, _plan):
+            """Writes part of the slice, then runs out of space"""
+            fileobj.write(b"partial")
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        with mock.patch.object(signing, "_write_slice", write_some):
+            with self.assertRaises(OSError):
+                signing.sign(path)
+        self.assertEqual(os.listdir(self.temp_dir), ["tool"])
+        with open(path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
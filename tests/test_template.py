@@ -0,0 +1,209 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.clone and the template cache in locallibs.template"""
+
+from __future__ import print_function
+
+import contextlib
+import errno
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import clone
+from locallibs.clone import TreeCloner
+from locallibs.manifest import Manifest
+from locallibs.template import TemplateCache
+
+URL = "https://www.python.org/ftp/python/3.11.9/python-3.11.9-macos11.pkg"
+
+
+def write(path, data, mode=0o644):
+    """Writes data to path, making its directory, and sets its mode"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as fileobj:
+        fileobj.write(data)
+    os.chmod(path, mode)
+
+
+def make_tree(root):
+    """Writes a small framework-like tree below root"""
+    write(os.path.join(root, "Versions", "3.11", "Python"), b"library",
+          0o755)
+    write(os.path.join(root, "Versions", "3.11", "bin", "pip3"), b"script",
+          0o755)
+    write(os.path.join(root, "Versions", "3.11", "lib", "python3.11",
+                       "site-packages", "README.txt"), b"readme")
+    os.symlink("3.11", os.path.join(root, "Versions", "Current"))
+
+
+class TestTreeCloner(unittest.TestCase):
+    """Cloning trees without copy-on-write support"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.src = os.path.join(self.temp_dir, "src")
+        self.dst = os.path.join(self.temp_dir, "dst")
+        make_tree(self.src)
+
+    def cloner(self, may_hardlink=None):
+        """Returns a TreeCloner that never tries to reflink"""
+        cloner = TreeCloner(may_hardlink)
+        cloner.use_reflink = False
+        cloner._clonefile = None
+        return cloner
+
+    def same_file(self, relative_path):
+        """Returns a boolean to indicate if relative_path is the same
+        inode in the source and the clone"""
+        return os.path.samefile(os.path.join(self.src, relative_path),
+                                os.path.join(self.dst, relative_path))
+
+    def test_copies_by_default(self):
+        cloner = self.cloner()
+        cloner.clone_tree(self.src, self.dst)
+        self.assertEqual(cloner.counts,
+                         {"reflink": 0, "hardlink": 0, "copy": 3})
+        self.assertFalse(self.same_file("Versions/3.11/Python"))
+        self.assertEqual(os.readlink(
+            os.path.join(self.dst, "Versions", "Current")), "3.11")
+        path = os.path.join(self.dst, "Versions", "3.11", "Python")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o755)
+        with open(path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"library")
+
+    def test_hardlinks(self):
+        cloner = self.cloner(lambda path: os.path.basename(path) == "Python")
+        cloner.clone_tree(self.src, self.dst)
+        self.assertEqual(cloner.counts,
+                         {"reflink": 0, "hardlink": 1, "copy": 2})
+        self.assertTrue(self.same_file("Versions/3.11/Python"))
+        self.assertFalse(self.same_file("Versions/3.11/bin/pip3"))
+
+    def test_hardlink_falls_back_to_copy(self):
+        cloner = self.cloner(lambda path: True)
+        with mock.patch.object(
+                os, "link",
+                side_effect=OSError(errno.EXDEV, "cross-device link")):
+            cloner.clone_tree(self.src, self.dst)
+        self.assertEqual(cloner.counts,
+                         {"reflink": 0, "hardlink": 0, "copy": 3})
+        self.assertFalse(self.same_file("Versions/3.11/Python"))
+
+    def test_read_only_directory(self):
+        bin_dir = os.path.join(self.src, "Versions", "3.11", "bin")
+        os.chmod(bin_dir, 0o555)
+        self.addCleanup(os.chmod, bin_dir, 0o755)
+        self.cloner().clone_tree(self.src, self.dst)
+        cloned_bin_dir = os.path.join(self.dst, "Versions", "3.11", "bin")
+        self.addCleanup(os.chmod, cloned_bin_dir, 0o755)
+        self.assertEqual(os.stat(cloned_bin_dir).st_mode & 0o777, 0o555)
+        self.assertTrue(os.path.exists(os.path.join(cloned_bin_dir, "pip3")))
+
+    @unittest.skipIf(clone.fcntl is None, "needs fcntl")
+    def test_unsupported_reflink_stops_trying(self):
+        cloner = TreeCloner()
+        cloner._clonefile = None
+        with mock.patch.object(
+                clone.fcntl, "ioctl",
+                side_effect=OSError(errno.EOPNOTSUPP, "not supported")) \
+                as ioctl:
+            cloner.clone_tree(self.src, self.dst)
+        self.assertEqual(ioctl.call_count, 1)
+        self.assertFalse(cloner.use_reflink)
+        self.assertEqual(cloner.counts["copy"], 3)
+
+
+class TestTemplateCache(unittest.TestCase):
+    """Storing and restoring templates"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache = TemplateCache(os.path.join(self.temp_dir, "templates"))
+        self.framework_path = os.path.join(
+            self.temp_dir, "build", "Python.framework")
+        make_tree(self.framework_path)
+        manifest = Manifest(self.framework_path)
+        manifest.record(os.path.join(
+            self.framework_path, "Versions", "3.11", "Python"), None)
+        manifest.save()
+        self.key = TemplateCache.key(URL, True)
+
+    def quietly(self, func, *args):
+        """Calls func with args, hiding its output"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+
+    def test_key(self):
+        self.assertEqual(self.key, TemplateCache.key(URL, True))
+        self.assertNotEqual(self.key, TemplateCache.key(URL, False))
+        self.assertNotEqual(
+            self.key, TemplateCache.key(URL, True, native_signing=True))
+        self.assertNotEqual(
+            self.key, TemplateCache.key(URL, True, pruned=["idle"]))
+        self.assertNotEqual(
+            self.key, TemplateCache.key(URL, True, archs=[16777228]))
+
+    def test_miss(self):
+        destination = os.path.join(self.temp_dir, "out", "Python.framework")
+        self.assertFalse(self.quietly(
+            self.cache.restore, self.key, destination))
+        self.assertFalse(os.path.exists(destination))
+
+    def test_hit(self):
+        self.quietly(self.cache.store, self.key, self.framework_path)
+        destination = os.path.join(self.temp_dir, "out", "Python.framework")
+        self.assertTrue(self.quietly(
+            self.cache.restore, self.key, destination))
+        with open(os.path.join(destination, "Versions", "3.11", "bin",
+                               "pip3"), "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"script")
+        manifest = Manifest(destination)
+        self.assertEqual(manifest.framework_path, destination)
+        self.assertEqual(list(manifest.entries),
+                         [os.path.join("Versions", "3.11", "Python")])
+        # a different key or an existing destination is a miss
+        self.assertFalse(self.quietly(
+            self.cache.restore, TemplateCache.key(URL, False),
+            os.path.join(self.temp_dir, "other", "Python.framework")))
+        self.assertFalse(self.quietly(
+            self.cache.restore, self.key, destination))
+
+    def test_store_keeps_first_template(self):
+        self.quietly(self.cache.store, self.key, self.framework_path)
+        # replaced, not written in place, as the template may share it
+        path = os.path.join(self.framework_path, "Versions", "3.11", "Python")
+        os.unlink(path)
+        write(path, b"changed", 0o755)
+        self.quietly(self.cache.store, self.key, self.framework_path)
+        destination = os.path.join(self.temp_dir, "out", "Python.framework")
+        self.quietly(self.cache.restore, self.key, destination)
+        with open(os.path.join(destination, "Versions", "3.11", "Python"),
+                  "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"library")
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)),
+                         [self.key])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.trace"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+from locallibs import trace
+
+
+class TestTrace(unittest.TestCase):
+    """write_trace with a fresh recorder"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        patcher = mock.patch.object(trace, "RECORDER", trace.Recorder())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self):
+        """Records a nested phase, file work on two threads and a
+        subprocess"""
+        def work(path):
+            with trace.file_work("analyze", path):
+                pass
+
+        with trace.phase("relocate"):
+            with trace.phase("analyze"):
+                threads = [threading.Thread(target=work, args=(path,))
+                           for path in ("/f/libfoo.dylib", "/f/libbar.dylib")]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            trace.check_output([sys.executable, "-c", "pass"])
+
+    def write(self):
+        """Writes the trace and returns it loaded"""
+        path = os.path.join(self.temp_dir, "trace.json")
+        trace.write_trace(path)
+        with open(path) as fileobj:
+            return json.load(fileobj)
+
+    def test_chrome_trace(self):
+        trace.start_trace()
+        self.record()
+        data = self.write()
+        self.assertEqual(data["displayTimeUnit"], "ms")
+        events = data["traceEvents"]
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            for field in ("ts", "dur", "pid", "tid"):
+                self.assertIsInstance(event[field], int)
+            self.assertGreaterEqual(event["ts"], 0)
+            self.assertGreaterEqual(event["dur"], 0)
+        self.assertEqual(
+            sorted((event["cat"], event["name"]) for event in events),
+            [("analyze", "libbar.dylib"), ("analyze", "libfoo.dylib"),
+             ("phase", "analyze"), ("phase", "relocate"),
+             ("subprocess", os.path.basename(sys.executable))])
+        phases = dict((event["name"], event) for event in events
+                      if event["cat"] == "phase")
+        outer, inner = phases["relocate"], phases["analyze"]
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertLessEqual(inner["ts"] + inner["dur"],
+                             outer["ts"] + outer["dur"] + 1)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            trace.summary()
+        self.assertIn("  analyze", output.getvalue())
+
+    def test_no_events_unless_tracing(self):
+        self.record()
+        self.assertEqual(self.write()["traceEvents"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
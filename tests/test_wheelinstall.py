@@ -0,0 +1,119 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for installing wheels directly with locallibs.wheelinstall"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+from locallibs import wheelinstall
+from tests.test_install import VERSION, make_wheel
+
+
+class TestInstallWheels(unittest.TestCase):
+    """install_wheels into a framework whose python is the one running the
+    tests"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.framework_path = os.path.join(self.temp_dir, "Python.framework")
+        bin_dir = os.path.join(self.framework_path, "Versions", VERSION, "bin")
+        os.makedirs(bin_dir)
+        os.symlink(sys.executable, os.path.join(bin_dir, "python" + VERSION))
+        self.site_packages = wheelinstall.Scheme(
+            self.framework_path, VERSION).site_packages
+
+    def install(self, filenames, jobs=1):
+        """Installs the wheels quietly and returns the leftover ones"""
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            return wheelinstall.install_wheels(
+                self.framework_path, VERSION,
+                [os.path.join(self.temp_dir, filename)
+                 for filename in filenames], jobs=jobs)
+
+    def installed_files(self):
+        """Returns the files below site-packages, relative to it"""
+        found = []
+        for dirpath, _dirs, files in os.walk(self.site_packages):
+            found.extend(
+                os.path.relpath(os.path.join(dirpath, filename),
+                                self.site_packages)
+                for filename in files)
+        return sorted(found)
+
+    def test_shared_namespace_directory(self):
+        filenames = [
+            make_wheel(self.temp_dir, "part%d" % index, "1.0", {
+                "shared/part%d/__init__.py" % index: "",
+                "shared/part%d/deep/module.py" % index: "",
+            })
+            for index in range(16)]
+        self.assertEqual(self.install(filenames, jobs=8), [])
+        for index in range(16):
+            self.assertTrue(os.path.exists(os.path.join(
+                self.site_packages, "shared", "part%d" % index, "deep",
+                "module.py")))
+
+    def test_directory_created_by_another_wheel(self):
+        parent = os.path.join(self.temp_dir, "shared")
+        path = os.path.join(parent, "module.py")
+        isdir = os.path.isdir
+
+        def isdir_then_race(some_path):
+            """Another wheel makes parent right after it is checked"""
+            found = isdir(some_path)
+            if some_path == parent and not found:
+                os.mkdir(parent)
+            return found
+
+        with mock.patch.object(os.path, "isdir", isdir_then_race):
+            wheelinstall._write(path, b"value = 1\n")
+        with open(path, "rb") as fileobj:
+            self.assertEqual(fileobj.read(), b"value = 1\n")
+
+    def test_failed_wheel_is_removed_and_left_to_pip(self):
+        good = make_wheel(self.temp_dir, "good", "1.0")
+        bad = make_wheel(self.temp_dir, "bad", "1.0", {
+            "bad/__init__.py": "",
+            "bad/module.py": "",
+            "bad/zz/../../../escape.py": "",
+        })
+        leftover = self.install([good, bad])
+        self.assertEqual(leftover, [os.path.join(self.temp_dir, bad)])
+        # nothing of the failed wheel is left for pip to trip over
+        self.assertEqual(self.installed_files(), [
+            "good-1.0.dist-info/INSTALLER",
+            "good-1.0.dist-info/METADATA",
+            "good-1.0.dist-info/RECORD",
+            "good-1.0.dist-info/WHEEL",
+            "good/__init__.py",
+        ])
+        self.assertNotIn("bad", wheelinstall.installed_names(
+            self.site_packages))
+
+
+if __name__ == "__main__":
+    unittest.main()
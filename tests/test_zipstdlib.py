@@ -0,0 +1,88 @@
+# encoding: utf-8
+#
+# Copyright 2018 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for locallibs.zipstdlib"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from locallibs import zipstdlib
+from tests.test_install import VERSION
+
+
+class TestZipStdlib(unittest.TestCase):
+    """zip_stdlib on a small stdlib, precompiled with the python running
+    the tests"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.framework_path = os.path.join(self.temp_dir, "Python.framework")
+        version_dir = os.path.join(self.framework_path, "Versions", VERSION)
+        os.makedirs(os.path.join(version_dir, "bin"))
+        os.symlink(sys.executable,
+                   os.path.join(version_dir, "bin", "python" + VERSION))
+        self.lib_dir = os.path.join(version_dir, "lib", "python" + VERSION)
+        for name in ("os.py", "abc.py", "json/__init__.py",
+                     "json/decoder.py", "tkinter/__init__.py",
+                     "ensurepip/__init__.py", "site-packages/pkg.py",
+                     "lib-dynload/_json.so", "data/__init__.py",
+                     "data/table.txt"):
+            self.write(name)
+
+    def write(self, name):
+        """Writes a file in the stdlib"""
+        path = os.path.join(self.lib_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fileobj:
+            fileobj.write("VALUE = 1\n")
+
+    def exists(self, name):
+        """Returns a boolean to indicate if name is still in the stdlib"""
+        return os.path.exists(os.path.join(self.lib_dir, name))
+
+    def test_zip_stdlib(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(zipstdlib.zip_stdlib(self.framework_path,
+                                                 VERSION))
+        with zipfile.ZipFile(zipstdlib.zip_path(self.framework_path,
+                                                VERSION)) as archive:
+            names = sorted(archive.namelist())
+        self.assertEqual(names, [
+            "abc.py", "abc.pyc", "json/__init__.py", "json/__init__.pyc",
+            "json/decoder.py", "json/decoder.pyc", "os.py", "os.pyc"])
+        self.assertFalse(any(name.split("/")[0] in zipstdlib.EXCLUDED
+                             for name in names))
+        # the landmark stays, the rest of what was packed goes
+        self.assertTrue(self.exists(zipstdlib.LANDMARK))
+        self.assertFalse(self.exists("abc.py"))
+        self.assertFalse(self.exists("json"))
+        for name in ("tkinter/__init__.py", "ensurepip/__init__.py",
+                     "site-packages/pkg.py", "lib-dynload/_json.so",
+                     "data/table.txt"):
+            self.assertTrue(self.exists(name), name)
+
+
+if __name__ == "__main__":
+    unittest.main()